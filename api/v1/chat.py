@@ -1,5 +1,7 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 
+from core.ocr import ocr_flight
 from services.llm import chat_service
 
 router = APIRouter()
@@ -12,3 +14,23 @@ async def generate_response(question: str, context: str):
     """
     result = await chat_service.chat(question, context)
     return result
+
+
+@router.get("/stats")
+async def stats():
+    """
+    模型请求统计 \n
+    :return: \n
+    script: \n
+        limiter：当前并发上限、执行中的请求数、延迟基线 \n
+        endpoints：各实例的权重、执行中的请求数、请求数、失败数、是否暂停使用、平均延迟 \n
+        coalescing：相同图片合并识别的统计，calls 实际调用模型的次数，coalesced 合并到已有调用的次数 \n
+    """
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": {**chat_service.stats(), "coalescing": ocr_flight.stats()}
+        }
+    )
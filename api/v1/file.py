@@ -1,19 +1,21 @@
-import asyncio
-import io
 import os
 import re
 
 import fitz
 from PIL import Image
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi import UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from config.config import settings
-from core.file import pdf_ocr_service, get_status
-from core.tools import verify_file_type, read_text_file, process_str, save_file, delete_dir, read_md
+from core.file import get_status, get_file_status, file_event_stream, submit_pdf
+from core.result import get_result_file, read_result_range, read_page_index, result_file_response
+from core.tools import verify_file_type, read_text_file, save_file, delete_dir, read_md, iter_md, iter_body, iter_str, \
+    markdown_response
 from schemas.util import ResponseModel
 from services.db_token import db
+from services.file_state import file_state
+from services.job_queue import job_queue
 from services.llm import chat_service
 
 router = APIRouter()
@@ -36,10 +38,14 @@ async def init(user_id: str = ""):
             }
         )
     try:
+        # 取消排队中的任务
+        await job_queue.cancel_user_jobs(user_id)
         # 清空用户缓存文件
         await delete_dir(f"{settings.UPLOAD_DIR}/{user_id}")
         # 清空token记录
         await db.delete_token_record(user_id)
+        # 清空文件状态
+        await file_state.delete_user(user_id)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -59,14 +65,16 @@ async def init(user_id: str = ""):
 
 
 @router.post("/upload", response_model=ResponseModel)
-async def upload_file(file: UploadFile = File(...), user_id: str = ""):
+async def upload_file(request: Request, file: UploadFile = File(...), user_id: str = ""):
     """
     上传文件 \n
+    :param request: 请求头 PROFILE_HEADER（默认 X-Profile）为 1 时对该文档的处理做性能分析 \n
     :param file: \n
     :param user_id: \n
     :return: \n
     script: \n
         更新：如果上传的文件名存在同名的，会删掉旧文件，并清除旧文件的清洗结果 \n
+        更新：内容相同的文档（包括其他用户上传的）已清洗完成时直接复用结果，上传后状态即为已完成；正在清洗时等待其完成后复用 \n
         因为状态码为2，表示清洗完成，为了避免出现问题，建议每次上传文件后都调用查状态接口，这样前面清洗完成了，再上传一个同名文件，就不会出现状态错误的问题
     """
     if not file:
@@ -100,10 +108,13 @@ async def upload_file(file: UploadFile = File(...), user_id: str = ""):
             }
         )
     try:
+        # 队列已满或同名文件正在处理时拒绝上传
+        await job_queue.check_capacity()
+        await job_queue.check_not_running(user_id, os.path.splitext(file.filename)[0])
         # 保存文件
-        file_path = await save_file(file, user_id)
-        # 开启异步线程执行任务
-        asyncio.create_task(pdf_ocr_service(file_path, user_id))
+        file_path, sha256, _ = await save_file(file, user_id)
+        # 相同内容的文档已处理过时直接复用结果，否则加入任务队列，由后台工作协程处理
+        await submit_pdf(file_path, user_id, sha256, request.headers.get(settings.PROFILE_HEADER) == "1")
         return JSONResponse(
             status_code=200,
             content={
@@ -132,13 +143,15 @@ async def upload_file(file: UploadFile = File(...), user_id: str = ""):
 
 
 @router.get("/status")
-async def status(user_id: str = ""):
+async def status(user_id: str = "", file_name: str = ""):
     """
     查询文件清洗状态 \n
     :param user_id: \n
+    :param file_name: 可选，不能携带文件后缀名，传入时只查询该文件 \n
     :return: \n
     script: \n
-        更新：添加一个参数：status_type --> 0 未开始（没有该用户的缓存数据），1 进行中(有数据未清洗完成)，2 已完成（上传的文件已全部清洗完成）
+        更新：添加一个参数：status_type --> 0 未开始（没有该用户的缓存数据），1 进行中(有数据未清洗完成)，2 已完成（上传的文件已全部处理结束，失败的文件见 files 中的 error）\n
+        files：各文件的详细状态，state --> queued 排队中，rendering 渲染中，recognizing 识别中（pages_done/pages_total），done 已完成，failed 失败
     """
     if not user_id or user_id == "" or user_id is None or user_id == " ":
         return JSONResponse(
@@ -150,8 +163,31 @@ async def status(user_id: str = ""):
             }
         )
     try:
+        if file_name:
+            # 查询单个文件
+            file_status = await get_file_status(user_id, file_name)
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "code": 200,
+                    "message": "success",
+                    "data": {
+                        "user_id": user_id,
+                        **file_status
+                    }
+                }
+            )
         # 获取文件状态
-        status_type, result = await get_status(user_id)
+        status_type, result, files = await get_status(user_id)
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "code": e.status_code,
+                "message": e.detail,
+                "data": " "
+            }
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -170,12 +206,58 @@ async def status(user_id: str = ""):
                 "user_id": user_id,
                 "status_type": status_type,
                 "status": result,
+                "files": files,
             }
             # "data": {"status": status}
         }
     )
 
 
+@router.get("/stream")
+async def stream(user_id: str = "", file_name: str = ""):
+    """
+    订阅文档处理进度（Server-Sent Events），参数不能带文件后缀名 \n
+    :param user_id: \n
+    :param file_name: 不能携带文件后缀名 \n
+    :return: \n
+    事件类型：\n
+        progress：处理进度 {"done": 已完成页数, "total": 总页数, "tokens": 已消耗token数, "reused_tokens": 复用token数} \n
+        page：单页结果 {"page": 页码, "route": 处理方式, "tokens": token数, "reused_tokens": 复用token数, "markdown": 内容} \n
+        delta：模型流式输出，需开启 LLM_STREAM {"page": 页码, "text": 文本片段} \n
+        done：处理完成 {"tokens": 总token数, "reused_tokens": 复用token数}，完整结果通过 /getfile 获取 \n
+        命中识别缓存或与其他请求合并的页面不消耗 token，原始消耗记在 reused_tokens 中 \n
+        retry：处理失败，等待重试 {"attempt": 已执行次数, "max_attempts": 最多执行次数, "delay": 重试前等待秒数, "message": 错误信息} \n
+        error：最终处理失败 {"message": 错误信息} \n
+        页面可能乱序到达，按 page 排序即可
+    """
+    if not user_id or user_id == " " or user_id == "" or user_id is None:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "code": 400,
+                "message": "用户ID错误",
+                "data": " "
+            }
+        )
+    if not file_name or file_name == " " or file_name == "" or file_name is None:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "code": 400,
+                "message": "文件错误",
+                "data": " "
+            }
+        )
+    return StreamingResponse(
+        file_event_stream(user_id, file_name),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @router.get("/token")
 async def get_token(user_id: str = ""):
     """
@@ -216,12 +298,82 @@ async def get_token(user_id: str = ""):
         }
     )
 
+@router.get("/pages")
+async def get_pages(user_id: str = "", file_name: str = ""):
+    """
+    查询文档每页的处理方式，参数不能带文件后缀名 \n
+    :param user_id: \n
+    :param file_name: 不能携带文件后缀名 \n
+    :return: \n
+    返回示例：\n
+        [ \n
+            {"page": 1, "route": "text", "tokens": 0},\n
+            {"page": 2, "route": "vlm", "tokens": 1200}\n
+        ] \n
+        route：text 直接提取文本层，vlm 调用模型识别
+    """
+    if not user_id or user_id == " " or user_id == "" or user_id is None:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "code": 400,
+                "message": "用户ID错误",
+                "data": " "
+            }
+        )
+    if not file_name or file_name == " " or file_name == "" or file_name is None:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "code": 400,
+                "message": "文件错误",
+                "data": " "
+            }
+        )
+    try:
+        result = await db.list_page_records(user_id, file_name)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "code": 500,
+                "message": f"服务器内部错误: {str(e)}"
+            }
+        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "message": "success",
+            "data": result
+        }
+    )
+
+
 @router.get("/getfile")
-async def get_md(user_id: str = "", file_name: str = ""):
+async def get_md(
+        request: Request, user_id: str = "", file_name: str = "", page: int | None = None,
+        page_size: int | None = None, offset: int | None = None, length: int | None = None, cursor: str = "",
+        raw: bool = False, index: bool = False
+):
     """
     获取文件内容，参数不能带文件后缀名 \n
+    只传 user_id 和 file_name 时返回全部内容；大文档可以分段获取： \n
+    - page、page_size：按页获取，data 为这几页的内容 \n
+    - offset、length：按字节获取，范围会对齐到完整的字符 \n
+    - cursor：上一次返回的 next_cursor，继续获取下一段，没有后续内容时 next_cursor 为 null \n
+    - raw=true：直接返回结果文件，支持 Range 和 If-None-Match / If-Modified-Since 请求头 \n
+    - index=true：返回每页的字节范围，配合 raw 的 Range 请求只读取需要的页 \n
+    :param request:
     :param user_id: \n
     :param file_name: 不能携带文件后缀名 \n
+    :param page: 起始页码，从1开始 \n
+    :param page_size: 页数，默认 RESULT_PAGE_SIZE \n
+    :param offset: 起始字节位置 \n
+    :param length: 字节数，默认 RESULT_RANGE_BYTES \n
+    :param cursor: \n
+    :param raw: \n
+    :param index: \n
     :return:
     """
     if not user_id or user_id == " " or user_id == "" or user_id is None:
@@ -243,28 +395,66 @@ async def get_md(user_id: str = "", file_name: str = ""):
                 "tokens": 0
             }
         )
-    # 读文件
-    result = await read_md(file_name, user_id)
+    result_file = get_result_file(user_id, file_name)
+    if raw:
+        return await result_file_response(request, result_file, f"{file_name}.md")
+    if index:
+        return JSONResponse(
+            status_code=200,
+            content={
+                "code": 200,
+                "message": "success",
+                "data": await read_page_index(result_file)
+            }
+        )
+    if page is None and offset is None and not cursor:
+        # 读文件
+        result = await read_md(file_name, user_id)
+        tokens = await db.read_token_record(user_id, file_name)
+        return JSONResponse(
+            status_code=200,
+            content={
+                "code": 200,
+                "message": "success",
+                "data": result,
+                "tokens": tokens
+            }
+        )
+    part = await read_result_range(result_file, page, page_size, offset, length, cursor)
     tokens = await db.read_token_record(user_id, file_name)
     return JSONResponse(
         status_code=200,
         content={
             "code": 200,
             "message": "success",
-            "data": result,
-            "tokens": tokens
+            "data": "```markdown" + part["content"] + "```",
+            "tokens": tokens,
+            "range": part["range"],
+            "next_cursor": part["next_cursor"]
         }
     )
 
 
 @router.post("/download")
-async def download(pdf_str: str = ""):
+async def download(request: Request, pdf_str: str = "", user_id: str = "", file_name: str = ""):
     """
-    下载文件
+    下载文件，内容规范化后流式返回，按以下顺序取内容：
+    1. pdf_str 查询参数，内容较长时会超过 URL 长度限制，建议改用后两种方式
+    2. user_id 和 file_name，与 /getfile 相同，直接分块读取已保存的结果
+    3. 请求体，直接发送文本（text/plain 或 text/markdown）
+    :param request:
     :param pdf_str:
+    :param user_id:
+    :param file_name: 不带后缀名
     :return:
     """
-    if not pdf_str or pdf_str == " " or pdf_str == "" or pdf_str is None:
+    if pdf_str and pdf_str != " ":
+        return markdown_response(iter_str(pdf_str), "example.md")
+    if file_name and file_name != " ":
+        # 已保存的结果本身就是 Markdown，只去掉前后的 ```，不替换转义
+        return markdown_response(await iter_md(file_name, user_id), f"{file_name}.md", unescape=False)
+    chunks = await iter_body(request)
+    if chunks is None:
         return JSONResponse(
             status_code=400,
             content={
@@ -273,24 +463,4 @@ async def download(pdf_str: str = ""):
                 "data": " "
             }
         )
-    try:
-        file_stream = io.BytesIO(pdf_str.encode("utf-8"))
-        normalized_content = await process_str(pdf_str)
-        return StreamingResponse(
-            normalized_content,
-            media_type="text/markdown; charset=utf-8",
-            # media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": "attachment; filename=example.md",
-                "Content-Type": "text/markdown; charset=utf-8"
-            }
-        )
-    except Exception as e:
-        return JSONResponse(
-            status_code=500,
-            content={
-                "code": 500,
-                "message": f"服务器内部错误: {str(e)}",
-                "data": None
-            }
-        )
+    return markdown_response(chunks, "example.md")
@@ -1,25 +1,26 @@
-import io
 import os
 import re
 
 from PIL import Image
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi import UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from config.config import settings
-from core.tools import verify_file_type, read_text_file, process_str
-from core.image import image_ocr_service
+from core.tools import verify_file_type, read_text_file, iter_body, iter_str, markdown_response
+from core.image import image_ocr_service, collect_batch_images, image_batch_service
 from schemas.util import ResponseModel
+from services.events import format_sse, EVENT_RESULT, EVENT_DONE
 from services.llm import chat_service
 
 router = APIRouter()
 
 
 @router.post("/upload", response_model=ResponseModel)
-async def upload_image(image: UploadFile = File(...)):
+async def upload_image(request: Request, image: UploadFile = File(...)):
     """
     上传图片
+    :param request: 请求头 PROFILE_HEADER（默认 X-Profile）为 1 时对本次识别做性能分析
     :param image:
     :return:
     """
@@ -43,7 +44,7 @@ async def upload_image(image: UploadFile = File(...)):
             }
         )
     try:
-        result = await image_ocr_service(image)
+        result = await image_ocr_service(image, request.headers.get(settings.PROFILE_HEADER) == "1")
         return JSONResponse(
             status_code=200,
             content={
@@ -72,50 +73,95 @@ async def upload_image(image: UploadFile = File(...)):
         )
 
 
-@router.post("/download")
-async def download(image_str: str = ""):
+@router.post("/batch")
+async def upload_image_batch(request: Request, stream: bool = False):
     """
-    下载文件
-    :param image_str:
+    批量上传图片，multipart 表单中的所有文件都会识别（字段名不限），zip 压缩包中的每个文件作为一张图片 \n
+    最多 IMAGE_BATCH_MAX_FILES 张，同时识别 IMAGE_BATCH_CONCURRENCY 张；单张失败不影响其他图片，失败的图片 code 不为 200 \n
+    :param request: 请求头 PROFILE_HEADER（默认 X-Profile）为 1 时对本次识别做性能分析 \n
+    :param stream: false 时全部完成后按上传顺序返回；true 时以 SSE 按完成顺序逐张推送 result 事件，最后推送 done 事件 \n
     :return:
     """
-    if not image_str or image_str == " " or image_str == "" or image_str is None:
+    # 流式返回时表单在响应结束后才关闭，不能使用 File 参数（处理函数返回时即关闭）
+    form = await request.form(max_files=settings.IMAGE_BATCH_MAX_FILES)
+    try:
+        items, close_archives = await collect_batch_images(
+            [value for _, value in form.multi_items() if not isinstance(value, str)]
+        )
+    except HTTPException as e:
+        await form.close()
         return JSONResponse(
-            status_code=400,
+            status_code=e.status_code,
             content={
-                "code": 400,
-                "message": "文件错误",
+                "code": e.status_code,
+                "message": e.detail,
                 "data": None
             }
         )
+    profile = request.headers.get(settings.PROFILE_HEADER) == "1"
 
+    async def close():
+        close_archives()
+        await form.close()
 
-    try:
-        file_stream = io.BytesIO(image_str.encode("utf-8"))  # \\r\\n
-        # file_stream = io.StringIO(image_str)
-        # str1 = f"""# 第一行{os.linesep}# 第二行{os.linesep}# 第三行"""
-        # print(image_str)
-        normalized_content = await process_str(image_str)
-        # print(file_stream.getvalue())
-        # print(normalized_content)
-        # with open('uploads/example.md', 'w', encoding='utf-8') as f:
-        #     f.write(normalized_content)
-        return StreamingResponse(
-            content=normalized_content,
-            media_type="text/markdown; charset=utf-8",
-            # media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": "attachment; filename=file.md",
-                "Content-Type": "text/markdown; charset=utf-8"
+    if not stream:
+        try:
+            results = [result async for result in image_batch_service(items, profile)]
+        finally:
+            await close()
+        results.sort(key=lambda result: result["index"])
+        return JSONResponse(
+            status_code=200,
+            content={
+                "code": 200,
+                "message": "success",
+                "data": results,
+                "tokens": sum(result["tokens"] for result in results)
             }
         )
-    except Exception as e:
+
+    async def event_stream():
+        failed = 0
+        tokens = 0
+        try:
+            async for result in image_batch_service(items, profile):
+                failed += result["code"] != 200
+                tokens += result["tokens"]
+                yield format_sse(EVENT_RESULT, result)
+            yield format_sse(EVENT_DONE, {"total": len(items), "failed": failed, "tokens": tokens})
+        finally:
+            await close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@router.post("/download")
+async def download(request: Request, image_str: str = ""):
+    """
+    下载文件，内容规范化后流式返回
+    内容较长时 image_str 查询参数会超过 URL 长度限制，建议不传 image_str，直接在请求体中发送文本（text/plain 或 text/markdown）
+    :param request:
+    :param image_str:
+    :return:
+    """
+    if image_str and image_str != " ":
+        return markdown_response(iter_str(image_str), "file.md")
+    chunks = await iter_body(request)
+    if chunks is None:
         return JSONResponse(
-            status_code=500,
+            status_code=400,
             content={
-                "code": 500,
-                "message": f"服务器内部错误: {str(e)}",
+                "code": 400,
+                "message": "文件错误",
                 "data": None
             }
         )
+    return markdown_response(chunks, "file.md")
 
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 与 services/llm.py 中的 PAGE_MARKER 一致
+_MARKER_PATTERN = re.compile(r"<<<PAGE (\d+)>>>")
+
+_WORDS = "识别 内容 表格 合同 金额 日期 数量 说明 条款 单位 合计 备注 项目 编号 名称".split()
+
+
+class FakeBackend:
+    """
+    OpenAI 兼容的模型服务替身，按配置的延迟分布、token 数和错误率响应图片识别请求
+    """
+
+    def __init__(self, latency: float, latency_dist: str, latency_sigma: float, per_image: bool,
+                 prompt_tokens: int, completion_tokens: int, error_rate: float, error_status: int, seed: int):
+        """
+        :param latency: 延迟均值（秒）
+        :param latency_dist: 延迟分布，fixed / uniform / exponential / lognormal
+        :param latency_sigma: lognormal 的 sigma，uniform 时为相对波动范围
+        :param per_image: 延迟是否按请求中的图片数成倍增加
+        :param prompt_tokens: 每张图片的输入 token 数
+        :param completion_tokens: 每张图片的输出 token 数，输出文本长度与之成正比
+        :param error_rate: 返回错误的概率
+        :param error_status: 错误的状态码，429 和 503 会附带 Retry-After
+        :param seed: 随机种子
+        """
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.per_image = per_image
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0, "images": 0, "inflight": 0, "max_inflight": 0}
+
+    def sample_latency(self, images: int) -> float:
+        if self.latency_dist == "fixed":
+            value = self.latency
+        elif self.latency_dist == "uniform":
+            value = self.latency * self.rng.uniform(1 - self.latency_sigma, 1 + self.latency_sigma)
+        elif self.latency_dist == "exponential":
+            value = self.rng.expovariate(1 / self.latency) if self.latency > 0 else 0
+        else:
+            # 均值为 latency 的对数正态分布，长尾接近真实模型服务
+            mu = math.log(max(self.latency, 1e-6)) - self.latency_sigma ** 2 / 2
+            value = self.rng.lognormvariate(mu, self.latency_sigma)
+        return max(0.0, value) * (images if self.per_image else 1)
+
+    def make_text(self, markers: list[int]) -> str:
+        # 中文约 1 字 1 token
+        def page_text():
+            words = []
+            while sum(len(word) for word in words) < self.completion_tokens:
+                words.append(self.rng.choice(_WORDS))
+            return "## 标题\n\n" + "".join(words) + "\n"
+
+        if len(markers) > 1:
+            return "\n".join(f"<<<PAGE {marker}>>>\n{page_text()}" for marker in markers)
+        return "```markdown\n" + page_text() + "```"
+
+
+def create_app(backend: FakeBackend) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return backend.stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        contents = [
+            part for message in body["messages"]
+            if isinstance(message["content"], list) for part in message["content"]
+        ]
+        images = max(1, sum(1 for part in contents if part.get("type") == "image_url"))
+        markers = [
+            int(match.group(1)) for part in contents if part.get("type") == "text"
+            for match in _MARKER_PATTERN.finditer(part["text"])
+        ]
+        stats = backend.stats
+        stats["requests"] += 1
+        stats["images"] += images
+        stats["inflight"] += 1
+        stats["max_inflight"] = max(stats["max_inflight"], stats["inflight"])
+        try:
+            await asyncio.sleep(backend.sample_latency(images))
+        finally:
+            stats["inflight"] -= 1
+        if backend.rng.random() < backend.error_rate:
+            stats["errors"] += 1
+            headers = {"Retry-After": "0.1"} if backend.error_status in (429, 503) else {}
+            return JSONResponse({"error": {"message": "fake backend error"}}, status_code=backend.error_status,
+                                headers=headers)
+        text = backend.make_text(markers if len(markers) == images else [])
+        usage = {
+            "prompt_tokens": backend.prompt_tokens * images,
+            "completion_tokens": backend.completion_tokens * images,
+            "total_tokens": (backend.prompt_tokens + backend.completion_tokens) * images,
+        }
+        model = body.get("model", "fake")
+        if body.get("stream"):
+            async def chunks():
+                for start in range(0, len(text), 64):
+                    delta = {"content": text[start:start + 64]}
+                    yield "data: " + json.dumps({
+                        "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                    }) + "\n\n"
+                yield "data: " + json.dumps({
+                    "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [], "usage": usage,
+                }) + "\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        return {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.5, help="模型延迟均值（秒）")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "exponential", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--per-image", action=argparse.BooleanOptionalAction, default=True,
+                        help="延迟按请求中的图片数成倍增加")
+    parser.add_argument("--prompt-tokens", type=int, default=1200)
+    parser.add_argument("--completion-tokens", type=int, default=600)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def backend_from_args(args: argparse.Namespace) -> FakeBackend:
+    return FakeBackend(
+        args.latency, args.latency_dist, args.latency_sigma, args.per_image, args.prompt_tokens,
+        args.completion_tokens, args.error_rate, args.error_status, args.seed,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地模型服务替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(backend_from_args(args)), host=args.host, port=args.port, log_level="warning")
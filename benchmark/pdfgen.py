@@ -0,0 +1,135 @@
+import io
+import random
+
+import fitz
+from PIL import Image, ImageDraw, ImageFilter
+
+# 合成页面类型：text 只有文本层，scanned 整页扫描图片，table 表格，mixed 以上类型交替
+PAGE_KINDS = ("text", "scanned", "table")
+DOC_KINDS = PAGE_KINDS + ("mixed",)
+
+_WORDS = (
+    "invoice contract payment delivery quantity amount total schedule report revenue margin customer "
+    "supplier warehouse inventory shipment order account balance period quarter annual summary review "
+    "section clause party agreement liability warranty service product version release"
+).split()
+
+# A4 页面尺寸（pt）
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(_WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _paragraphs(rng: random.Random, count: int) -> list[str]:
+    return [" ".join(_sentence(rng, rng.randint(6, 14)) for _ in range(rng.randint(2, 5))) for _ in range(count)]
+
+
+def _text_page(doc: fitz.Document, rng: random.Random, index: int):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_text((72, 72), f"Section {index + 1}: {_sentence(rng, 4)}", fontsize=16)
+    rect = fitz.Rect(72, 100, PAGE_WIDTH - 72, PAGE_HEIGHT - 72)
+    page.insert_textbox(rect, "\n\n".join(_paragraphs(rng, 8)), fontsize=10.5)
+
+
+def _scanned_page(doc: fitz.Document, rng: random.Random, index: int, dpi: int = 150):
+    """
+    整页图片，没有文本层，模拟扫描件：灰度、轻微倾斜、噪点，JPEG 压缩
+    """
+    width, height = int(PAGE_WIDTH / 72 * dpi), int(PAGE_HEIGHT / 72 * dpi)
+    image = Image.new("L", (width, height), 250)
+    draw = ImageDraw.Draw(image)
+    y = dpi
+    draw.text((dpi, y), f"Scanned page {index + 1}", fill=20)
+    for paragraph in _paragraphs(rng, 12):
+        y += dpi // 4
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) > 90:
+                draw.text((dpi, y), line, fill=rng.randint(10, 60))
+                y += dpi // 8
+                line = ""
+            line += word + " "
+        draw.text((dpi, y), line, fill=rng.randint(10, 60))
+        y += dpi // 8
+        if y > height - dpi:
+            break
+    # 噪点
+    for _ in range(width * height // 400):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randint(120, 200))
+    image = image.rotate(rng.uniform(-1.0, 1.0), fillcolor=250).filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=70)
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, stream=buffer.getvalue())
+
+
+def _table_page(doc: fitz.Document, rng: random.Random, index: int):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_text((72, 72), f"Table {index + 1}: {_sentence(rng, 3)}", fontsize=14)
+    columns, rows = rng.randint(4, 7), rng.randint(15, 30)
+    left, top = 72, 96
+    cell_width = (PAGE_WIDTH - 144) / columns
+    cell_height = min(22, (PAGE_HEIGHT - top - 72) / rows)
+    for row in range(rows):
+        for column in range(columns):
+            x, y = left + column * cell_width, top + row * cell_height
+            page.draw_rect(fitz.Rect(x, y, x + cell_width, y + cell_height), color=(0, 0, 0), width=0.5)
+            if row == 0:
+                text = rng.choice(_WORDS).title()
+            elif column == 0:
+                text = rng.choice(_WORDS)
+            else:
+                text = f"{rng.uniform(0, 100000):,.2f}"
+            page.insert_text((x + 3, y + cell_height - 6), text, fontsize=8)
+
+
+_PAGE_BUILDERS = {"text": _text_page, "scanned": _scanned_page, "table": _table_page}
+
+
+def make_pdf(kind: str, pages: int, seed: int = 0) -> bytes:
+    """
+    生成合成 PDF，相同参数生成的内容相同
+    :param kind: text / scanned / table / mixed
+    :param pages: 页数
+    :param seed: 随机种子
+    :return: PDF 字节
+    """
+    if kind not in DOC_KINDS:
+        raise ValueError(f"不支持的文档类型: {kind}，可选：{', '.join(DOC_KINDS)}")
+    rng = random.Random(f"{kind}-{pages}-{seed}")
+    doc = fitz.open()
+    for index in range(pages):
+        page_kind = PAGE_KINDS[index % len(PAGE_KINDS)] if kind == "mixed" else kind
+        _PAGE_BUILDERS[page_kind](doc, rng, index)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def make_image(seed: int = 0, dpi: int = 110) -> bytes:
+    """
+    生成单张扫描页图片（PNG），用于图片识别的压测
+    :param seed:
+    :param dpi:
+    :return:
+    """
+    doc = fitz.open()
+    _scanned_page(doc, random.Random(f"image-{seed}"), seed, dpi)
+    pix = doc[0].get_pixmap(dpi=dpi)
+    return pix.tobytes("png")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="生成合成 PDF")
+    parser.add_argument("output")
+    parser.add_argument("--kind", choices=DOC_KINDS, default="mixed")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    with open(args.output, "wb") as f:
+        f.write(make_pdf(args.kind, args.pages, args.seed))
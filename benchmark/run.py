@@ -0,0 +1,493 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmark import fake_vlm
+from benchmark.pdfgen import DOC_KINDS, make_pdf, make_image
+
+SCENARIOS = ("pipeline", "image", "http")
+
+
+def percentiles(values: list[float]) -> dict:
+    """
+    p50 / p95 / p99（最近秩）、均值和最大值
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1],
+    }
+
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _child_pids(pid: int) -> list[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+class Monitor:
+    """
+    压测期间采样事件循环延迟和内存
+    事件循环延迟：定时器实际唤醒时间与预期时间的差
+    内存：本进程的峰值 RSS，以及本进程加渲染子进程的 RSS 之和的峰值（采样得到，不含模型服务替身）
+    """
+
+    def __init__(self, exclude_pids: set, interval: float = 0.05):
+        self.exclude_pids = exclude_pids
+        self.interval = interval
+        self.lags: list[float] = []
+        self.peak_total_kb = 0
+        self._stop = threading.Event()
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def _sample_rss(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            pids = [pid]
+            index = 0
+            while index < len(pids):
+                pids += [child for child in _child_pids(pids[index]) if child not in self.exclude_pids]
+                index += 1
+            self.peak_total_kb = max(self.peak_total_kb, sum(_rss_kb(p) for p in pids))
+            self._stop.wait(0.1)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._measure_lag())
+        self._thread = threading.Thread(target=self._sample_rss, daemon=True)
+        self._thread.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._stop.set()
+        self._thread.join()
+
+    def report(self) -> dict:
+        return {
+            "event_loop_lag": percentiles(self.lags),
+            # Linux 上 ru_maxrss 单位为 KB
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "peak_rss_total_mb": self.peak_total_kb / 1024,
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_backend(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmark.fake_vlm", "--port", str(port),
+        "--latency", str(args.latency), "--latency-dist", args.latency_dist,
+        "--latency-sigma", str(args.latency_sigma), "--per-image" if args.per_image else "--no-per-image",
+        "--prompt-tokens", str(args.prompt_tokens), "--completion-tokens", str(args.completion_tokens),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status), "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, cwd=ROOT)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("模型服务替身启动失败")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("模型服务替身启动超时")
+
+
+async def backend_stats(api_base: str) -> dict | None:
+    import httpx
+
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(api_base.rsplit("/v1", 1)[0] + "/health", timeout=2)
+            return response.json()
+    except Exception:
+        return None
+
+
+def build_documents(args: argparse.Namespace) -> list[tuple[str, bytes, int]]:
+    """
+    :return: [(文件名, PDF 字节, 页数)]，文档类型按 --kinds 轮流，每个文档的内容都不同
+    """
+    documents = []
+    for index in range(args.docs):
+        kind = args.kinds[index % len(args.kinds)]
+        documents.append((f"{kind}-{index}", make_pdf(kind, args.pages, args.seed * 1000 + index), args.pages))
+    return documents
+
+
+def configure_environment(args: argparse.Namespace, api_base: str):
+    """
+    服务配置在导入时读取，必须在导入 core / services 之前设置
+    """
+    os.environ.update({
+        "VLLM_API_BASE": api_base,
+        "VLLM_API_KEY": "fake",
+        "VLLM_MODEL": "fake-vl",
+        "VLLM_ENDPOINTS": "",
+        "OCR_CACHE_ENABLED": "true" if args.cache else "false",
+        "DOC_DEDUP_ENABLED": "true" if args.cache else "false",
+        "TRACE_EXPORTER": "jsonl" if args.trace else "none",
+        "LOG_LEVEL": "INFO" if args.verbose else "WARNING",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+
+async def _write_upload(user_id: str, file_name: str, data: bytes) -> str:
+    from core.tools import create_dir
+
+    upload_dir, temp_dir, result_dir = await create_dir(user_id)
+    path = os.path.join(upload_dir, f"{file_name}.pdf")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+async def scenario_pipeline(args: argparse.Namespace, documents: list) -> dict:
+    """
+    直接调用 pdf_ocr_service，--concurrency 个文档并行
+    """
+    from core.file import pdf_ocr_service
+
+    paths = [
+        (await _write_upload(f"bench-pipeline-{index}", name, data), f"bench-pipeline-{index}", pages)
+        for index, (name, data, pages) in enumerate(documents)
+    ]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], []
+    pages = 0
+
+    async def run(path, user_id, page_count):
+        nonlocal pages
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await pdf_ocr_service(path, user_id)
+                latencies.append(time.perf_counter() - start)
+                pages += page_count
+            except Exception as e:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(path, user_id, page_count) for path, user_id, page_count in paths))
+    wall = time.perf_counter() - start
+    return {
+        "documents": len(latencies),
+        "pages": pages,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "pages_per_sec": pages / wall if wall else 0,
+        "document_latency": percentiles(latencies),
+    }
+
+
+async def scenario_image(args: argparse.Namespace) -> dict:
+    """
+    直接调用 image_ocr_service，--image-concurrency 个请求并行
+    """
+    from fastapi import UploadFile
+    from core.image import image_ocr_service
+
+    images = [make_image(args.seed * 1000 + index) for index in range(args.images)]
+    semaphore = asyncio.Semaphore(args.image_concurrency)
+    latencies, errors = [], []
+
+    async def run(index, data):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await image_ocr_service(UploadFile(io.BytesIO(data), filename=f"bench-{index}.png", size=len(data)))
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(index, data) for index, data in enumerate(images)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "pages_per_sec": len(latencies) / wall if wall else 0,
+        "request_latency": percentiles(latencies),
+    }
+
+
+async def scenario_http(args: argparse.Namespace, documents: list) -> dict:
+    """
+    通过 ASGI 调用 HTTP 接口：上传全部文档后轮询状态直到完成，同时并发上传图片
+    包含应用的生命周期（任务队列），结束时关闭数据库等资源，因此放在最后执行
+    """
+    import httpx
+    from main import app
+
+    upload_latencies, document_latencies, image_latencies, errors = [], [], [], []
+    images = [make_image(args.seed * 1000 + 500 + index) for index in range(args.images)]
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 5000))
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def run_document(index, name, data):
+            user_id = f"bench-http-{index}"
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/v1/file/upload", params={"user_id": user_id}, files={"file": (f"{name}.pdf", data)}
+            )
+            upload_latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.text)
+                return
+            while True:
+                await asyncio.sleep(args.poll_interval)
+                response = await client.get("/api/v1/file/status", params={"user_id": user_id, "file_name": name})
+                state = response.json()["data"].get("state")
+                if state == "done":
+                    document_latencies.append(time.perf_counter() - start)
+                    return
+                if state == "failed":
+                    errors.append(response.json()["data"].get("error"))
+                    return
+
+        semaphore = asyncio.Semaphore(args.image_concurrency)
+
+        async def run_image(index, data):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/image/upload", files={"image": (f"bench-{index}.png", data)})
+                if response.status_code == 200:
+                    image_latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append(response.text)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(run_document(index, name, data) for index, (name, data, _) in enumerate(documents)),
+            *(run_image(index, data) for index, data in enumerate(images)),
+        )
+        wall = time.perf_counter() - start
+    pages = len(document_latencies) * args.pages + len(image_latencies)
+    return {
+        "documents": len(document_latencies),
+        "images": len(image_latencies),
+        "pages": pages,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "pages_per_sec": pages / wall if wall else 0,
+        "upload_latency": percentiles(upload_latencies),
+        "document_latency": percentiles(document_latencies),
+        "image_latency": percentiles(image_latencies),
+    }
+
+
+async def run_scenarios(args: argparse.Namespace, api_base: str, exclude_pids: set) -> dict:
+    from core.render import shutdown_render_pool
+    from services.database import database
+    from services.llm import chat_service
+    from services.tracing import tracer
+
+    documents = build_documents(args)
+    if args.warmup:
+        # 预热渲染进程池和模型连接，不计入结果
+        await scenario_pipeline(args, [("warmup", make_pdf("mixed", 3, -1), 3)])
+    results = {}
+    for name in args.scenarios:
+        before = await backend_stats(api_base)
+        async with Monitor(exclude_pids) as monitor:
+            if name == "pipeline":
+                result = await scenario_pipeline(args, documents)
+            elif name == "image":
+                result = await scenario_image(args)
+            else:
+                result = await scenario_http(args, documents)
+        result.update(monitor.report())
+        after = await backend_stats(api_base)
+        if before and after:
+            result["backend"] = {
+                "requests": after["requests"] - before["requests"],
+                "errors": after["errors"] - before["errors"],
+                "max_inflight": after["max_inflight"],
+            }
+        results[name] = result
+    if "http" not in args.scenarios:
+        # http 场景的生命周期结束时已经释放
+        shutdown_render_pool()
+        await chat_service.aclose()
+        await database.close()
+        tracer.close()
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict) -> list[str]:
+    """
+    与之前的结果对比主要指标
+    """
+    lines = [f"对比基线 {baseline.get('commit') or ''}"]
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for key, path in (
+            ("pages_per_sec", ("pages_per_sec",)),
+            ("document_latency.p95", ("document_latency", "p95")),
+            ("request_latency.p95", ("request_latency", "p95")),
+            ("event_loop_lag.p99", ("event_loop_lag", "p99")),
+            ("peak_rss_total_mb", ("peak_rss_total_mb",)),
+        ):
+            new_value, old_value = result, old
+            for part in path:
+                new_value = new_value.get(part) if isinstance(new_value, dict) else None
+                old_value = old_value.get(part) if isinstance(old_value, dict) else None
+            if new_value is None or old_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100 if old_value else 0
+            lines.append(f"  {name}.{key}: {old_value:.4g} -> {new_value:.4g} ({change:+.1f}%)")
+    return lines
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="OCR 流水线压测，使用本地模型服务替身")
+    parser.add_argument("--scenarios", default="pipeline,image,http",
+                        help=f"逗号分隔，可选：{', '.join(SCENARIOS)}，http 总是最后执行")
+    parser.add_argument("--docs", type=int, default=6, help="文档数")
+    parser.add_argument("--pages", type=int, default=12, help="每个文档的页数")
+    parser.add_argument("--kinds", default="mixed", help=f"逗号分隔的文档类型，按顺序轮流：{', '.join(DOC_KINDS)}")
+    parser.add_argument("--concurrency", type=int, default=2, help="pipeline 场景同时处理的文档数")
+    parser.add_argument("--images", type=int, default=20, help="image / http 场景的图片数")
+    parser.add_argument("--image-concurrency", type=int, default=8)
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="http 场景查询状态的间隔（秒）")
+    parser.add_argument("--warmup", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--cache", action="store_true", help="开启识别缓存和文档复用，默认关闭以测量实际处理")
+    parser.add_argument("--trace", action="store_true", help="写入追踪记录")
+    parser.add_argument("--api-base", help="使用已启动的模型服务，不启动替身")
+    parser.add_argument("--env", action="append", default=[], help="额外的服务配置，KEY=VALUE，可重复")
+    parser.add_argument("--output", help="结果 JSON 文件，默认 benchmark-<commit>.json")
+    parser.add_argument("--compare", help="对比之前保存的结果 JSON")
+    parser.add_argument("--verbose", action="store_true", help="显示服务日志")
+    fake_vlm.add_arguments(parser)
+    args = parser.parse_args(argv)
+    args.scenarios = [name for name in SCENARIOS if name in args.scenarios.split(",")]
+    args.kinds = args.kinds.split(",")
+    for kind in args.kinds:
+        if kind not in DOC_KINDS:
+            parser.error(f"不支持的文档类型: {kind}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backend = None
+    api_base = args.api_base
+    if api_base is None:
+        port = _free_port()
+        backend = start_fake_backend(args, port)
+        api_base = f"http://127.0.0.1:{port}/v1"
+    commit = _git_commit()
+    output = os.path.abspath(args.output or f"benchmark-{(commit or 'unknown')[:8]}.json")
+    workdir = tempfile.mkdtemp(prefix="ocr-bench-")
+    configure_environment(args, api_base)
+    cwd = os.getcwd()
+    # 上传目录、数据库等都使用相对路径，放到临时目录中
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run_scenarios(args, api_base, {backend.pid} if backend else set()))
+    finally:
+        os.chdir(cwd)
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workdir": workdir,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")},
+        "scenarios": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, result in results.items():
+        latency = result.get("document_latency") or result.get("request_latency") or {}
+        print(
+            f"{name}: {result['pages_per_sec']:.2f} 页/秒，"
+            f"延迟 p50/p95/p99 {latency.get('p50', 0):.3f}/{latency.get('p95', 0):.3f}/{latency.get('p99', 0):.3f} 秒，"
+            f"事件循环延迟 p99 {result['event_loop_lag'].get('p99', 0) * 1000:.1f} 毫秒，"
+            f"峰值内存 {result['peak_rss_total_mb']:.0f} MB，错误 {result['errors']}"
+        )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print("\n".join(compare(report, json.load(f))))
+    print(f"结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,8 +49,8 @@ class Settings:
     VERSION: str = os.getenv("VERSION", "v1.0")
     API_V1_STR: str = "/api/v1"
 
-    # 允许访问的ip地址
-    ALLOWED_ORIGINS: list = [
+    # 允许访问的ip地址，支持网段（如 192.168.10.0/24），设置环境变量时以逗号分隔并替换默认列表
+    ALLOWED_ORIGINS: list = [item.strip() for item in os.getenv("ALLOWED_ORIGINS", "").split(",") if item.strip()] or [
         "127.0.0.1",
         "14.145.46.218",
         "192.168.10.122",
@@ -62,11 +62,22 @@ class Settings:
     ]
     # 数据库配置
     DB_PATH = "token.db"
+    # 数据库被锁定时的等待时间（毫秒）
+    DB_BUSY_TIMEOUT: int = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
+    # 连接的页缓存大小（KB）
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
     # 文件上传配置
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 5 * 1024 * 1024  # 5MB
+    # 上传文档（PDF）的大小上限，超过后中止上传
+    MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", str(200 * 1024 * 1024)))
+    # 上传文件分块写入磁盘的块大小
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
     # 允许的图片类型
     ALLOWED_IMAGE_TYPES = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+    # 批量图片识别（/image/batch）单次最多的图片数（压缩包按其中的文件计），及同时识别的图片数
+    IMAGE_BATCH_MAX_FILES: int = int(os.getenv("IMAGE_BATCH_MAX_FILES", "500"))
+    IMAGE_BATCH_CONCURRENCY: int = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "8"))
     # 允许的文件扩展名
     ALLOWED_FILE_TYPE_ext = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.csv', '.txt', '.md']
     # pdf文件
@@ -87,18 +98,157 @@ class Settings:
     VLLM_API_KEY: str = os.getenv("VLLM_API_KEY", "token-abc123")
     VLLM_API_BASE: str = os.getenv("VLLM_API_BASE", "")
     VLLM_MODEL: str = os.getenv("VLLM_MODEL", "")
+    # 多个 vLLM 实例，JSON 数组：[{"api_base": "...", "api_key": "...", "weight": 1}]
+    # api_key、model、weight 可省略，默认使用上面的配置；各实例的 model 必须相同；未配置时只使用 VLLM_API_BASE
+    VLLM_ENDPOINTS: str = os.getenv("VLLM_ENDPOINTS", "")
+    # 实例连续失败该次数后暂停使用，冷却（秒）后重新加入
+    LLM_EJECT_FAILURES: int = int(os.getenv("LLM_EJECT_FAILURES", "3"))
+    LLM_EJECT_COOLDOWN: float = float(os.getenv("LLM_EJECT_COOLDOWN", "30"))
 
     # chat模型
     CHAT_API_KEY: str = os.getenv("CHAT_API_KEY", "")
     CHAT_API_BASE: str = os.getenv("CHAT_API_BASE", "")
     CHAT_MODEL: str = os.getenv("CHAT_MODEL", "")
 
+    # PDF页面渲染配置
+    # 固定渲染 DPI，0 表示按页面自动选择
+    PDF_RENDER_DPI: int = int(os.getenv("PDF_RENDER_DPI", "0"))
+    # 自动选择 DPI 的上下限
+    PDF_RENDER_MIN_DPI: int = int(os.getenv("PDF_RENDER_MIN_DPI", "96"))
+    PDF_RENDER_MAX_DPI: int = int(os.getenv("PDF_RENDER_MAX_DPI", "300"))
+    # 单页图片像素预算，超过模型可用的图片尺寸只会增加 token 和耗时
+    PDF_RENDER_MAX_PIXELS: int = int(os.getenv("PDF_RENDER_MAX_PIXELS", str(2048 * 2048)))
+    # 页面上较小文字渲染后的目标像素高度
+    PDF_RENDER_GLYPH_PX: int = int(os.getenv("PDF_RENDER_GLYPH_PX", "24"))
+    # 页面图片编码格式：PNG / JPEG / WEBP
+    PDF_IMAGE_FORMAT: str = os.getenv("PDF_IMAGE_FORMAT", "PNG")
+    # JPEG、WEBP 的压缩质量（1-100）
+    PDF_IMAGE_QUALITY: int = int(os.getenv("PDF_IMAGE_QUALITY", "85"))
+
+    # 页面处理方式：auto 按页面特征自动选择，text 有文本层即直接提取，vlm 全部调用模型
+    PDF_TEXT_ROUTING: str = os.getenv("PDF_TEXT_ROUTING", "auto").lower()
+    # auto 模式下直接提取文本层的条件：最少字符数、图片最大覆盖率、矢量图形最大数量
+    PDF_TEXT_MIN_CHARS: int = int(os.getenv("PDF_TEXT_MIN_CHARS", "50"))
+    PDF_TEXT_MAX_IMAGE_COVERAGE: float = float(os.getenv("PDF_TEXT_MAX_IMAGE_COVERAGE", "0.3"))
+    PDF_TEXT_MAX_DRAWINGS: int = int(os.getenv("PDF_TEXT_MAX_DRAWINGS", "100"))
+    # 单次模型请求最多合并的页数，1 表示逐页请求
+    PDF_BATCH_PAGES: int = int(os.getenv("PDF_BATCH_PAGES", "1"))
+    # 单次请求所有页面图片的像素总量上限，页面图片越大合并的页数越少
+    PDF_BATCH_MAX_PIXELS: int = int(os.getenv("PDF_BATCH_MAX_PIXELS", str(4096 * 4096)))
+    # 页面渲染进程数
+    RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+    # 渲染预取深度：领先模型识别阶段最多渲染的页数
+    RENDER_PREFETCH: int = int(os.getenv("RENDER_PREFETCH", "8"))
+
+    # 模型请求连接池配置
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+    # 空闲连接保活时间（秒）
+    LLM_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+    # 是否启用 HTTP/2
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "false").lower() == "true"
+
+    # 识别结果缓存配置
+    OCR_CACHE_ENABLED: bool = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+    OCR_CACHE_PATH: str = os.getenv("OCR_CACHE_PATH", f"{UPLOAD_DIR}/ocr_cache.db")
+    # 缓存容量上限（字节），超出后按最近访问时间淘汰
+    OCR_CACHE_MAX_BYTES: int = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    # 相同图片（及模型、提示词）同时识别时只请求一次模型，其余请求等待同一个结果
+    OCR_COALESCE_ENABLED: bool = os.getenv("OCR_COALESCE_ENABLED", "true").lower() == "true"
+
+    # 文档去重配置
+    # 内容相同的文档（不区分用户）复用已有的识别结果，处理中的相同文档等待其完成
+    DOC_DEDUP_ENABLED: bool = os.getenv("DOC_DEDUP_ENABLED", "true").lower() == "true"
+    DOC_STORE_DIR: str = os.getenv("DOC_STORE_DIR", "doc_store")
+
+    # 并发配置
+    # 单个PDF文档同时识别的页数
+    PDF_PAGE_CONCURRENCY: int = int(os.getenv("PDF_PAGE_CONCURRENCY", "8"))
+    # 全局同时请求模型的最大数量（所有文档、图片共享）
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+    # 是否按后端延迟和过载情况自动调整并发数（AIMD），关闭时固定为 LLM_MAX_CONCURRENCY
+    LLM_ADAPTIVE_CONCURRENCY: bool = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+    LLM_INITIAL_CONCURRENCY: int = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+    LLM_MIN_CONCURRENCY: int = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+    # 单页延迟超过基线（最小延迟）的倍数时视为后端过载
+    LLM_LATENCY_TOLERANCE: float = float(os.getenv("LLM_LATENCY_TOLERANCE", "3"))
+    # 单页的典型输出 token 数，输出更多的请求按 输出 token 数 / 该值 折算页数后再计算单页延迟
+    # 避免内容密集、输出较长的页面被误判为过载
+    LLM_PAGE_TOKENS: int = int(os.getenv("LLM_PAGE_TOKENS", "1000"))
+    # 过载时并发数乘以该系数
+    LLM_DECREASE_FACTOR: float = float(os.getenv("LLM_DECREASE_FACTOR", "0.7"))
+
+    # 模型请求重试配置
+    # 单页请求的超时（秒），多页合并请求按页数倍增
+    LLM_REQUEST_TIMEOUT: float = float(os.getenv("LLM_REQUEST_TIMEOUT", "180"))
+    # 从首次发出请求起的总时限（秒），包含所有重试
+    LLM_REQUEST_DEADLINE: float = float(os.getenv("LLM_REQUEST_DEADLINE", "600"))
+    # 可重试错误（429、5xx、超时、连接失败）的最大重试次数
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "4"))
+    # 指数退避的初始等待和最大等待（秒），服务端返回 Retry-After 时按其等待，不受最大等待限制
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+
+    # 处理进度推送配置
+    # 是否以流式方式请求模型，并把模型输出实时推送给订阅者
+    LLM_STREAM: bool = os.getenv("LLM_STREAM", "false").lower() == "true"
+    # 单个订阅者最多缓存的事件数，超过后断开该订阅者
+    EVENT_QUEUE_SIZE: int = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+    # 无事件时发送保活消息的间隔（秒）
+    EVENT_KEEPALIVE: float = float(os.getenv("EVENT_KEEPALIVE", "15"))
+
+    # 任务队列配置
+    # 同时处理的文档数
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    # 排队中和执行中的任务上限，超过后拒绝上传
+    JOB_QUEUE_MAX_DEPTH: int = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100"))
+    # 任务最多执行次数，失败后按次数递增延迟重试（秒）
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_DELAY: float = float(os.getenv("JOB_RETRY_DELAY", "10"))
+
+    # 结果分段获取配置（/file/getfile）
+    # 按页获取时默认及最多返回的页数
+    RESULT_PAGE_SIZE: int = int(os.getenv("RESULT_PAGE_SIZE", "10"))
+    RESULT_MAX_PAGES: int = int(os.getenv("RESULT_MAX_PAGES", "100"))
+    # 按字节获取时默认及最多返回的字节数
+    RESULT_RANGE_BYTES: int = int(os.getenv("RESULT_RANGE_BYTES", str(256 * 1024)))
+    RESULT_MAX_RANGE_BYTES: int = int(os.getenv("RESULT_MAX_RANGE_BYTES", str(4 * 1024 * 1024)))
+
+    # 日志配置
+    # 日志级别：DEBUG / INFO / WARNING / ERROR
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    # 输出格式：text 或 json（每行一个 JSON 对象）
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text").lower()
+    # 等待写出的日志条数上限，超过后丢弃
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # 高频日志（每页、每个请求）每多少条输出 1 条，1 表示全部输出
+    LOG_SAMPLE_EVERY: int = int(os.getenv("LOG_SAMPLE_EVERY", "10"))
+
+    # 追踪与性能分析配置
+    # span 导出方式：jsonl 写入 TRACE_FILE，none 不导出，或 "模块:类名" 指定自定义导出器
+    TRACE_EXPORTER: str = os.getenv("TRACE_EXPORTER", "jsonl")
+    TRACE_FILE: str = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+    # 单个追踪文件的大小上限（字节）及保留的轮转文件数
+    TRACE_MAX_BYTES: int = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+    TRACE_BACKUP_COUNT: int = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+    # 对所有任务做 cProfile 分析，关闭时只分析请求头 PROFILE_HEADER 为 1 的请求
+    PROFILE_ENABLED: bool = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+    PROFILE_HEADER: str = os.getenv("PROFILE_HEADER", "X-Profile")
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+
     # OpenAI配置
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = "gpt-4o"
 
     MY_PROMPT_VL_USER = """
 请根据图片中的内容，生成一份格式为Markdown格式的文档
+"""
+
+    # 多页合并识别的用户提示词，{count} 为页数，{marker} 为第一页的页码标记
+    MY_PROMPT_VL_BATCH = """
+下面依次是同一文档连续的 {count} 页图片，每张图片前标注了页码标记。
+请逐页识别图片中的内容，生成Markdown格式的文档。
+每页的内容必须以单独一行的页码标记开头（第一页为 {marker}，之后依次递增），不要合并、遗漏或调换页面。
 """
 
     MY_PROMPT_VL_SYSTEM = """
@@ -0,0 +1,98 @@
+import os
+import shutil
+
+import aiofiles
+import aiofiles.os
+
+from core.result import write_index
+from core.tools import get_dir
+from services.db_token import db
+
+# 源文件标记：记录生成检查点时源文件的大小和修改时间，文件被覆盖后检查点失效
+_SOURCE_MARKER = "source"
+
+
+def get_checkpoint_dir(user_id: str, file_name: str) -> str:
+    """
+    获取文档的检查点目录，保存已完成页面的 Markdown 片段
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    return f"{temp_dir}/{file_name}"
+
+
+def get_fragment_path(checkpoint_dir: str, page_number: int) -> str:
+    """
+    单页 Markdown 片段路径
+    :param checkpoint_dir:
+    :param page_number: 页码，从0开始
+    :return:
+    """
+    return f"{checkpoint_dir}/page_{page_number + 1:05d}.md"
+
+
+async def prepare_checkpoint(file: str, user_id: str, file_name: str) -> set:
+    """
+    准备检查点目录，返回之前已完成的页码
+    源文件与检查点不一致（重新上传了同名文件）时清空旧检查点
+    :param file: 源文件路径
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return: 已完成的页码集合，页码从0开始
+    """
+    checkpoint_dir = get_checkpoint_dir(user_id, file_name)
+    stat = os.stat(file)
+    source = f"{stat.st_size}:{stat.st_mtime_ns}"
+    marker = f"{checkpoint_dir}/{_SOURCE_MARKER}"
+    if os.path.exists(marker):
+        async with aiofiles.open(marker, "r", encoding="utf-8") as f:
+            if (await f.read()) == source:
+                # 片段和页面记录都存在的页面才视为已完成
+                records = await db.list_page_records(user_id, file_name)
+                return {
+                    record["page"] - 1 for record in records
+                    if os.path.exists(get_fragment_path(checkpoint_dir, record["page"] - 1))
+                }
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    await db.delete_page_records(user_id, file_name)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    async with aiofiles.open(marker, "w", encoding="utf-8") as f:
+        await f.write(source)
+    return set()
+
+
+async def write_fragment(checkpoint_dir: str, page_number: int, markdown: str):
+    """
+    保存单页 Markdown 片段，先写临时文件再重命名，避免中断后留下不完整的片段
+    :param checkpoint_dir:
+    :param page_number: 页码，从0开始
+    :param markdown:
+    """
+    path = get_fragment_path(checkpoint_dir, page_number)
+    async with aiofiles.open(path + ".tmp", "w", encoding="utf-8") as f:
+        await f.write(markdown)
+    await aiofiles.os.replace(path + ".tmp", path)
+
+
+async def assemble_result(checkpoint_dir: str, page_count: int, result_file: str):
+    """
+    按页码顺序将片段逐个写入结果文件，完成后原子替换，并删除检查点
+    同时记录每页的字节位置，保存为页索引，用于按页获取结果
+    :param checkpoint_dir:
+    :param page_count:
+    :param result_file:
+    """
+    # 临时文件放在检查点目录中，避免结果目录出现未完成的文件
+    temp_file = f"{checkpoint_dir}/result.md.tmp"
+    offsets = [0]
+    async with aiofiles.open(temp_file, "wb") as out:
+        for page_number in range(page_count):
+            async with aiofiles.open(get_fragment_path(checkpoint_dir, page_number), "rb") as f:
+                fragment = await f.read()
+            await out.write(fragment)
+            offsets.append(offsets[-1] + len(fragment))
+    await aiofiles.os.replace(temp_file, result_file)
+    await write_index(result_file, offsets)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
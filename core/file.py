@@ -1,22 +1,111 @@
-import io
+import asyncio
+import functools
 import os
 import re
+import shutil
+import time
 
-import fitz
-from PIL import Image
+import aiofiles
 from fastapi import UploadFile, HTTPException, File
 
 from config.config import settings
 from services.db_token import db
+from services.doc_store import doc_store, link_or_copy
+from services.file_state import file_state, ACTIVE_STATES, STATE_DONE
+from services.job_queue import job_queue
 from services.llm import chat_service
-from core.tools import verify_file_type, read_text_file, create_dir, get_dir
+from services.logger import get_logger
+from services.metrics import stage_seconds, pages_total, documents_total, tokens_total, errors_total
+from services.profiler import profile_job
+from services.tracing import tracer, current_span, Span
+from services.events import event_broker, format_sse, EVENT_PROGRESS, EVENT_PAGE, EVENT_DELTA, EVENT_DONE, EVENT_ERROR
+from core.checkpoint import get_checkpoint_dir, get_fragment_path, prepare_checkpoint, write_fragment, \
+    assemble_result
+from core.ocr import recognize_image, recognize_images, SOURCE_FRESH
+from core.render import run_in_render_pool, page_count_job, process_page_job, render_options
+from core.text_layer import ROUTE_TEXT
+from core.tools import verify_file_type, read_text_file, create_dir, get_dir, get_index_path
 
+logger = get_logger("file")
 
-async def pdf_ocr_service(file: str, user_id: str = ""):
+
+async def submit_pdf(file: str, user_id: str, sha256: str, profile: bool = False):
+    """
+    提交已上传的 PDF：相同内容的文档已处理过时直接复用结果，否则加入任务队列
+    :param file: 上传文件路径
+    :param user_id:
+    :param sha256: 上传内容的哈希
+    :param profile: 处理时是否做性能分析
+    :return:
+    """
+    if not settings.DOC_DEDUP_ENABLED:
+        await job_queue.enqueue(user_id, file, profile=profile)
+        return
+    file_name = os.path.splitext(os.path.basename(file))[0]
+    if await reuse_document(user_id, file_name, sha256):
+        # 之前排队的同名文件已被覆盖，不再处理
+        await job_queue.cancel_user_jobs(user_id, file_name)
+        return
+    await job_queue.enqueue(user_id, file, sha256, profile)
+
+
+def _document_key(sha256: str) -> str:
+    return doc_store.make_key(sha256, chat_service.model, settings.MY_PROMPT_VL_SYSTEM, settings.MY_PROMPT_VL_USER)
+
+
+async def _link_index(src: str, dst: str):
+    """
+    结果文件在文档存储和用户目录之间共享时一并共享页索引，源结果没有索引时删除目标的旧索引
+    :param src: 源结果文件
+    :param dst: 目标结果文件
+    """
+    if os.path.exists(get_index_path(src)):
+        await link_or_copy(get_index_path(src), get_index_path(dst))
+    elif os.path.exists(get_index_path(dst)):
+        os.remove(get_index_path(dst))
+
+
+async def reuse_document(user_id: str, file_name: str, sha256: str) -> bool:
+    """
+    复用相同内容文档的识别结果，不调用模型
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param sha256: 上传内容的哈希
+    :return: 是否已复用
+    """
+    key = _document_key(sha256)
+    document = await doc_store.get(key)
+    if document is None:
+        return False
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    # 清除同名文件之前中断留下的检查点
+    shutil.rmtree(get_checkpoint_dir(user_id, file_name), ignore_errors=True)
+    await db.delete_page_records(user_id, file_name)
+    await link_or_copy(document["path"], f"{result_dir}/{file_name}.md")
+    await _link_index(document["path"], f"{result_dir}/{file_name}.md")
+    # 复用的结果不计入本次消耗，单独记录
+    await db.create_token_record(user_id, file_name, 0, document["tokens"])
+    await doc_store.mark_reused(key)
+    await file_state.started(user_id, file_name, document["page_count"], document["page_count"])
+    await file_state.finished(user_id, file_name, STATE_DONE)
+    documents_total.inc(outcome="reused")
+    tokens_total.inc(document["tokens"], kind="reused")
+    event_broker.publish(user_id, file_name, EVENT_DONE, {
+        "total": document["page_count"],
+        "tokens": 0,
+        "reused_tokens": document["tokens"],
+    })
+    logger.info("复用已处理文档的结果", user_id=user_id, file=file_name, pages=document["page_count"])
+    return True
+
+
+async def pdf_ocr_service(file: str, user_id: str = "", sha256: str = None, profile: bool = False):
     """
     PDF OCR
     :param file:
     :param user_id:
+    :param sha256: 上传内容的哈希，传入时先尝试复用相同文档的结果，完成后保存结果供其他用户复用
+    :param profile: 是否做性能分析
     :return:
     """
     # 获取带扩展名的文件名
@@ -26,97 +115,379 @@ async def pdf_ocr_service(file: str, user_id: str = ""):
     # 获取用户文件夹
     user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
 
-    # 用 fitz 打开二进制流
-    pdf_document = fitz.open(file)
-    print(f"PDF总页数: {len(pdf_document)}")
-    result = ""
-    total_tokens = 0
-    for page_number in range(pdf_document.page_count):
-        # 加载页面，将pdf的每一页转为图片
-        page = pdf_document.load_page(page_number)
-
-        pix = page.get_pixmap(dpi=300)
-
-        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-
-        image_file_name = f"{temp_dir}/{file_name}_page_{page_number + 1}.png"
-
-        print(f"第{str(page_number + 1)}图片信息：{img}")
-        print("开始图片保存")
-        print(f"图片保存路径：{image_file_name}")
-
-        img.save(image_file_name)
-
-        print("图片保存成功")
-        # if not os.path.exists(image_file_name):
-        #     print("临时文件路径错误！")
-        print(f"开始调用图片识别接口处理第{page_number + 1}页")
-        # 调用图片识别接口
-        # 读取文件
-        image_contents = Image.open(image_file_name)
-        print(image_contents)
-        # 使用BytesIO获取图像的二进制数据
-        bytes_data = io.BytesIO()
-        image_contents.save(bytes_data, format='PNG')  # 保存图像到BytesIO对象，格式可以是JPEG, PNG等
-        bytes_data = bytes_data.getvalue()
-        tokens, image_md = await chat_service.generate_response(bytes_data)
-        image_md = re.sub(r"```markdown", "", image_md)
-        image_md = re.sub(r"```(?=$|\n)", "", image_md)
-        result += image_md
-        total_tokens = total_tokens + tokens
-
-    # 关闭文档
-    pdf_document.close()
-    # 删掉临时文件
-    if os.path.exists(temp_dir):
+    # 每个文档一棵 span 树，页面及模型请求是其子 span
+    with tracer.span("pdf_ocr", user_id=user_id, file_name=file_name, model=chat_service.model) as span:
+        async with profile_job(f"{user_id}-{file_name}", profile) as profile_path:
+            if profile_path:
+                span.set(profile=profile_path)
+            try:
+                # 等待相同文档处理完成的任务在这里直接复用结果
+                if sha256 and await reuse_document(user_id, file_name, sha256):
+                    span.set(reused=True)
+                    return result_dir + f"/{file_name}.md"
+                return await _pdf_ocr(file, user_id, file_name, result_dir, sha256)
+            except Exception:
+                # 是否重试由任务队列决定，最终失败时再更新状态并通知订阅者
+                errors_total.inc(stage="document")
+                raise
+
+
+async def _pdf_ocr(file: str, user_id: str, file_name: str, result_dir: str, sha256: str = None) -> str:
+    """
+    PDF 逐页处理流水线：渲染进程处理页面，识别协程调用模型，每页完成后保存检查点并发布事件
+    :param file:
+    :param user_id:
+    :param file_name: 不带后缀名
+    :param result_dir:
+    :param sha256: 上传内容的哈希
+    :return: 结果文件路径
+    """
+    start = time.perf_counter()
+    # 在渲染进程中打开文档，避免阻塞事件循环
+    page_count = await run_in_render_pool(page_count_job, file)
+    # 之前中断的任务只处理未完成的页面
+    checkpoint_dir = get_checkpoint_dir(user_id, file_name)
+    finished = await prepare_checkpoint(file, user_id, file_name)
+    page_numbers = [page_number for page_number in range(page_count) if page_number not in finished]
+    logger.info(
+        "开始处理文档", user_id=user_id, file=file_name, pages=page_count, resumed_pages=len(finished),
+        remaining_pages=len(page_numbers)
+    )
+    tokens, reused_tokens = await db.sum_page_tokens(user_id, file_name)
+    # 文档处理上下文，识别协程共享进度
+    job = {
+        "user_id": user_id,
+        "file_name": file_name,
+        "checkpoint_dir": checkpoint_dir,
+        "total": page_count,
+        "done": len(finished),
+        "tokens": tokens,
+        "reused_tokens": reused_tokens,
+        # 当前单次请求合并的页数，按拆分结果自动调整
+        "batch_pages": max(1, settings.PDF_BATCH_PAGES),
+    }
+    await file_state.started(user_id, file_name, len(finished), page_count)
+    _publish_progress(job)
+    # 识别协程数即单个文档的页面并发上限，全局上限由 chat_service 控制
+    workers = max(1, min(settings.PDF_PAGE_CONCURRENCY, len(page_numbers)))
+    span = current_span()
+    span.set(pages=page_count, resumed_pages=len(finished), workers=workers)
+    # 领先识别阶段的预取页数（渲染中 + 已渲染待识别），合并识别时至少能为每个识别协程凑满一批
+    window = asyncio.Semaphore(max(1, settings.RENDER_PREFETCH, workers * job["batch_pages"]))
+    queue: asyncio.Queue = asyncio.Queue()
+    # 渲染与识别流水线并行，任意一页失败会取消其余任务，已完成的页面保留在检查点中
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_render_pages(file, page_numbers, queue, window, workers))
+            for _ in range(workers):
+                tg.create_task(_recognize_pages(queue, window, job))
+    except ExceptionGroup as e:
+        # 只抛出第一个失败页面的原始异常
+        raise e.exceptions[0]
+
+    # 按页码顺序流式拼接结果
+    result_file = result_dir + f"/{file_name}.md"
+    with stage_seconds.time(stage="result_write"), tracer.span("assemble_result"):
+        await assemble_result(checkpoint_dir, page_count, result_file)
+    # 存储token数量，包含之前中断时已完成页面的消耗，命中缓存或合并到其他请求的页面只记录为复用
+    total_tokens, reused_tokens = await db.sum_page_tokens(user_id, file_name)
+    await db.create_token_record(user_id, file_name, total_tokens, reused_tokens)
+    span.set(tokens=total_tokens, reused_tokens=reused_tokens)
+    if sha256:
+        # 保存到文档存储，供相同内容的文档复用，记录的是生成整个结果的原始消耗
         try:
-            # 遍历文件夹中的所有文件
-            for temp_image_name in os.listdir(temp_dir):
-                temp_image_path = os.path.join(temp_dir, temp_image_name)
-                # 确保是文件而不是子文件夹
-                if os.path.isfile(temp_image_path):
-                    os.remove(temp_image_path)  # 删除文件
-                    print(f"Deleted: {temp_image_path}")
+            key = _document_key(sha256)
+            await doc_store.put(key, sha256, result_file, page_count, total_tokens + reused_tokens)
+            await _link_index(result_file, doc_store.get_path(key))
         except Exception as e:
-            print(f"临时文件处理中出现错误: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"临时文件处理中出现错误: {e}"
-            )
+            logger.error("保存文档结果失败", user_id=user_id, file=file_name, error=e)
+    await file_state.finished(user_id, file_name, STATE_DONE)
+    documents_total.inc(outcome="done")
+    event_broker.publish(user_id, file_name, EVENT_DONE, {
+        "total": page_count,
+        "tokens": total_tokens,
+        "reused_tokens": reused_tokens,
+    })
+    logger.info(
+        "文档处理完成", user_id=user_id, file=file_name, pages=page_count, tokens=total_tokens,
+        reused_tokens=reused_tokens,
+        duration=round(time.perf_counter() - start, 3)
+    )
+    return result_file
 
-    result_file = result_dir + f"/{file_name}.md"
-    with open(result_file, 'w', encoding='utf-8') as file:
-        file.write(result)
-    # 存储token数量
-    await db.create_token_record(user_id, file_name, total_tokens)
-    return result
 
+def _publish_progress(job: dict):
+    event_broker.publish(job["user_id"], job["file_name"], EVENT_PROGRESS, {
+        "done": job["done"],
+        "total": job["total"],
+        "tokens": job["tokens"],
+        "reused_tokens": job["reused_tokens"],
+    })
 
-async def get_status(user_id: str):
+
+async def _render_pages(file: str, page_numbers: list, queue: asyncio.Queue, window: asyncio.Semaphore, workers: int):
     """
-    查询文件清洗状态
-    :param user_id:
+    按页码顺序在渲染进程池中处理页面（文本提取或渲染），并送入识别队列
+    :param file:
+    :param page_numbers: 需要处理的页码
+    :param queue: 识别队列
+    :param window: 预取窗口，识别协程取走页面后释放
+    :param workers: 识别协程数，渲染结束后逐个发送结束标记
     :return:
     """
-    # 获取用户文件夹
-    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    rendering: asyncio.Queue = asyncio.Queue()
+
+    options = render_options()
+
+    async def submit():
+        for page_number in page_numbers:
+            await window.acquire()
+            # 页面 span 从提交渲染开始，到结果保存后结束
+            page_span = tracer.start_span("page", page=page_number + 1)
+            render_span = tracer.start_span("render", parent=page_span)
+            future = asyncio.ensure_future(run_in_render_pool(process_page_job, file, page_number, options))
+            rendering.put_nowait((page_number, future, page_span, render_span))
+
+    submitter = asyncio.create_task(submit())
+    try:
+        for _ in range(len(page_numbers)):
+            page_number, future, page_span, render_span = await rendering.get()
+            try:
+                page = await future
+            except BaseException as e:
+                render_span.end(e)
+                page_span.end(e)
+                raise
+            # 渲染进程中各步骤的耗时
+            for stage, seconds in page["timings"].items():
+                stage_seconds.observe(seconds, stage=stage)
+            render_span.end(**{f"{stage}_seconds": seconds for stage, seconds in page["timings"].items()})
+            page_span.set(route=page["route"])
+            if page["route"] != ROUTE_TEXT:
+                page_span.set(dpi=page["dpi"], width=page["width"], height=page["height"], image_bytes=len(page["image"]))
+            page["span"] = page_span
+            await queue.put((page_number, page))
+    finally:
+        submitter.cancel()
+        while not rendering.empty():
+            rendering.get_nowait()[1].cancel()
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def _recognize_pages(queue: asyncio.Queue, window: asyncio.Semaphore, job: dict):
+    """
+    从识别队列中取出已处理的页面，需要时调用模型识别，每页完成后立即保存到检查点并发布事件
+    开启多页合并时，把队列中已渲染好的后续页面合并到同一次模型请求中
+    :param queue:
+    :param window:
+    :param job: 文档处理上下文
+    :return:
+    """
+    user_id, file_name = job["user_id"], job["file_name"]
+    # 上一轮合并时取出但未放入批次的页面
+    carry = None
+    while True:
+        if carry is not None:
+            item, carry = carry, None
+        else:
+            item = await queue.get()
+            if item is None:
+                return
+            window.release()
+        page_number, page = item
+        if page["route"] == ROUTE_TEXT:
+            # 文本层完整的页面直接使用提取结果，不调用模型
+            await _save_page(job, page_number, page["route"], 0, page["markdown"], page["span"], SOURCE_FRESH)
+            continue
+        batch = [item]
+        if job["batch_pages"] > 1:
+            batch, carry = _take_batch(queue, window, item, job["batch_pages"])
+        try:
+            if len(batch) > 1:
+                image_bytes = sum(len(p["image"]) for _, p in batch)
+                logger.debug(
+                    "合并识别", user_id=user_id, file=file_name, pages=f"{batch[0][0] + 1}-{batch[-1][0] + 1}",
+                    image_bytes=image_bytes
+                )
+                # 合并请求同时属于多个页面，挂在文档 span 下，各页面记录所属的批次
+                with tracer.span("recognize_batch", pages=[n + 1 for n, _ in batch], image_bytes=image_bytes) as span:
+                    for _, p in batch:
+                        p["span"].set(batch=span.span_id)
+                    results, split_ok = await recognize_images([(p["image"], p["mime_type"]) for _, p in batch])
+                    span.set(split_ok=split_ok)
+                # 拆分失败时减少合并页数，成功后逐步恢复
+                if split_ok:
+                    job["batch_pages"] = min(settings.PDF_BATCH_PAGES, job["batch_pages"] + 1)
+                else:
+                    job["batch_pages"] = max(1, job["batch_pages"] // 2)
+            else:
+                logger.debug(
+                    "识别页面", user_id=user_id, file=file_name, page=page_number + 1, dpi=page["dpi"],
+                    size=f"{page['width']}x{page['height']}", image_bytes=len(page["image"])
+                )
+                # 有订阅者时转发模型的流式输出
+                stream = settings.LLM_STREAM and event_broker.has_subscribers(user_id, file_name)
+                on_delta = functools.partial(_publish_delta, job, page_number + 1) if stream else None
+                # 调用图片识别接口，相同页面命中缓存时不再调用模型
+                with tracer.span("recognize", parent=page["span"], image_bytes=len(page["image"])):
+                    results = [await recognize_image(page["image"], page["mime_type"], on_delta)]
+        except BaseException as e:
+            for _, p in batch:
+                p["span"].end(e)
+            raise
+        for (page_number, page), (tokens, image_md, source) in zip(batch, results):
+            image_md = re.sub(r"```markdown", "", image_md)
+            image_md = re.sub(r"```(?=$|\n)", "", image_md)
+            await _save_page(job, page_number, page["route"], tokens, image_md, page["span"], source)
+
+
+def _publish_delta(job: dict, page: int, text: str):
+    event_broker.publish(job["user_id"], job["file_name"], EVENT_DELTA, {"page": page, "text": text})
+
+
+def _take_batch(queue: asyncio.Queue, window: asyncio.Semaphore, first: tuple, max_pages: int) -> tuple[list, tuple | None]:
+    """
+    从识别队列中取出已渲染好的后续页面，与 first 合并为一个批次，不等待尚未渲染完成的页面
+    批次中所有图片的像素总量不超过 PDF_BATCH_MAX_PIXELS，页面图片越大合并的页数越少
+    :param queue:
+    :param window:
+    :param first: 批次的第一页
+    :param max_pages: 最多合并的页数
+    :return: (批次, 取出但不能放入批次的页面)
+    """
+    batch = [first]
+    pixels = first[1]["width"] * first[1]["height"]
+    while len(batch) < max_pages and not queue.empty():
+        item = queue.get_nowait()
+        if item is None:
+            # 结束标记留给其他识别协程
+            queue.put_nowait(None)
+            break
+        window.release()
+        page = item[1]
+        if page["route"] == ROUTE_TEXT or pixels + page["width"] * page["height"] > settings.PDF_BATCH_MAX_PIXELS:
+            return batch, item
+        pixels += page["width"] * page["height"]
+        batch.append(item)
+    return batch, None
+
 
-    if not os.path.exists(upload_dir) or not os.path.exists(result_dir):
-        return 0, None
-    # 上传集
-    # files_list = os.listdir(upload_dir)
-    files_list = [os.path.splitext(f)[0] for f in os.listdir(upload_dir)]
+async def _save_page(job: dict, page_number: int, route: str, tokens: int, markdown: str, span: Span, source: str):
+    """
+    保存单页结果并发布进度
+    :param job: 文档处理上下文
+    :param page_number: 页码，从0开始
+    :param route: 处理方式
+    :param tokens:
+    :param markdown:
+    :param span: 页面 span，保存后结束
+    :param source: 识别结果的来源（SOURCE_*），命中缓存或合并到其他请求的 token 只记录为复用，不计入本次消耗
+    """
+    user_id, file_name = job["user_id"], job["file_name"]
+    # 与复用已处理文档相同，只有实际调用模型的请求计费，命中缓存或合并到其他请求的页面不重复计费
+    reused_tokens = tokens if source != SOURCE_FRESH else 0
+    tokens -= reused_tokens
+    # 先保存片段再记录页面，两者都存在时该页才视为完成
+    with stage_seconds.time(stage="result_write"), tracer.span("result_write", parent=span, bytes=len(markdown)):
+        await write_fragment(job["checkpoint_dir"], page_number, markdown)
+    # 记录每页的处理方式
+    await db.save_page_record(user_id, file_name, page_number, route, tokens, reused_tokens)
+    pages_total.inc(route=route)
+    tokens_total.inc(tokens + reused_tokens, kind=source)
+    span.end(tokens=tokens, reused_tokens=reused_tokens)
+    # 渲染为图片的页面附带自适应选择的 DPI 和像素尺寸
+    render = {}
+    if "dpi" in span.attributes:
+        render = {"dpi": span.attributes["dpi"], "size": f"{span.attributes['width']}x{span.attributes['height']}"}
+    logger.info(
+        "页面处理完成", user_id=user_id, file=file_name, page=page_number + 1, route=route, **render, tokens=tokens,
+        reused_tokens=reused_tokens, duration=round(span.duration, 3), sample=True
+    )
+    job["done"] += 1
+    job["tokens"] += tokens
+    job["reused_tokens"] += reused_tokens
+    await file_state.progress(user_id, file_name, job["done"])
+    event_broker.publish(user_id, file_name, EVENT_PAGE, {
+        "page": page_number + 1,
+        "route": route,
+        "tokens": tokens,
+        "reused_tokens": reused_tokens,
+        "markdown": markdown,
+    })
+    _publish_progress(job)
 
-    # 结果集
-    # result_list = os.listdir(result_dir)
-    result_list = [os.path.splitext(f)[0] for f in os.listdir(result_dir)]
 
-    result = dict.fromkeys(files_list, False)
+async def file_event_stream(user_id: str, file_name: str):
+    """
+    文档处理事件流（Server-Sent Events）
+    先补发检查点中已完成的页面和当前进度，再实时推送后续事件，直到处理完成或失败
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    # 先订阅再补发，避免遗漏两者之间产生的事件
+    queue = event_broker.subscribe(user_id, file_name)
+    try:
+        user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+        checkpoint_dir = get_checkpoint_dir(user_id, file_name)
+        if not os.path.exists(checkpoint_dir) and os.path.exists(f"{result_dir}/{file_name}.md"):
+            # 已处理完成，结果通过 /getfile 获取
+            tokens = await db.read_token_record(user_id, file_name)
+            yield format_sse(EVENT_DONE, {"tokens": tokens or 0})
+            return
+        sent = set()
+        for record in await db.list_page_records(user_id, file_name):
+            fragment = get_fragment_path(checkpoint_dir, record["page"] - 1)
+            if not os.path.exists(fragment):
+                continue
+            async with aiofiles.open(fragment, "r", encoding="utf-8") as f:
+                markdown = await f.read()
+            sent.add(record["page"])
+            yield format_sse(EVENT_PAGE, {**record, "markdown": markdown})
+        progress = event_broker.get_progress(user_id, file_name)
+        if progress:
+            yield format_sse(EVENT_PROGRESS, progress)
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=settings.EVENT_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # 保持连接
+                yield ": keepalive\n\n"
+                continue
+            if event == EVENT_PAGE and data["page"] in sent:
+                continue
+            yield format_sse(event, data)
+            if event in (EVENT_DONE, EVENT_ERROR):
+                return
+    finally:
+        event_broker.unsubscribe(user_id, file_name, queue)
 
-    for file in result_list:
-        result[file] = True
 
-    if False in result.values():
-        return 1, result
-    else:
-        return 2, result
+async def get_status(user_id: str):
+    """
+    查询文件清洗状态
+    :param user_id:
+    :return: (status_type, 各文件是否完成, 各文件的详细状态)
+    """
+    files = await file_state.list_user(user_id)
+    if not files:
+        return 0, None, []
+    result = {file["file_name"]: file["state"] == STATE_DONE for file in files}
+    # 所有文件都已结束（完成或失败）时视为已完成，失败原因见详细状态
+    if any(file["state"] in ACTIVE_STATES for file in files):
+        return 1, result, files
+    return 2, result, files
+
+
+async def get_file_status(user_id: str, file_name: str) -> dict:
+    """
+    查询单个文件的清洗状态
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    status = await file_state.get(user_id, file_name)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"文件不存在: {file_name}")
+    return status
@@ -1,33 +1,69 @@
-import io
+import asyncio
+import os
+import zipfile
+from typing import AsyncIterator
 
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 from fastapi import UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
 
 from config.config import settings
+from core.ocr import recognize_image
+from core.render import run_in_render_pool, verify_image_job
 from core.tools import verify_file_type
 from services.llm import chat_service
+from services.logger import get_logger
+from services.profiler import profile_job
+from services.tracing import tracer, current_span, Span
 
+logger = get_logger("image")
 
-async def image_ocr_service(image: UploadFile = File(...)):
-    # 验证图片类型
-    mime_type = verify_file_type(image.filename, settings.ALLOWED_IMAGE_TYPES)
-    # 读取图片内容
-    image_contents = await image.read()
-    # 并验证是否为有效图片
+
+async def image_ocr_service(image: UploadFile = File(...), profile: bool = False):
+    """
+    图片 OCR，每次调用记录一棵 span 树
+    :param image:
+    :param profile: 是否做性能分析
+    :return:
+    """
+    with tracer.span("image_ocr", file_name=image.filename, model=chat_service.model) as span:
+        async with profile_job(f"image-{image.filename}", profile) as profile_path:
+            if profile_path:
+                span.set(profile=profile_path)
+            return await _image_ocr(image)
+
+
+async def _verify_image(image_contents: bytes) -> str:
+    """
+    在渲染进程中校验图片，不阻塞事件循环
+    :param image_contents:
+    :return: 图片实际格式的 MIME 类型
+    """
     try:
-        img = Image.open(io.BytesIO(image_contents))
-        # 验证图片完整性
-        img.verify()
-    except Exception as e:
+        info = await run_in_render_pool(verify_image_job, image_contents)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError, SyntaxError) as e:
+        # 只有图片本身无效时返回 400，进程池异常等服务端错误照常抛出
+        # PIL 的部分格式解析器对损坏的文件抛出 SyntaxError
         raise HTTPException(
             status_code=400,
             detail=f"无效的图片文件: {str(e)}"
         )
+    current_span().set(image_bytes=len(image_contents), **info)
+    return info["mime_type"]
+
+
+async def _image_ocr(image: UploadFile):
+    # 验证图片类型
+    verify_file_type(image.filename, settings.ALLOWED_IMAGE_TYPES)
+    # 读取图片内容
+    image_contents = await image.read()
+    # 并验证是否为有效图片
+    mime_type = await _verify_image(image_contents)
+    span = current_span()
     try:
         # print(image_contents)
-        # 识别图片
-        total_tokens, result = await chat_service.generate_response(image_contents)
+        # 识别图片，与批量识别共用缓存，相同图片同时识别时只调用一次模型
+        total_tokens, result, _ = await recognize_image(image_contents, mime_type)
+        span.set(tokens=total_tokens)
         return result
     except HTTPException as e:
         raise HTTPException(
@@ -39,3 +75,113 @@ async def image_ocr_service(image: UploadFile = File(...)):
             status_code=400,
             detail=f"服务器内部错误: {str(e)}"
         )
+
+
+async def collect_batch_images(files: list[UploadFile]) -> tuple[list[tuple[str, object]], object]:
+    """
+    展开批量上传的文件，zip 压缩包中的每个文件作为一张图片，此时只读取目录，内容在识别时才读取
+    :param files:
+    :return: ([(文件名, 读取内容的协程函数)], 识别完成后关闭压缩包的函数)
+    """
+    items = []
+    archives = []
+
+    def close():
+        for archive in archives:
+            archive.close()
+
+    try:
+        for file in files:
+            if os.path.splitext(file.filename or "")[1].lower() != ".zip":
+                items.append((file.filename, file.read))
+                continue
+            try:
+                archive = await asyncio.to_thread(zipfile.ZipFile, file.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"无效的压缩包: {file.filename}")
+            archives.append(archive)
+            for info in archive.infolist():
+                name = info.filename
+                # 跳过目录和 macOS 压缩时附带的元数据文件
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("._"):
+                    continue
+                items.append((name, _zip_reader(archive, info)))
+            if len(items) > settings.IMAGE_BATCH_MAX_FILES:
+                break
+        if len(items) > settings.IMAGE_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"图片数量超出限制，最多 {settings.IMAGE_BATCH_MAX_FILES} 张")
+        if not items:
+            raise HTTPException(status_code=400, detail="没有需要识别的图片")
+    except HTTPException:
+        close()
+        raise
+    return items, close
+
+
+def _zip_reader(archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+    async def read() -> bytes:
+        # 按目录中记录的解压后大小提前拒绝，避免解压超大文件
+        if info.file_size > settings.MAX_FILE_SIZE:
+            raise HTTPException(status_code=400, detail="文件大小超出限制. 最大允许大小: 5M")
+        return await asyncio.to_thread(archive.read, info)
+
+    return read
+
+
+async def image_batch_service(items: list[tuple[str, object]], profile: bool = False) -> AsyncIterator[dict]:
+    """
+    批量图片 OCR，最多 IMAGE_BATCH_CONCURRENCY 张同时识别，按完成顺序逐个返回结果
+    单张图片失败不影响其他图片，结果中的 code 不为 200；提前停止迭代时取消未完成的识别
+    :param items: collect_batch_images 返回的图片列表
+    :param profile: 是否做性能分析
+    :return: {"index", "file_name", "code", "message", "data", "tokens"}，index 为图片在上传顺序中的位置
+    """
+    # 结果逐个返回，期间不能持有当前 span，子 span 显式指定父 span
+    batch_span = tracer.start_span("image_batch", images=len(items), model=chat_service.model)
+    semaphore = asyncio.Semaphore(settings.IMAGE_BATCH_CONCURRENCY)
+    failed = 0
+    tokens = 0
+    async with profile_job(f"image-batch-{len(items)}", profile) as profile_path:
+        if profile_path:
+            batch_span.set(profile=profile_path)
+        tasks = [
+            asyncio.create_task(_batch_image_ocr(index, name, read, semaphore, batch_span))
+            for index, (name, read) in enumerate(items)
+        ]
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                failed += result["code"] != 200
+                tokens += result["tokens"]
+                yield result
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端断开等原因提前停止
+            batch_span.set(cancelled=True)
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            batch_span.end(failed=failed, tokens=tokens)
+    logger.info("批量图片识别完成", images=len(items), failed=failed, tokens=tokens)
+
+
+async def _batch_image_ocr(index: int, name: str, read, semaphore: asyncio.Semaphore, parent: Span) -> dict:
+    result = {"index": index, "file_name": name, "code": 200, "message": "success", "data": None, "tokens": 0}
+    async with semaphore:
+        with tracer.span("image_ocr", parent=parent, file_name=name, index=index) as span:
+            try:
+                verify_file_type(name, settings.ALLOWED_IMAGE_TYPES)
+                image_contents = await read()
+                if len(image_contents) > settings.MAX_FILE_SIZE:
+                    raise HTTPException(status_code=400, detail="文件大小超出限制. 最大允许大小: 5M")
+                mime_type = await _verify_image(image_contents)
+                result["tokens"], result["data"], _ = await recognize_image(image_contents, mime_type)
+                span.set(tokens=result["tokens"])
+            except HTTPException as e:
+                span.end(e)
+                result.update(code=e.status_code, message=e.detail)
+            except Exception as e:
+                span.end(e)
+                logger.error("批量图片识别失败", file=name, error=e, sample=True)
+                result.update(code=500, message=f"服务器内部错误: {str(e)}")
+    return result
@@ -0,0 +1,145 @@
+import asyncio
+import re
+
+from config.config import settings
+from services.llm import chat_service, PAGE_MARKER
+from services.logger import get_logger
+from services.ocr_cache import ocr_cache
+from services.single_flight import SingleFlight
+from services.tracing import current_span
+
+logger = get_logger("ocr")
+
+# 正在识别的图片，按缓存键合并相同图片的并发请求
+ocr_flight = SingleFlight("ocr")
+
+# 识别结果的来源：本次调用模型、命中缓存、合并到其他请求，后两者没有实际消耗 token
+SOURCE_FRESH = "fresh"
+SOURCE_CACHED = "cached"
+SOURCE_COALESCED = "coalesced"
+
+# 匹配单独一行的页码标记
+_MARKER_PATTERN = re.compile(
+    r"^[ \t]*" + re.escape(PAGE_MARKER).replace(r"\{\}", r"(\d+)") + r"[ \t]*$", re.MULTILINE
+)
+# 第一个页码标记之前允许出现的内容：空白和代码块标记
+_PREAMBLE_PATTERN = re.compile(r"^(\s|```(markdown)?)*$")
+
+
+def _cache_key(image_contents: bytes) -> str:
+    return ocr_cache.make_key(
+        image_contents, chat_service.model, settings.MY_PROMPT_VL_SYSTEM, settings.MY_PROMPT_VL_USER
+    )
+
+
+async def _coalesce(key: str, func) -> tuple[int, str, str]:
+    """
+    相同图片正在识别时等待同一次模型调用的结果
+    :param key: _cache_key 的结果
+    :param func: 实际调用模型的协程函数
+    :return: (tokens, markdown, 来源)
+    """
+    if not settings.OCR_COALESCE_ENABLED:
+        return *await func(), SOURCE_FRESH
+    source = SOURCE_FRESH
+    if ocr_flight.inflight(key):
+        source = SOURCE_COALESCED
+        span = current_span()
+        if span is not None:
+            span.set(coalesced=True)
+        logger.debug("合并相同图片的识别请求", sample=True)
+    return *await ocr_flight.do(key, func), source
+
+
+async def recognize_image(image_contents: bytes, mime_type: str, on_delta=None) -> tuple[int, str, str]:
+    """
+    图片识别，命中缓存时直接返回缓存结果，不再调用模型；相同图片同时识别时只调用一次模型
+    :param image_contents: 编码后的图片字节
+    :param mime_type:
+    :param on_delta: 流式接收模型输出的回调，命中缓存或合并到其他请求时不会调用
+    :return: (tokens, markdown, 来源)，命中缓存或合并时 tokens 为实际识别时消耗的数量，来源为 SOURCE_*
+    """
+    if not settings.OCR_CACHE_ENABLED:
+        if not settings.OCR_COALESCE_ENABLED:
+            return *await chat_service.generate_response(image_contents, mime_type, on_delta), SOURCE_FRESH
+        return await _coalesce(
+            _cache_key(image_contents), lambda: chat_service.generate_response(image_contents, mime_type, on_delta)
+        )
+    key = _cache_key(image_contents)
+    cached = await ocr_cache.get(key)
+    span = current_span()
+    if span is not None:
+        span.set(cache_hit=cached is not None)
+    if cached is not None:
+        return *cached, SOURCE_CACHED
+
+    async def generate():
+        result = await chat_service.generate_response(image_contents, mime_type, on_delta)
+        await ocr_cache.set(key, *result)
+        return result
+
+    return await _coalesce(key, generate)
+
+
+async def recognize_images(images: list[tuple[bytes, str]]) -> tuple[list[tuple[int, str, str]], bool]:
+    """
+    多页合并识别，未命中缓存的页面合并为一次模型请求，合并识别的结果不写入缓存
+    模型输出无法按页码标记拆分时，改为逐页请求
+    :param images: [(编码后的图片字节, MIME 类型)]，按页码顺序
+    :return: ([(tokens, markdown, 来源)]，与 images 一一对应), 合并请求的输出是否拆分成功
+    """
+    results: list[tuple[int, str, str] | None] = [None] * len(images)
+    if settings.OCR_CACHE_ENABLED:
+        keys = [_cache_key(image_contents) for image_contents, _ in images]
+        for index, key in enumerate(keys):
+            cached = await ocr_cache.get(key)
+            if cached is not None:
+                results[index] = (*cached, SOURCE_CACHED)
+    missing = [index for index, result in enumerate(results) if result is None]
+    span = current_span()
+    if span is not None:
+        span.set(cache_hits=len(images) - len(missing))
+    split_ok = True
+    if len(missing) == 1:
+        results[missing[0]] = await recognize_image(*images[missing[0]])
+    elif missing:
+        tokens, output = await chat_service.generate_batch_response([images[index] for index in missing])
+        pages = split_pages(output, len(missing))
+        if pages is None:
+            split_ok = False
+            logger.warning("合并识别的结果无法按页拆分，改为逐页识别", pages=len(missing))
+            fallback = await asyncio.gather(*(recognize_image(*images[index]) for index in missing))
+            for index, result in zip(missing, fallback):
+                results[index] = result
+            # 拆分失败的合并请求同样消耗了 token，计入第一页
+            first_tokens, first_markdown, _ = results[missing[0]]
+            results[missing[0]] = (first_tokens + tokens, first_markdown, SOURCE_FRESH)
+        else:
+            # 按各页输出长度分摊 token
+            lengths = [max(1, len(page)) for page in pages]
+            shares = [tokens * length // sum(lengths) for length in lengths]
+            shares[0] += tokens - sum(shares)
+            # 拆分出的结果来自多页提示词，token 数也是估算值，不写入按单页提示词计算键的缓存
+            for index, share, markdown in zip(missing, shares, pages):
+                results[index] = (share, markdown, SOURCE_FRESH)
+    return results, split_ok
+
+
+def split_pages(output: str, count: int) -> list[str] | None:
+    """
+    按页码标记拆分多页识别的输出
+    :param output: 模型输出
+    :param count: 页数
+    :return: 各页的 markdown，标记缺失、重复或顺序不符时返回 None
+    """
+    matches = list(_MARKER_PATTERN.finditer(output))
+    if [int(match.group(1)) for match in matches] != list(range(1, count + 1)):
+        return None
+    if not _PREAMBLE_PATTERN.match(output[:matches[0].start()]):
+        return None
+    pages = []
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < count else len(output)
+        # 与逐页识别的结果一样以换行结尾，拼接时页面之间不会粘连
+        pages.append(output[match.end():end].strip("\n") + "\n")
+    return pages
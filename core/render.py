@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import io
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+from PIL import Image
+
+from config.config import settings
+from services.metrics import render_inflight
+from core.text_layer import ROUTE_TEXT, get_text_dict, analyze_page, classify_page, text_dict_to_markdown
+
+# 支持的页面图片编码格式及对应的 MIME 类型
+IMAGE_FORMATS = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+# 每个渲染进程最多同时保持打开的文档数
+MAX_OPEN_DOCUMENTS = 4
+
+# 渲染进程内的文档缓存：(路径, 修改时间, 大小) -> fitz.Document
+_documents: OrderedDict = OrderedDict()
+# 主进程中的渲染进程池，首次使用时创建
+_render_pool: ProcessPoolExecutor | None = None
+
+
+def normalize_image_format(image_format: str) -> str:
+    """
+    规范化图片编码格式名称
+    :param image_format: PNG / JPEG(JPG) / WEBP，大小写不敏感
+    :return:
+    """
+    image_format = image_format.strip().upper()
+    if image_format == "JPG":
+        image_format = "JPEG"
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片编码格式: {image_format}，可选: {', '.join(IMAGE_FORMATS)}")
+    return image_format
+
+
+def encode_pixmap(pix: fitz.Pixmap, image_format: str = "PNG", quality: int = 85) -> tuple[bytes, str]:
+    """
+    将 pixmap 直接编码为图片字节，全程在内存中完成，不落盘
+    :param pix:
+    :param image_format: PNG / JPEG / WEBP
+    :param quality: JPEG、WEBP 的压缩质量（1-100），PNG 忽略该参数
+    :return: (图片字节, MIME 类型)
+    """
+    image_format = normalize_image_format(image_format)
+    if image_format == "PNG":
+        data = pix.tobytes("png")
+    elif image_format == "JPEG":
+        data = pix.tobytes("jpeg", jpg_quality=quality)
+    else:
+        # PyMuPDF 不支持直接输出 WEBP，借助 PIL 编码
+        mode = "RGBA" if pix.alpha else "RGB"
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        buffer = io.BytesIO()
+        img.save(buffer, format="WEBP", quality=quality)
+        data = buffer.getvalue()
+    return data, IMAGE_FORMATS[image_format]
+
+
+def choose_dpi(page: fitz.Page, features: dict, options: dict) -> int:
+    """
+    按页面选择渲染分辨率
+    有文本层时按较小文字的字号计算，使其渲染后达到目标像素高度；扫描页等没有文本层的页面使用最大 DPI
+    结果再受像素预算（模型可用的最大图片尺寸）和上下限约束
+    :param page:
+    :param features: analyze_page 的结果
+    :param options: render_options 的结果
+    :return:
+    """
+    if options["dpi"]:
+        return options["dpi"]
+    font_size = features.get("small_font_size") or 0
+    if features.get("chars") and font_size > 0:
+        dpi = options["glyph_px"] * 72 / font_size
+    else:
+        dpi = options["max_dpi"]
+    # 像素预算对应的最大 DPI
+    page_area = page.rect.width * page.rect.height
+    if page_area > 0 and options["max_pixels"] > 0:
+        dpi = min(dpi, 72 * (options["max_pixels"] / page_area) ** 0.5)
+    return int(max(options["min_dpi"], min(options["max_dpi"], dpi)))
+
+
+def _open_document(file: str) -> fitz.Document:
+    """
+    在渲染进程内打开文档并缓存，同一进程处理同一文档的后续页面时直接复用
+    文件被同名覆盖后修改时间或大小会变化，缓存随之失效
+    :param file:
+    :return:
+    """
+    stat = os.stat(file)
+    key = (os.path.abspath(file), stat.st_mtime_ns, stat.st_size)
+    document = _documents.get(key)
+    if document is not None:
+        _documents.move_to_end(key)
+        return document
+    document = fitz.open(file)
+    _documents[key] = document
+    while len(_documents) > MAX_OPEN_DOCUMENTS:
+        _, expired = _documents.popitem(last=False)
+        expired.close()
+    return document
+
+
+def page_count_job(file: str) -> int:
+    """
+    渲染进程任务：获取文档页数
+    :param file:
+    :return:
+    """
+    return _open_document(file).page_count
+
+
+def verify_image_job(image_contents: bytes) -> dict:
+    """
+    渲染进程任务：校验上传图片的完整性并识别实际格式
+    :param image_contents:
+    :return: {"mime_type", "width", "height"}，图片无效时抛出异常
+    """
+    img = Image.open(io.BytesIO(image_contents))
+    # 验证图片完整性
+    img.verify()
+    # 按图片实际格式确定 MIME 类型
+    return {"mime_type": Image.MIME.get(img.format, "image/png"), "width": img.width, "height": img.height}
+
+
+def render_options() -> dict:
+    """
+    页面处理参数，由主进程读取配置后传给渲染进程
+    :return:
+    """
+    return {
+        "dpi": settings.PDF_RENDER_DPI,
+        "min_dpi": settings.PDF_RENDER_MIN_DPI,
+        "max_dpi": settings.PDF_RENDER_MAX_DPI,
+        "max_pixels": settings.PDF_RENDER_MAX_PIXELS,
+        "glyph_px": settings.PDF_RENDER_GLYPH_PX,
+        "image_format": settings.PDF_IMAGE_FORMAT,
+        "quality": settings.PDF_IMAGE_QUALITY,
+        "routing": settings.PDF_TEXT_ROUTING,
+        "min_chars": settings.PDF_TEXT_MIN_CHARS,
+        "max_image_coverage": settings.PDF_TEXT_MAX_IMAGE_COVERAGE,
+        "max_drawings": settings.PDF_TEXT_MAX_DRAWINGS,
+    }
+
+
+def process_page_job(file: str, page_number: int, options: dict) -> dict:
+    """
+    渲染进程任务：判断页面处理方式，文本页直接提取 Markdown，其余页面渲染并编码为图片
+    :param file:
+    :param page_number: 页码，从0开始
+    :param options: render_options 的结果
+    :return: 页面处理结果，route 为 text 时包含 markdown，为 vlm 时包含 image、mime_type 及渲染的 dpi、width、height
+        timings 为各步骤耗时（秒）
+    """
+    start = time.perf_counter()
+    page = _open_document(file).load_page(page_number)
+    text_dict = get_text_dict(page)
+    features = analyze_page(page, text_dict)
+    route = classify_page(features, options)
+    timings = {"page_analyze": time.perf_counter() - start}
+    result = {"page_number": page_number, "route": route, "features": features, "timings": timings}
+    if route == ROUTE_TEXT:
+        start = time.perf_counter()
+        result["markdown"] = text_dict_to_markdown(page, text_dict)
+        timings["text_extract"] = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        dpi = choose_dpi(page, features, options)
+        pix = page.get_pixmap(dpi=dpi)
+        timings["page_render"] = time.perf_counter() - start
+        start = time.perf_counter()
+        result["image"], result["mime_type"] = encode_pixmap(pix, options["image_format"], options["quality"])
+        timings["image_encode"] = time.perf_counter() - start
+        result.update(dpi=dpi, width=pix.width, height=pix.height)
+    return result
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    获取页面渲染进程池，使用 spawn 方式创建，避免复制主进程中的事件循环、连接等状态
+    :return:
+    """
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=settings.RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _render_pool
+
+
+def shutdown_render_pool():
+    """
+    关闭页面渲染进程池
+    :return:
+    """
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True, cancel_futures=True)
+        _render_pool = None
+
+
+async def run_in_render_pool(func, *args):
+    """
+    在渲染进程池中执行任务，不阻塞事件循环
+    :param func: 模块级函数
+    :param args:
+    :return:
+    """
+    global _render_pool
+    loop = asyncio.get_running_loop()
+    try:
+        with render_inflight.track_inprogress():
+            return await loop.run_in_executor(get_render_pool(), functools.partial(func, *args))
+    except BrokenProcessPool:
+        # 渲染进程异常退出后进程池不可再用，丢弃后下次重新创建
+        _render_pool = None
+        raise
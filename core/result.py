@@ -0,0 +1,209 @@
+import base64
+import json
+import os
+from email.utils import parsedate_to_datetime
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from config.config import settings
+from core.tools import get_dir, get_index_path
+
+
+def get_result_file(user_id: str, file_name: str) -> str:
+    """
+    :param user_id:
+    :param file_name: 不带后缀名
+    :return:
+    """
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    return f"{result_dir}/{file_name}.md"
+
+
+async def write_index(result_file: str, offsets: list[int]):
+    """
+    保存页索引，先写临时文件再重命名
+    :param result_file:
+    :param offsets: 每页的起始字节位置，最后一项为文件大小，共 页数 + 1 项
+    """
+    path = get_index_path(result_file)
+    async with aiofiles.open(path + ".tmp", "w", encoding="utf-8") as f:
+        await f.write(json.dumps({"size": offsets[-1], "offsets": offsets}))
+    await aiofiles.os.replace(path + ".tmp", path)
+
+
+async def load_index(result_file: str, size: int) -> list[int]:
+    """
+    读取页索引，与结果文件大小不一致（结果被覆盖）或没有索引（此前生成的结果）时整个文件视为一页
+    :param result_file:
+    :param size: 结果文件大小
+    :return: 每页的起始字节位置，最后一项为文件大小
+    """
+    try:
+        async with aiofiles.open(get_index_path(result_file), "r", encoding="utf-8") as f:
+            offsets = json.loads(await f.read())["offsets"]
+        if offsets and offsets[0] == 0 and offsets[-1] == size:
+            return offsets
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return [0, size]
+
+
+def _version(stat: os.stat_result) -> str:
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, stat: os.stat_result) -> dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if data["unit"] not in ("page", "byte") or not isinstance(data["start"], int) or not isinstance(data["count"], int):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="游标无效")
+    if data.get("version") != _version(stat):
+        raise HTTPException(status_code=409, detail="结果已更新，请重新获取")
+    return data
+
+
+def _utf8_bounds(data: bytes, at_eof: bool) -> tuple[int, int]:
+    """
+    把字节范围收缩到完整的 UTF-8 字符边界
+    :param data:
+    :param at_eof: 范围是否到文件末尾，到末尾时不需要收缩结尾
+    :return: (开头跳过的字节数, 结尾位置)
+    """
+    start = 0
+    while start < min(3, len(data)) and data[start] & 0xC0 == 0x80:
+        start += 1
+    end = len(data)
+    if not at_eof:
+        for back in range(1, min(4, end - start) + 1):
+            byte = data[end - back]
+            if byte & 0xC0 == 0x80:
+                continue
+            if byte >= 0xC0:
+                width = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+                if width > back:
+                    end -= back
+            break
+    return start, end
+
+
+async def _read(result_file: str, start: int, end: int) -> bytes:
+    async with aiofiles.open(result_file, "rb") as f:
+        await f.seek(start)
+        return await f.read(end - start)
+
+
+async def read_result_range(
+        result_file: str, page: int = None, page_size: int = None, offset: int = None, length: int = None,
+        cursor: str = ""
+) -> dict:
+    """
+    按页或按字节读取结果的一部分，cursor 为上一次返回的 next_cursor，传入时忽略其他参数
+    :param result_file:
+    :param page: 起始页码，从1开始
+    :param page_size: 页数，默认 RESULT_PAGE_SIZE
+    :param offset: 起始字节位置，不在字符边界时从下一个完整字符开始
+    :param length: 字节数，默认 RESULT_RANGE_BYTES，结尾不在字符边界时截到上一个完整字符
+    :param cursor:
+    :return: {"content", "range", "next_cursor"}，range 中 end 不包含在内，没有后续内容时 next_cursor 为 None
+    """
+    try:
+        stat = await aiofiles.os.stat(result_file)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"文件不存在或未清洗完成: {os.path.basename(result_file)}")
+    if cursor:
+        data = _decode_cursor(cursor, stat)
+        unit, start, count = data["unit"], data["start"], data["count"]
+    elif page is not None:
+        unit, start, count = "page", page - 1, page_size or settings.RESULT_PAGE_SIZE
+    else:
+        unit, start, count = "byte", offset, length or settings.RESULT_RANGE_BYTES
+    if start < 0 or count <= 0:
+        raise HTTPException(status_code=400, detail="范围参数错误")
+
+    size = stat.st_size
+    if unit == "page":
+        offsets = await load_index(result_file, size)
+        total = len(offsets) - 1
+        if start >= total:
+            raise HTTPException(status_code=416, detail=f"页码超出范围，共 {total} 页")
+        end = min(start + min(count, settings.RESULT_MAX_PAGES), total)
+        content = (await _read(result_file, offsets[start], offsets[end])).decode("utf-8", errors="replace")
+        result_range = {"unit": "page", "start": start + 1, "end": end + 1, "total": total}
+    else:
+        if start > size or start == size > 0:
+            raise HTTPException(status_code=416, detail=f"起始位置超出范围，文件大小 {size} 字节")
+        # 至少读取一个完整字符
+        end = min(start + max(min(count, settings.RESULT_MAX_RANGE_BYTES), 4), size)
+        data = await _read(result_file, start, end)
+        skip, cut = _utf8_bounds(data, end == size)
+        cut = max(cut, skip)
+        content = data[skip:cut].decode("utf-8", errors="replace")
+        start, end = start + skip, start + cut
+        result_range = {"unit": "byte", "start": start, "end": end, "total": size}
+
+    next_cursor = None
+    if end < (total if unit == "page" else size):
+        next_cursor = _encode_cursor({"unit": unit, "start": end, "count": count, "version": _version(stat)})
+    return {"content": content, "range": result_range, "next_cursor": next_cursor}
+
+
+async def read_page_index(result_file: str) -> dict:
+    """
+    页索引，供按 HTTP Range 直接读取原始文件的客户端使用
+    :param result_file:
+    :return: {"size", "pages": [[起始字节, 结束字节], ...]}，结束字节不包含在内
+    """
+    try:
+        stat = await aiofiles.os.stat(result_file)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"文件不存在或未清洗完成: {os.path.basename(result_file)}")
+    offsets = await load_index(result_file, stat.st_size)
+    return {"size": stat.st_size, "pages": [[offsets[i], offsets[i + 1]] for i in range(len(offsets) - 1)]}
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match 优先于 If-Modified-Since，按弱比较
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def result_file_response(request: Request, result_file: str, filename: str) -> Response:
+    """
+    直接返回结果文件，支持 Range 请求（断点续传、按页索引读取部分内容）和条件请求（未变化时返回 304）
+    :param request:
+    :param result_file:
+    :param filename: 下载的文件名
+    :return:
+    """
+    try:
+        stat = await aiofiles.os.stat(result_file)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"文件不存在或未清洗完成: {os.path.basename(result_file)}")
+    response = FileResponse(
+        result_file, stat_result=stat, media_type="text/markdown; charset=utf-8", filename=filename,
+        content_disposition_type="inline"
+    )
+    if request.method in ("GET", "HEAD") and _not_modified(request, response.headers["etag"], stat.st_mtime):
+        return Response(status_code=304, headers={
+            "etag": response.headers["etag"],
+            "last-modified": response.headers["last-modified"],
+        })
+    return response
@@ -0,0 +1,263 @@
+import re
+from collections import Counter
+
+import fitz
+
+# 页面处理方式：直接提取文本层 / 调用视觉模型识别
+ROUTE_TEXT = "text"
+ROUTE_VLM = "vlm"
+
+# 字体标志位：粗体
+_FLAG_BOLD = 16
+# 常见的 OCR 隐藏文本层字体
+_OCR_FONTS = ("glyphless",)
+# 列表项前缀；编号只识别数字，字母编号容易误判人名缩写等，且不是 Markdown 有序列表
+# -、*、– 后必须有空白，避免把 "-5%"、"*注"、"–0.3" 等负数和注释误判为列表项
+_BULLET_PATTERN = re.compile(r"^\s*(?:[•●○◦▪■□◆◇·‣⁃]\s*|[\-*–]\s+)")
+_NUMBERED_PATTERN = re.compile(r"^\s*(\d{1,3})([.)、])\s+")
+# 中日韩字符，行与行之间拼接时不插入空格
+_CJK_PATTERN = re.compile(r"[　-〿぀-ヿ㐀-鿿＀-￯]")
+# 字号不小于正文字号的该倍数时视为标题
+_HEADING_RATIO = 1.15
+# 列表项的续行比列表项开头至少缩进的距离（pt）
+_LIST_INDENT = 1.0
+# 行间空白超过行高的该倍数时视为分段，列表在此结束
+_PARAGRAPH_GAP_RATIO = 0.5
+# 与提示词中的标题层级保持一致，从 ## 开始
+_HEADING_LEVELS = ("##", "###", "####", "#####")
+
+
+def get_text_dict(page: fitz.Page) -> dict:
+    """
+    提取页面文本结构（不含图片数据）
+    :param page:
+    :return:
+    """
+    return page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES, sort=True)
+
+
+def analyze_page(page: fitz.Page, text_dict: dict) -> dict:
+    """
+    统计页面特征，用于判断页面是否可以直接使用文本层
+    :param page:
+    :param text_dict: get_text_dict 的结果
+    :return:
+    """
+    page_area = abs(page.rect) or 1
+    chars = 0
+    hidden_chars = 0
+    replacement_chars = 0
+    for span in _iter_spans(text_dict):
+        text = span["text"].strip()
+        if not text:
+            continue
+        chars += len(text)
+        replacement_chars += text.count("�")
+        # 透明文字或 OCR 字体，通常是扫描件上叠加的识别结果
+        if span.get("alpha", 255) == 0 or span["font"].lower().startswith(_OCR_FONTS):
+            hidden_chars += len(text)
+    image_area = 0
+    for info in page.get_image_info():
+        image_area += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return {
+        "chars": chars,
+        "small_font_size": _small_font_size(text_dict),
+        "hidden_ratio": hidden_chars / chars if chars else 0,
+        "replacement_ratio": replacement_chars / chars if chars else 0,
+        "image_coverage": min(1.0, image_area / page_area),
+        "drawings": len(page.get_cdrawings()),
+    }
+
+
+def classify_page(features: dict, policy: dict) -> str:
+    """
+    根据页面特征和路由策略选择处理方式
+    :param features: analyze_page 的结果
+    :param policy: routing: auto / text / vlm，以及 auto 模式下的各项阈值
+    :return: ROUTE_TEXT 或 ROUTE_VLM
+    """
+    routing = policy["routing"]
+    if routing == ROUTE_VLM or features["chars"] == 0:
+        return ROUTE_VLM
+    if routing == ROUTE_TEXT:
+        return ROUTE_TEXT
+    if features["chars"] < policy["min_chars"]:
+        return ROUTE_VLM
+    if features["hidden_ratio"] > 0.5 or features["replacement_ratio"] > 0.05:
+        return ROUTE_VLM
+    if features["image_coverage"] > policy["max_image_coverage"]:
+        return ROUTE_VLM
+    if features["drawings"] > policy["max_drawings"]:
+        return ROUTE_VLM
+    return ROUTE_TEXT
+
+
+def text_dict_to_markdown(page: fitz.Page, text_dict: dict) -> str:
+    """
+    将页面文本层转换为 Markdown，保留标题、列表和阅读顺序
+    :param page:
+    :param text_dict: get_text_dict 的结果
+    :return:
+    """
+    blocks = [block for block in text_dict["blocks"] if block.get("type") == 0 and block.get("lines")]
+    if not blocks:
+        return ""
+    body_size = _body_font_size(text_dict)
+    heading_sizes = sorted(
+        {round(size, 1) for size in _span_sizes(text_dict) if size >= body_size * _HEADING_RATIO},
+        reverse=True,
+    )
+    lines_md = []
+    for block in _reading_order(blocks, page.rect.width):
+        lines_md.extend(_block_to_markdown(block, body_size, heading_sizes))
+        lines_md.append("")
+    return "\n" + "\n".join(lines_md).strip() + "\n"
+
+
+def _iter_spans(text_dict: dict):
+    for block in text_dict["blocks"]:
+        for line in block.get("lines", []):
+            yield from line["spans"]
+
+
+def _span_sizes(text_dict: dict):
+    for span in _iter_spans(text_dict):
+        if span["text"].strip():
+            yield span["size"]
+
+
+def _body_font_size(text_dict: dict) -> float:
+    """按字符数加权，出现最多的字号视为正文字号"""
+    counter = Counter()
+    for span in _iter_spans(text_dict):
+        counter[round(span["size"], 1)] += len(span["text"].strip())
+    return counter.most_common(1)[0][0] if counter else 0
+
+
+def _small_font_size(text_dict: dict) -> float:
+    """按字符数加权的第10百分位字号，代表页面上需要看清的较小文字，忽略个别极小字符"""
+    counter = Counter()
+    for span in _iter_spans(text_dict):
+        counter[round(span["size"], 1)] += len(span["text"].strip())
+    total = sum(counter.values())
+    if not total:
+        return 0
+    seen = 0
+    for size in sorted(counter):
+        seen += counter[size]
+        if seen >= total * 0.1:
+            return size
+    return 0
+
+
+def _reading_order(blocks: list, page_width: float) -> list:
+    """
+    双栏排版时按 通栏 -> 左栏 -> 右栏 的顺序输出，单栏保持从上到下
+    :param blocks:
+    :param page_width:
+    :return:
+    """
+    middle = page_width / 2
+    ordered = []
+    left, right = [], []
+    for block in sorted(blocks, key=lambda b: (b["bbox"][1], b["bbox"][0])):
+        x0, _, x1, _ = block["bbox"]
+        if x1 <= middle + 5:
+            left.append(block)
+        elif x0 >= middle - 5:
+            right.append(block)
+        else:
+            # 通栏块：先输出之前积累的左右两栏
+            ordered.extend(left)
+            ordered.extend(right)
+            left, right = [], []
+            ordered.append(block)
+    ordered.extend(left)
+    ordered.extend(right)
+    return ordered
+
+
+def _line_text(line: dict) -> str:
+    return "".join(span["text"] for span in line["spans"]).strip()
+
+
+def _join_lines(lines: list) -> str:
+    """将同一段落的多行拼接为一行，处理英文断词和中文换行"""
+    text = ""
+    for line in lines:
+        if not text:
+            text = line
+        elif text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line
+        elif _CJK_PATTERN.match(text[-1]) or _CJK_PATTERN.match(line[0]):
+            text += line
+        else:
+            text += " " + line
+    return text
+
+
+def _block_to_markdown(block: dict, body_size: float, heading_sizes: list) -> list:
+    lines = []
+    for line in block["lines"]:
+        text = _line_text(line)
+        if not text:
+            continue
+        spans = [span for span in line["spans"] if span["text"].strip()]
+        size = round(max(span["size"] for span in spans), 1)
+        bold = all(span["flags"] & _FLAG_BOLD for span in spans)
+        lines.append((text, size, bold, line["bbox"]))
+    if not lines:
+        return []
+
+    # 整块字号较大：标题
+    block_size = min(size for _, size, _, _ in lines)
+    if heading_sizes and block_size in heading_sizes:
+        level = _HEADING_LEVELS[min(heading_sizes.index(block_size), len(_HEADING_LEVELS) - 1)]
+        return [f"{level} {_join_lines([text for text, _, _, _ in lines])}"]
+    # 单行加粗短句：小标题
+    if len(lines) == 1 and lines[0][2] and len(lines[0][0]) <= 80:
+        return [f"**{lines[0][0]}**"]
+
+    result = []
+    paragraph = []
+    # 当前列表项开头的左边界，不在列表中时为 None
+    item_x0 = None
+    previous = None
+    for text, _, _, bbox in lines:
+        bullet = _BULLET_PATTERN.match(text)
+        numbered = _NUMBERED_PATTERN.match(text)
+        if item_x0 is not None and not (bullet or numbered) and not _continues_item(bbox, item_x0, previous):
+            item_x0 = None
+        previous = bbox
+        if bullet or numbered:
+            if paragraph:
+                result.append(_join_lines(paragraph))
+                paragraph = []
+            if bullet:
+                result.append("- " + text[bullet.end():])
+            else:
+                result.append(f"{numbered.group(1)}. " + text[numbered.end():])
+            item_x0 = bbox[0]
+        elif item_x0 is not None:
+            # 列表项换行后的续行
+            result[-1] = _join_lines([result[-1], text])
+        else:
+            paragraph.append(text)
+    if paragraph:
+        result.append(_join_lines(paragraph))
+    return result
+
+
+def _continues_item(bbox: tuple, item_x0: float, previous: tuple) -> bool:
+    """
+    列表项之后的普通行是否为该列表项的续行：相对列表项开头有缩进，且与上一行之间没有分段的空白
+    回到列表项的左边界或与上一行间隔较大时，视为列表之后的普通段落
+    :param bbox: 当前行的 bbox
+    :param item_x0: 列表项开头的左边界
+    :param previous: 上一行的 bbox
+    :return:
+    """
+    if bbox[0] < item_x0 + _LIST_INDENT:
+        return False
+    line_height = previous[3] - previous[1]
+    return bbox[1] - previous[3] <= line_height * _PARAGRAPH_GAP_RATIO
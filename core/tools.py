@@ -1,11 +1,22 @@
+import codecs
+import hashlib
 import os
 import re
 import shutil
-from asyncio import sleep
+import uuid
+from typing import AsyncIterator
+from urllib.parse import quote
 
-from fastapi import UploadFile, HTTPException
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile, HTTPException, Request
+from fastapi.responses import StreamingResponse
 
 from config.config import settings
+from services.logger import get_logger
+from services.metrics import stage_seconds, errors_total
+
+logger = get_logger("tools")
 
 
 def verify_file_type(filename: str, allowed_types: list):
@@ -46,42 +57,216 @@ async def process_str(text: str) -> str:
     """
     if text == "" or text == " ":
         return text
-    n: str = os.linesep
-    normalized_content = re.sub(r"\\r\\n", n, text)
-    normalized_content = re.sub(r"\\n", n, normalized_content)
-    normalized_content = re.sub(r"(?<=^)```markdown", "", normalized_content)
-    normalized_content = re.sub(r"```(?=$)", "", normalized_content)
+    normalizer = MarkdownNormalizer()
+    return normalizer.feed(text) + normalizer.close()
+
+
+class MarkdownNormalizer:
+    """
+    增量处理下载内容，结果与逐次 re.sub 处理整个字符串相同：
+    字面的 \\r\\n、\\n 换成换行符，去掉开头的 ```markdown 和结尾的 ```
+    按块输入，每块只扫描一遍；末尾保留几个字符，跨块的转义和结尾的 ``` 在下一块或 close 时处理
+    已保存的结果本身就是 Markdown，不能替换转义，否则 LaTeX 的 \\nabla、路径中的 \\n 等会被改写
+    """
+
+    _ESCAPE = re.compile(r"\\r\\n|\\n")
+    _OPENING = "```markdown"
+    _CLOSING = re.compile(r"```(?=$)")
+    # 输入保留的字符数，不少于最长的转义序列；输出保留的字符数，不少于结尾的 ``` 加一个换行
+    _INPUT_HOLD = len("\\r\\n") - 1
+    _OUTPUT_HOLD = len("```") + 1
+
+    def __init__(self, unescape: bool = True):
+        """
+        :param unescape: 是否把字面的 \\r\\n、\\n 换成换行符，为 False 时只去掉前后的 ```
+        """
+        self.unescape = unescape
+        self._pending = ""
+        self._output = ""
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        :param chunk:
+        :return: 可以输出的部分，可能为空
+        """
+        self._pending += chunk
+        if not self._started:
+            # 开头不足 ```markdown 的长度时无法判断，继续等待
+            if len(self._pending) < len(self._OPENING) and self._OPENING.startswith(self._pending):
+                return ""
+            self._started = True
+            if self._pending.startswith(self._OPENING):
+                self._pending = self._pending[len(self._OPENING):]
+        self._unescape(len(self._pending) - self._INPUT_HOLD)
+        if len(self._output) <= self._OUTPUT_HOLD:
+            return ""
+        ready, self._output = self._output[:-self._OUTPUT_HOLD], self._output[-self._OUTPUT_HOLD:]
+        return ready
+
+    def close(self) -> str:
+        """
+        :return: 剩余的部分
+        """
+        if not self._started and self._pending == self._OPENING:
+            self._pending = ""
+        self._started = True
+        self._unescape(len(self._pending))
+        output, self._output = self._output, ""
+        return self._CLOSING.sub("", output)
+
+    def _unescape(self, limit: int):
+        """
+        替换 limit 之前开始的转义序列，其余的留到下次
+        """
+        if limit <= 0:
+            return
+        parts = [self._output]
+        position = 0
+        for match in self._ESCAPE.finditer(self._pending) if self.unescape else ():
+            if match.start() >= limit:
+                break
+            parts.append(self._pending[position:match.start()])
+            parts.append(os.linesep)
+            position = match.end()
+        end = max(position, limit)
+        parts.append(self._pending[position:end])
+        self._output = "".join(parts)
+        self._pending = self._pending[end:]
+
+
+async def normalize_stream(chunks: AsyncIterator[str], unescape: bool = True) -> AsyncIterator[bytes]:
+    """
+    逐块规范化并编码为 UTF-8，用作 StreamingResponse 的内容
+    :param chunks:
+    :param unescape: 是否替换字面的换行转义
+    :return:
+    """
+    normalizer = MarkdownNormalizer(unescape)
+    async for chunk in chunks:
+        output = normalizer.feed(chunk)
+        if output:
+            yield output.encode("utf-8")
+    output = normalizer.close()
+    if output:
+        yield output.encode("utf-8")
+
+
+async def decode_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    把请求体等字节流按 UTF-8 增量解码，跨块的多字节字符在下一块补齐后输出
+    :param chunks:
+    :return:
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def iter_body(request: Request) -> AsyncIterator[str] | None:
+    """
+    按块读取请求体并解码，不整体读入内存
+    :param request:
+    :return: 请求体为空时返回 None
+    """
+    stream = request.stream()
+    first = b""
+    async for chunk in stream:
+        if chunk:
+            first = chunk
+            break
+    if not first:
+        return None
+
+    async def chunks():
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    return decode_stream(chunks())
+
+
+async def iter_str(text: str) -> AsyncIterator[str]:
+    """
+    把已在内存中的字符串作为只有一块的流
+    """
+    yield text
 
-    return normalized_content
+
+def markdown_response(chunks: AsyncIterator[str], filename: str, unescape: bool = True) -> StreamingResponse:
+    """
+    规范化后以附件形式流式返回
+    :param chunks:
+    :param filename: 下载的文件名，可以包含中文
+    :param unescape: 是否替换字面的换行转义，已保存的结果传 False
+    :return:
+    """
+    fallback = re.sub(r"[^\w.-]", "_", filename.encode("ascii", "replace").decode("ascii"))
+    return StreamingResponse(
+        normalize_stream(chunks, unescape),
+        media_type="text/markdown; charset=utf-8",
+        headers={
+            "Content-Disposition": f"attachment; filename={fallback}; filename*=UTF-8''{quote(filename)}",
+        }
+    )
 
 
-async def save_file(file: UploadFile, user_id: str = "") -> str:
+async def save_file(file: UploadFile, user_id: str = "") -> tuple[str, str, int]:
     """
-    保存上传的文件
+    保存上传的文件，分块流式写入磁盘，写入的同时计算内容哈希和大小
+    先写入临时文件，完成后原子重命名，上传中断或超过大小上限时不会覆盖同名的旧文件
     :param file:
     :param user_id:
-    :return: 保存后的文件路径
+    :return: (保存后的文件路径, 内容的 SHA-256, 文件大小)
     """
     # 构建文件保存路径
     upload_dir, temp_dir, result_dir = await create_dir(user_id)
     file_path = os.path.join(upload_dir, file.filename)
-
-    if os.path.exists(file_path):
-        print(f"文件已存在，删除旧文件: {file_path}")
-        os.remove(file_path)
-        result_path = result_dir + "/" + os.path.splitext(file.filename)[0] + ".md"
-        if os.path.exists(result_path):
-            os.remove(result_path)
-            print(f"删除旧文件: {result_path}")
+    # 同名文件并发上传时各自写入不同的临时文件
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
     # 保存文件到本地
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()  # 读取文件内容
-            buffer.write(content)  # 写入文件到本地
+        with stage_seconds.time(stage="upload_save"):
+            async with aiofiles.open(temp_path, "wb") as buffer:
+                while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > settings.MAX_UPLOAD_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"文件过大，最大允许 {settings.MAX_UPLOAD_SIZE // (1024 * 1024)}MB"
+                        )
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+            await aiofiles.os.replace(temp_path, file_path)
+    except HTTPException:
+        await _remove_quietly(temp_path)
+        raise
     except Exception as e:
+        errors_total.inc(stage="upload_save")
+        await _remove_quietly(temp_path)
         raise HTTPException(status_code=500, detail=f"上传时文件保存失败: {str(e)}")
-    await sleep(1)
-    return file_path
+    # 覆盖了同名文件时清除旧文件的清洗结果
+    result_path = result_dir + "/" + os.path.splitext(file.filename)[0] + ".md"
+    if os.path.exists(result_path):
+        os.remove(result_path)
+        logger.info("删除旧文件的清洗结果", path=result_path)
+    await _remove_quietly(get_index_path(result_path))
+    logger.info("文件保存成功", user_id=user_id, path=file_path, size=size, sha256=digest.hexdigest())
+    return file_path, digest.hexdigest(), size
+
+
+async def _remove_quietly(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
 
 
 async def create_dir(user_id: str):
@@ -93,20 +278,20 @@ async def create_dir(user_id: str):
     user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
     if not os.path.exists(f'{settings.UPLOAD_DIR}'):
         os.makedirs(f'{settings.UPLOAD_DIR}')
-        print(f"创建文件夹 {settings.UPLOAD_DIR} 成功")
+        logger.info("创建文件夹", path=settings.UPLOAD_DIR)
     if not os.path.exists(user_dir):
         os.makedirs(user_dir)
-        print(f"创建 {user_id} 文件夹成功")
+        logger.info("创建文件夹", path=user_dir)
     if not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
-        print("创建 temp 文件夹成功")
+        logger.info("创建文件夹", path=temp_dir)
     if not os.path.exists(result_dir):
         os.makedirs(result_dir)
-        print("创建 result 文件夹成功")
+        logger.info("创建文件夹", path=result_dir)
     # os.makedirs(upload_dir, exist_ok=True)
     if not os.path.exists(upload_dir):
         os.makedirs(upload_dir)
-        print("创建 upload 文件夹成功")
+        logger.info("创建文件夹", path=upload_dir)
     return upload_dir, temp_dir, result_dir
 
 
@@ -124,6 +309,15 @@ def get_dir(user_id: str):
     return user_dir, upload_dir, temp_dir, result_dir
 
 
+def get_index_path(result_file: str) -> str:
+    """
+    结果文件对应的页索引路径，与结果文件放在同一目录，记录每页在结果文件中的字节位置
+    :param result_file:
+    :return:
+    """
+    return os.path.splitext(result_file)[0] + ".pages.json"
+
+
 async def delete_dir(del_dir: str):
     """
     删除文件夹，递归删除整个文件夹及其内容
@@ -131,14 +325,14 @@ async def delete_dir(del_dir: str):
     :return:
     """
     if not os.path.exists(del_dir):
-        print(f"路径不存在: {del_dir}")
+        logger.info("路径不存在", path=del_dir)
         return
 
     try:
         shutil.rmtree(del_dir)
-        print(f"成功删除文件夹: {del_dir}")
+        logger.info("删除文件夹", path=del_dir)
     except Exception as e:
-        print(f"删除文件夹失败: {e}")
+        logger.error("删除文件夹失败", path=del_dir, error=e)
         raise HTTPException(status_code=500, detail=f"删除文件夹失败: {str(e)}")
 
 
@@ -158,3 +352,30 @@ async def read_md(file_name: str, user_id: str = ""):
     with open(result_file, 'r', encoding='utf-8') as file:
         content = file.read()
     return "```markdown" + content + "```"
+
+
+async def iter_md(file_name: str, user_id: str = "", chunk_size: int = 64 * 1024) -> AsyncIterator[str]:
+    """
+    分块读取md文件，不带后缀名，内容与 read_md 相同（包括前后的 ```markdown 和 ```），不整体读入内存
+    :param file_name:
+    :param user_id:
+    :param chunk_size: 每次读取的字符数
+    :return:
+    """
+    user_dir, upload_dir, temp_dir, result_dir = get_dir(user_id)
+    result_file = f"{result_dir}/{file_name}.md"
+    if not os.path.exists(result_file):
+        raise HTTPException(status_code=404, detail=f"文件不存在或未清洗完成: {file_name}")
+    # 在返回生成器之前打开文件，文件不存在等错误可以在响应开始前返回
+    file = await aiofiles.open(result_file, "r", encoding="utf-8")
+
+    async def chunks():
+        try:
+            yield "```markdown"
+            while chunk := await file.read(chunk_size):
+                yield chunk
+            yield "```"
+        finally:
+            await file.close()
+
+    return chunks()
@@ -1,13 +1,54 @@
 import os
+import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from api.v1.api import api_router
 from config.config import settings
+from core.file import pdf_ocr_service
+from core.render import shutdown_render_pool
+from services.access import IpAllowlist
+from services.database import database
+from services.job_queue import job_queue
+from services.llm import chat_service
+from services.logger import get_logger, shutdown_logging
+from services.metrics import registry, CONTENT_TYPE, http_request_seconds, job_queue_depth, llm_inflight, \
+    llm_concurrency_limit
+from services.tracing import tracer
+
+logger = get_logger("access")
+# 启动时编译一次，每个请求只做集合查询
+allowlist = IpAllowlist(settings.ALLOWED_ORIGINS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时恢复未完成的任务，关闭时释放后台资源
+    :param app:
+    :return:
+    """
+    # 启动文档处理工作协程
+    await job_queue.start(pdf_ocr_service)
+    yield
+    # 停止工作协程，执行中的任务下次启动时继续
+    await job_queue.stop()
+    # 关闭页面渲染进程池
+    shutdown_render_pool()
+    # 关闭模型客户端连接池
+    await chat_service.aclose()
+    # 关闭数据库连接
+    await database.close()
+    # 写完剩余的追踪记录和日志
+    tracer.close()
+    shutdown_logging()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
@@ -33,16 +74,13 @@ async def restrict_access(request: Request, call_next):
     :param call_next:
     :return:
     """
-    # 定义允许的来源列表
-    allowed_origins = settings.ALLOWED_ORIGINS
-    origin = request.headers.get("origin")
-    client_ip = request.client.host  # 获取客户端的IP地址
-    client_port = request.client.port
-    print(f"origin: {origin}, client_ip: {client_ip}, client_port：{client_port}")
-    client = client_ip + ":" + str(client_port)
-    print(client)
+    client_ip = request.client.host if request.client else None  # 获取客户端的IP地址
     # 如果客户端 IP 不在允许的来源列表中，则返回 403 错误
-    if client_ip not in allowed_origins:
+    logger.debug("请求", client_ip=client_ip, method=request.method, path=request.url.path)
+    if not allowlist.allows(client_ip):
+        logger.warning(
+            "拒绝访问", client_ip=client_ip, path=request.url.path, origin=request.headers.get("origin"), sample=True
+        )
         return JSONResponse(
             content={"code": 403, "message": "Forbidden: Access denied，你的ip地址不在白名单中！无法访问..."},
             status_code=403,
@@ -51,6 +89,31 @@ async def restrict_access(request: Request, call_next):
     return response
 
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """
+    记录请求耗时，按路由模板而不是实际路径统计，避免路径参数产生过多的标签
+    在 restrict_access 外层，被拒绝的请求同样计入
+    :param request:
+    :param call_next:
+    :return:
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status,
+        )
+
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 
@@ -63,6 +126,19 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 指标
+    :return:
+    """
+    # 采集时读取的当前值
+    job_queue_depth.set(await job_queue.depth())
+    llm_inflight.set(chat_service.limiter.inflight)
+    llm_concurrency_limit.set(int(chat_service.limiter.limit))
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 # 创建上传目录
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 #  初始化数据库
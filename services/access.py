@@ -0,0 +1,50 @@
+import ipaddress
+from functools import lru_cache
+
+
+class IpAllowlist:
+    """
+    预编译的 IP 白名单，支持单个地址和网段（CIDR）
+    单个地址直接按字符串查集合；网段的判断结果按客户端地址缓存，重复访问只需一次字典查询
+    """
+
+    def __init__(self, entries: list[str]):
+        """
+        :param entries: 地址或网段，如 "127.0.0.1"、"192.168.10.0/24"、"::1"
+        """
+        addresses = set()
+        networks = []
+        for entry in entries:
+            entry = entry.strip()
+            if not entry:
+                continue
+            if "/" in entry:
+                network = ipaddress.ip_network(entry, strict=False)
+                if network.num_addresses == 1:
+                    addresses.add(str(network.network_address))
+                else:
+                    networks.append(network)
+            else:
+                addresses.add(str(ipaddress.ip_address(entry)))
+        self._addresses = frozenset(addresses)
+        self._networks = tuple(networks)
+        self._match_network = lru_cache(maxsize=4096)(self._in_networks)
+
+    def _in_networks(self, client_ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(client_ip)
+        except ValueError:
+            return False
+        # IPv4 映射的 IPv6 地址（::ffff:a.b.c.d）按 IPv4 判断
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+            if str(address) in self._addresses:
+                return True
+        return any(address in network for network in self._networks if network.version == address.version)
+
+    def allows(self, client_ip: str | None) -> bool:
+        if client_ip is None:
+            return False
+        if client_ip in self._addresses:
+            return True
+        return self._match_network(client_ip)
@@ -0,0 +1,130 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config.config import settings
+
+
+class Database:
+    """
+    SQLite 数据访问层
+    所有查询都在同一个后台线程中通过同一个连接执行，不阻塞事件循环，也避免多连接争抢数据库锁
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        # 单线程执行器：写操作天然串行，连接只在该线程中使用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        # 等待合并提交的写操作，元素为 (sql, params, future)
+        self._pending: list[tuple[str, tuple, asyncio.Future]] = []
+        self._flush_task: asyncio.Task | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 即可保证数据库不损坏，只在断电时可能丢失最后几个事务
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(f"PRAGMA cache_size=-{settings.DB_CACHE_SIZE_KB}")
+            self._conn = conn
+        return self._conn
+
+    def _call(self, func, *args):
+        """
+        在后台线程中执行，成功后提交，失败时回滚
+        """
+        conn = self._connect()
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def run_sync(self, func, *args):
+        """
+        同步执行，仅用于启动时建表等没有事件循环的场景
+        :param func: 参数为 (conn, *args) 的函数
+        :return: func 的返回值
+        """
+        return self._executor.submit(self._call, func, *args).result()
+
+    async def run(self, func, *args):
+        """
+        在后台线程中执行 func，func 内的所有语句在同一个事务中提交
+        :param func: 参数为 (conn, *args) 的函数
+        :return: func 的返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, *args)
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """
+        执行写语句
+        :return: 影响的行数
+        """
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def fetchone(self, sql: str, params: tuple = ()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute_batched(self, sql: str, params: tuple = ()):
+        """
+        执行写语句，与同一时间其他协程提交的写操作合并到同一个事务中
+        适合页面记录、进度等高频的小写入，返回时数据已提交
+        :param sql:
+        :param params:
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, params, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        try:
+            # 上一批提交期间到达的写操作在下一轮一起提交
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await self.run(self._write_batch, [(sql, params) for sql, params, _ in batch])
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self._flush_task = None
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, statements: list):
+        for sql, params in statements:
+            conn.execute(sql, params)
+
+    async def close(self):
+        """
+        关闭连接，之后的查询会重新建立连接
+        """
+        if self._flush_task is not None:
+            await self._flush_task
+
+        def close(_):
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, close, None)
+
+
+database = Database(settings.DB_PATH)
@@ -1,16 +1,14 @@
 import sqlite3
 
-from config.config import settings
-
-DB_PATH = settings.DB_PATH
+from services.database import database
 
 
 class DB:
     def __init__(self):
-        self.init_db()
+        database.run_sync(self.init_db)
 
-    def init_db(self):
-        conn = sqlite3.connect(DB_PATH)
+    @staticmethod
+    def init_db(conn: sqlite3.Connection):
         cursor = conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS tokens (
@@ -20,40 +18,67 @@ class DB:
                 total_tokens INTEGER DEFAULT 0
             )
         """)
-        conn.commit()
-        conn.close()
+        # 旧版本没有唯一索引，同一文件可能有多条记录，只保留最新的一条
+        cursor.execute("""
+            DELETE FROM tokens WHERE id NOT IN (
+                SELECT MAX(id) FROM tokens GROUP BY user_id, file_name
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_tokens_user_file ON tokens (user_id, file_name)
+        """)
+        # 复用其他用户已处理文档时记录原始消耗，不计入 total_tokens
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(tokens)")]
+        if "reused_tokens" not in columns:
+            cursor.execute("ALTER TABLE tokens ADD COLUMN reused_tokens INTEGER DEFAULT 0")
+        # 每页的处理方式（text 文本层提取 / vlm 模型识别）及 token 数
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                file_name TEXT,
+                page_number INTEGER,
+                route TEXT,
+                tokens INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_pages_file_page ON pages (user_id, file_name, page_number)
+        """)
+        # 结果来自识别缓存等已有结果时记录原始消耗，不计入 tokens
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(pages)")]
+        if "reused_tokens" not in columns:
+            cursor.execute("ALTER TABLE pages ADD COLUMN reused_tokens INTEGER DEFAULT 0")
 
-    async def create_token_record(self, user_id: str, file_name: str, total_tokens: int = 0):
+    async def create_token_record(self, user_id: str, file_name: str, total_tokens: int = 0, reused_tokens: int = 0):
         """
-        创建一条新的 token 记录
+        创建 token 记录，文件已有记录时（重新处理）覆盖
         :param user_id: 用户 ID
         :param file_name: 文件名
-        :param total_tokens: token 数量
+        :param total_tokens: 本次实际消耗的 token 数量
+        :param reused_tokens: 复用已有结果时，该结果首次识别消耗的 token 数量
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        try:
-            cursor.execute("""
-                INSERT INTO tokens (user_id, file_name, total_tokens)
-                VALUES (?, ?, ?)
-            """, (user_id, file_name, total_tokens))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            print(f"文件 {file_name} 已存在！")
-        finally:
-            conn.close()
+        await database.execute("""
+            INSERT INTO tokens (user_id, file_name, total_tokens, reused_tokens)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, file_name) DO UPDATE SET
+            total_tokens = excluded.total_tokens, reused_tokens = excluded.reused_tokens
+        """, (user_id, file_name, total_tokens, reused_tokens))
 
     async def update_token_record(self, user_id: str, file_name: str, tokens):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
+        """
+        累加 token 数量，没有记录时创建
+        :param user_id: 用户 ID
+        :param file_name: 文件名
+        :param tokens: 新增的 token 数量
+        """
+        await database.execute_batched("""
             INSERT INTO tokens (user_id, file_name, total_tokens)
             VALUES (?, ?, ?)
-            ON CONFLICT(file_name) DO UPDATE SET
-            total_tokens = total_tokens + ?
+            ON CONFLICT(user_id, file_name) DO UPDATE SET
+            total_tokens = total_tokens + excluded.total_tokens
         """, (user_id, file_name, tokens))
-        conn.commit()
-        conn.close()
 
     async def read_token_record(self, user_id: str, file_name: str) -> dict or None:
         """
@@ -62,19 +87,11 @@ class DB:
         :param file_name: 文件名
         :return: 包含记录的字典或 None
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tokens WHERE user_id=? AND file_name=?", (user_id, file_name,))
-        result = cursor.fetchone()
-        conn.close()
-
+        result = await database.fetchone(
+            "SELECT total_tokens FROM tokens WHERE user_id=? AND file_name=?", (user_id, file_name,)
+        )
         if result:
-            # return {
-            #     "user_id": result[0],
-            #     "file_name": result[1],
-            #     "total_tokens": result[2]
-            # }
-            return result[3]
+            return result[0]
         return None
 
     async def delete_token_record(self, user_id: str):
@@ -82,43 +99,93 @@ class DB:
         删除指定文件名的 token 记录
         :param user_id: 用户id
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM tokens WHERE user_id=?", (user_id,))
-        conn.commit()
-        conn.close()
+        def delete(conn: sqlite3.Connection):
+            conn.execute("DELETE FROM tokens WHERE user_id=?", (user_id,))
+            conn.execute("DELETE FROM pages WHERE user_id=?", (user_id,))
+
+        await database.run(delete)
+
+    async def save_page_record(
+            self, user_id: str, file_name: str, page_number: int, route: str, tokens: int = 0, reused_tokens: int = 0
+    ):
+        """
+        保存单页的处理记录，重复处理同一页时覆盖
+        同时完成的多个页面合并到同一个事务中提交
+        :param user_id: 用户 ID
+        :param file_name: 文件名
+        :param page_number: 页码，从0开始
+        :param route: 处理方式，text / vlm
+        :param tokens: 本次实际消耗的 token 数量
+        :param reused_tokens: 结果来自已有识别结果时，该结果首次识别消耗的 token 数量
+        """
+        await database.execute_batched("""
+            INSERT INTO pages (user_id, file_name, page_number, route, tokens, reused_tokens)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, file_name, page_number) DO UPDATE SET
+            route = excluded.route, tokens = excluded.tokens, reused_tokens = excluded.reused_tokens,
+            created_at = CURRENT_TIMESTAMP
+        """, (user_id, file_name, page_number, route, tokens, reused_tokens))
+
+    async def delete_page_records(self, user_id: str, file_name: str):
+        """
+        删除文件所有页面的处理记录
+        :param user_id: 用户 ID
+        :param file_name: 文件名
+        """
+        await database.execute("DELETE FROM pages WHERE user_id=? AND file_name=?", (user_id, file_name))
+
+    async def list_page_records(self, user_id: str, file_name: str):
+        """
+        列出文件各页的处理记录
+        :param user_id: 用户 ID
+        :param file_name: 文件名
+        :return: 按页码排序的记录列表
+        """
+        results = await database.fetchall("""
+            SELECT page_number, route, tokens, reused_tokens FROM pages
+            WHERE user_id=? AND file_name=? ORDER BY page_number
+        """, (user_id, file_name))
+
+        return [
+            {"page": r[0] + 1, "route": r[1], "tokens": r[2], "reused_tokens": r[3]}
+            for r in results
+        ]
+
+    async def sum_page_tokens(self, user_id: str, file_name: str) -> tuple[int, int]:
+        """
+        文件所有页面的 token 总数
+        :param user_id: 用户 ID
+        :param file_name: 文件名
+        :return: (实际消耗的 token 数, 复用已有结果的 token 数)
+        """
+        result = await database.fetchone(
+            "SELECT COALESCE(SUM(tokens), 0), COALESCE(SUM(reused_tokens), 0) FROM pages WHERE user_id=? AND file_name=?",
+            (user_id, file_name)
+        )
+        return result[0], result[1]
 
     async def list_user_records(self,  user_id: str):
         """
         列出所有 token 记录
         :return: 所有记录的列表
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tokens WHERE user_id=?", (user_id,))
-        results = cursor.fetchall()
-        conn.close()
-
-        # 将结果转为 dict 格式
-        columns = [column[0] for column in cursor.description]
-        result_dicts = [dict(zip(columns, row)) for row in results]
-
-        return result_dicts
+        def query(conn: sqlite3.Connection):
+            cursor = conn.execute("SELECT * FROM tokens WHERE user_id=?", (user_id,))
+            # 将结果转为 dict 格式
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+        return await database.run(query)
 
     async def list_all_records(self):
         """
         列出所有 token 记录
         :return: 所有记录的列表
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tokens")
-        results = cursor.fetchall()
-        conn.close()
+        results = await database.fetchall("SELECT user_id, file_name, total_tokens, reused_tokens FROM tokens")
 
         return [
-            {"user_id": r[1], "file_name": r[2], "total_tokens": r[3]}
+            {"user_id": r[0], "file_name": r[1], "total_tokens": r[2], "reused_tokens": r[3]}
             for r in results
         ]
 
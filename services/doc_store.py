@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import uuid
+
+import aiofiles.os
+
+from config.config import settings
+from services.database import database
+
+
+class DocumentStore:
+    """
+    按内容寻址的文档结果存储，不同用户上传的相同文档共用一份识别结果
+    键为上传内容的 SHA-256 与模型、提示词的组合哈希，模型或提示词变化后不再复用旧结果
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        database.run_sync(self.init_db)
+
+    @staticmethod
+    def init_db(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                key TEXT PRIMARY KEY,
+                sha256 TEXT,
+                page_count INTEGER DEFAULT 0,
+                tokens INTEGER DEFAULT 0,
+                reuse_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                reused_at TIMESTAMP
+            )
+        """)
+
+    @staticmethod
+    def make_key(sha256: str, model: str, system_prompt: str, user_prompt: str) -> str:
+        """
+        计算文档键
+        :param sha256: 上传内容的 SHA-256
+        :param model: 模型名称
+        :param system_prompt:
+        :param user_prompt:
+        :return:
+        """
+        digest = hashlib.sha256()
+        for part in (sha256, model, system_prompt, user_prompt):
+            part = part.encode("utf-8")
+            # 写入长度前缀，避免不同字段拼接后产生相同的内容
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get_path(self, key: str) -> str:
+        """
+        结果文件在存储中的路径，按键的前两位分目录
+        :param key:
+        :return:
+        """
+        return f"{self.store_dir}/{key[:2]}/{key}.md"
+
+    async def get(self, key: str) -> dict | None:
+        """
+        查询已完成的文档
+        :param key:
+        :return: {"path", "page_count", "tokens"}，不存在或结果文件丢失时返回 None
+        """
+        row = await database.fetchone("SELECT page_count, tokens FROM documents WHERE key=?", (key,))
+        path = self.get_path(key)
+        if row is None or not await aiofiles.os.path.exists(path):
+            return None
+        return {"path": path, "page_count": row[0], "tokens": row[1]}
+
+    async def put(self, key: str, sha256: str, result_file: str, page_count: int, tokens: int):
+        """
+        保存文档结果，复制到存储目录后再写入记录
+        :param key:
+        :param sha256:
+        :param result_file: 用户结果文件
+        :param page_count:
+        :param tokens: 首次识别消耗的 token 数
+        """
+        path = self.get_path(key)
+        await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+        await link_or_copy(result_file, path)
+        await database.execute("""
+            INSERT INTO documents (key, sha256, page_count, tokens)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+            page_count = excluded.page_count, tokens = excluded.tokens
+        """, (key, sha256, page_count, tokens))
+
+    async def mark_reused(self, key: str):
+        await database.execute_batched(
+            "UPDATE documents SET reuse_count = reuse_count + 1, reused_at = CURRENT_TIMESTAMP WHERE key=?", (key,)
+        )
+
+
+async def link_or_copy(src: str, dst: str):
+    """
+    通过硬链接共享文件内容，跨文件系统等无法链接时复制，先写入临时文件再原子替换
+    :param src:
+    :param dst:
+    """
+    temp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        await aiofiles.os.link(src, temp)
+    except OSError:
+        await aiofiles.os.wrap(shutil.copyfile)(src, temp)
+    await aiofiles.os.replace(temp, dst)
+
+
+doc_store = DocumentStore(settings.DOC_STORE_DIR)
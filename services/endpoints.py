@@ -0,0 +1,137 @@
+import json
+import time
+
+from config.config import settings
+from services.logger import get_logger
+
+logger = get_logger("endpoints")
+
+
+class Endpoint:
+    """
+    单个模型服务实例及其运行统计
+    """
+
+    def __init__(self, api_base: str, api_key: str, model: str, weight: float = 1.0):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(0.01, float(weight))
+        # 正在执行的请求数
+        self.outstanding = 0
+        # 连续失败次数，成功后清零
+        self.consecutive_failures = 0
+        # 被摘除到该时间（time.monotonic）为止
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.total_latency = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self) -> dict:
+        successes = self.requests - self.failures
+        return {
+            "api_base": self.api_base,
+            "model": self.model,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "ejected": not self.is_available(time.monotonic()),
+            "avg_latency": self.total_latency / successes if successes else None,
+        }
+
+
+class EndpointPool:
+    """
+    多个模型服务实例的负载均衡
+    按 正在执行的请求数 / 权重 选择最空闲的实例；连续失败达到阈值的实例被摘除，冷却后重新加入
+    冷却后的第一个请求再次失败时立即重新摘除
+    """
+
+    def __init__(self, endpoints: list[Endpoint], eject_failures: int, eject_cooldown: float):
+        if not endpoints:
+            raise ValueError("至少需要配置一个模型服务地址")
+        self.endpoints = endpoints
+        self.eject_failures = max(1, eject_failures)
+        self.eject_cooldown = eject_cooldown
+
+    def pick(self) -> Endpoint:
+        """
+        选择实例并占用，请求结束后必须调用 on_success 或 on_failure
+        所有实例都被摘除时选择最早恢复的实例，不拒绝请求
+        :return:
+        """
+        now = time.monotonic()
+        available = [endpoint for endpoint in self.endpoints if endpoint.is_available(now)]
+        if available:
+            endpoint = min(available, key=lambda e: ((e.outstanding + 1) / e.weight, e.consecutive_failures))
+        else:
+            endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def on_success(self, endpoint: Endpoint, latency: float):
+        endpoint.outstanding -= 1
+        endpoint.consecutive_failures = 0
+        endpoint.total_latency += latency
+
+    def on_failure(self, endpoint: Endpoint):
+        """
+        记录实例故障（超时、连接失败、5xx、限流），连续失败达到阈值时摘除
+        :param endpoint:
+        """
+        endpoint.outstanding -= 1
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.eject_failures and endpoint.is_available(time.monotonic()):
+            endpoint.ejected_until = time.monotonic() + self.eject_cooldown
+            endpoint.ejections += 1
+            logger.warning(
+                "模型服务连续失败，暂停使用", api_base=endpoint.api_base, failures=endpoint.consecutive_failures,
+                cooldown=self.eject_cooldown
+            )
+
+    def on_done(self, endpoint: Endpoint):
+        """
+        请求结束但与实例健康无关（如请求参数错误、被取消）
+        :param endpoint:
+        """
+        endpoint.outstanding -= 1
+
+    def stats(self) -> list:
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def load_endpoints() -> list[Endpoint]:
+    """
+    读取模型服务配置
+    VLLM_ENDPOINTS 为 JSON 数组，元素为 {"api_base", "api_key", "model", "weight"}，api_key、model、weight 可省略
+    未配置时使用 VLLM_API_BASE / VLLM_API_KEY / VLLM_MODEL
+    识别缓存和文档去重的键包含模型名称，所有实例必须部署同一个模型（与第一个实例相同）
+    :return:
+    """
+    if not settings.VLLM_ENDPOINTS:
+        return [Endpoint(settings.VLLM_API_BASE, settings.VLLM_API_KEY, settings.VLLM_MODEL)]
+    endpoints = [
+        Endpoint(
+            item["api_base"],
+            item.get("api_key", settings.VLLM_API_KEY),
+            item.get("model", settings.VLLM_MODEL),
+            item.get("weight", 1),
+        )
+        for item in json.loads(settings.VLLM_ENDPOINTS)
+    ]
+    for endpoint in endpoints[1:]:
+        if endpoint.model != endpoints[0].model:
+            raise ValueError(
+                f"VLLM_ENDPOINTS 中的实例必须使用同一个模型: {endpoint.api_base} 为 {endpoint.model}，"
+                f"{endpoints[0].api_base} 为 {endpoints[0].model}"
+            )
+    return endpoints
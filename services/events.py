@@ -0,0 +1,87 @@
+import asyncio
+import json
+from collections import defaultdict
+
+from config.config import settings
+
+# 文档处理事件
+EVENT_PROGRESS = "progress"
+EVENT_PAGE = "page"
+EVENT_DELTA = "delta"
+EVENT_DONE = "done"
+EVENT_ERROR = "error"
+# 处理失败后等待重试，不是结束事件
+EVENT_RETRY = "retry"
+# 批量图片识别中单张图片的结果
+EVENT_RESULT = "result"
+
+# 订阅队列溢出时发送给订阅者的结束标记
+_OVERFLOW = (EVENT_ERROR, {"message": "消费速度过慢，事件已丢弃，请重新连接"})
+
+
+class EventBroker:
+    """
+    进程内的文档处理事件发布/订阅，按 (user_id, file_name) 区分
+    """
+
+    def __init__(self):
+        self._subscribers: dict[tuple[str, str], set[asyncio.Queue]] = defaultdict(set)
+        # 每个文档最近一次的进度，供新订阅者获取当前状态
+        self._progress: dict[tuple[str, str], dict] = {}
+
+    def subscribe(self, user_id: str, file_name: str) -> asyncio.Queue:
+        """
+        订阅文档事件
+        :param user_id:
+        :param file_name: 不带后缀名
+        :return: 事件队列，元素为 (event, data)
+        """
+        queue = asyncio.Queue(maxsize=settings.EVENT_QUEUE_SIZE)
+        self._subscribers[(user_id, file_name)].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, file_name: str, queue: asyncio.Queue):
+        key = (user_id, file_name)
+        self._subscribers[key].discard(queue)
+        if not self._subscribers[key]:
+            del self._subscribers[key]
+
+    def has_subscribers(self, user_id: str, file_name: str) -> bool:
+        return bool(self._subscribers.get((user_id, file_name)))
+
+    def get_progress(self, user_id: str, file_name: str) -> dict | None:
+        return self._progress.get((user_id, file_name))
+
+    def publish(self, user_id: str, file_name: str, event: str, data: dict):
+        """
+        发布事件，订阅者队列已满时移除该订阅者并通知其重新连接
+        :param user_id:
+        :param file_name:
+        :param event:
+        :param data:
+        """
+        key = (user_id, file_name)
+        if event == EVENT_PROGRESS:
+            self._progress[key] = data
+        elif event in (EVENT_DONE, EVENT_ERROR):
+            self._progress.pop(key, None)
+        for queue in list(self._subscribers.get(key, ())):
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                self.unsubscribe(user_id, file_name, queue)
+                queue.get_nowait()
+                queue.put_nowait(_OVERFLOW)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """
+    格式化为 Server-Sent Events 消息
+    :param event:
+    :param data:
+    :return:
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+event_broker = EventBroker()
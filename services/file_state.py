@@ -0,0 +1,150 @@
+import sqlite3
+
+from services.database import database
+
+# 文件处理状态
+STATE_QUEUED = "queued"
+STATE_RENDERING = "rendering"
+STATE_RECOGNIZING = "recognizing"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+# 处理中的状态
+ACTIVE_STATES = (STATE_QUEUED, STATE_RENDERING, STATE_RECOGNIZING)
+
+
+class FileStateStore:
+    """
+    每个文件的处理状态，按 (user_id, file_name) 唯一索引
+    """
+
+    _COLUMNS = "file_name, state, pages_done, pages_total, error, created_at, updated_at, started_at, finished_at"
+
+    def __init__(self):
+        database.run_sync(self.init_db)
+
+    @staticmethod
+    def init_db(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS file_states (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                file_name TEXT,
+                state TEXT,
+                pages_done INTEGER DEFAULT 0,
+                pages_total INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_file_states_user_file ON file_states (user_id, file_name)
+        """)
+
+    async def queued(self, user_id: str, file_name: str, error: str = None):
+        """
+        文件进入任务队列，重新上传时重置进度
+        :param user_id:
+        :param file_name: 不带后缀名
+        :param error: 重试时保留上一次的错误信息
+        """
+        await database.execute("""
+            INSERT INTO file_states (user_id, file_name, state, error)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, file_name) DO UPDATE SET
+                state=excluded.state, error=excluded.error, pages_done=0,
+                updated_at=CURRENT_TIMESTAMP, started_at=NULL, finished_at=NULL
+        """, (user_id, file_name, STATE_QUEUED, error))
+
+    async def started(self, user_id: str, file_name: str, pages_done: int, pages_total: int):
+        """
+        开始渲染页面
+        :param user_id:
+        :param file_name:
+        :param pages_done: 检查点中已完成的页数
+        :param pages_total:
+        """
+        await database.execute("""
+            INSERT INTO file_states (user_id, file_name, state, pages_done, pages_total, started_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id, file_name) DO UPDATE SET
+                state=excluded.state, pages_done=excluded.pages_done, pages_total=excluded.pages_total,
+                updated_at=CURRENT_TIMESTAMP, started_at=CURRENT_TIMESTAMP, finished_at=NULL
+        """, (user_id, file_name, STATE_RENDERING, pages_done, pages_total))
+
+    async def progress(self, user_id: str, file_name: str, pages_done: int):
+        """
+        更新识别进度，与同时完成的页面记录合并提交
+        :param user_id:
+        :param file_name:
+        :param pages_done:
+        """
+        await database.execute_batched("""
+            UPDATE file_states SET state=?, pages_done=?, updated_at=CURRENT_TIMESTAMP
+            WHERE user_id=? AND file_name=?
+        """, (STATE_RECOGNIZING, pages_done, user_id, file_name))
+
+    async def finished(self, user_id: str, file_name: str, state: str, error: str = None):
+        """
+        处理结束
+        :param user_id:
+        :param file_name:
+        :param state: done / failed
+        :param error: 失败原因
+        """
+        await database.execute("""
+            INSERT INTO file_states (user_id, file_name, state, error, finished_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id, file_name) DO UPDATE SET
+                state=excluded.state, error=excluded.error,
+                updated_at=CURRENT_TIMESTAMP, finished_at=CURRENT_TIMESTAMP
+        """, (user_id, file_name, state, error))
+
+    async def get(self, user_id: str, file_name: str) -> dict | None:
+        """
+        查询单个文件的状态
+        :param user_id:
+        :param file_name:
+        :return:
+        """
+        row = await database.fetchone(
+            f"SELECT {self._COLUMNS} FROM file_states WHERE user_id=? AND file_name=?", (user_id, file_name)
+        )
+        return self._to_dict(row) if row else None
+
+    async def list_user(self, user_id: str) -> list:
+        """
+        查询用户所有文件的状态
+        :param user_id:
+        :return:
+        """
+        rows = await database.fetchall(f"SELECT {self._COLUMNS} FROM file_states WHERE user_id=? ORDER BY id", (user_id,))
+        return [self._to_dict(row) for row in rows]
+
+    async def delete_user(self, user_id: str):
+        """
+        删除用户所有文件的状态
+        :param user_id:
+        """
+        await database.execute("DELETE FROM file_states WHERE user_id=?", (user_id,))
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        return {
+            "file_name": row[0],
+            "state": row[1],
+            "pages_done": row[2],
+            "pages_total": row[3],
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+        }
+
+
+file_state = FileStateStore()
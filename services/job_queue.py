@@ -0,0 +1,306 @@
+import asyncio
+import os
+import sqlite3
+
+from fastapi import HTTPException
+
+from config.config import settings
+from services.database import database
+from services.events import event_broker, EVENT_ERROR, EVENT_RETRY
+from services.file_state import file_state, STATE_FAILED
+from services.logger import get_logger
+from services.metrics import documents_total
+
+logger = get_logger("job_queue")
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+# 相同内容的文档正在处理，等待其完成后再执行（直接复用结果）
+JOB_ATTACHED = "attached"
+
+
+class JobQueue:
+    """
+    持久化的文档处理任务队列
+    任务记录保存在 SQLite 中，服务重启后自动恢复未完成的任务；内存队列只保存待执行的任务 id
+    """
+
+    def __init__(self):
+        database.run_sync(self.init_db)
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._handler = None
+
+    @staticmethod
+    def init_db(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                file_name TEXT,
+                file_path TEXT,
+                state TEXT,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_file ON jobs (user_id, file_name)")
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(jobs)")]
+        if "sha256" not in columns:
+            cursor.execute("ALTER TABLE jobs ADD COLUMN sha256 TEXT")
+        if "parent_id" not in columns:
+            cursor.execute("ALTER TABLE jobs ADD COLUMN parent_id INTEGER")
+        if "profile" not in columns:
+            cursor.execute("ALTER TABLE jobs ADD COLUMN profile INTEGER DEFAULT 0")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_sha256 ON jobs (sha256, state)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_parent ON jobs (parent_id, state)")
+
+    async def start(self, handler):
+        """
+        恢复未完成的任务并启动固定数量的工作协程
+        :param handler: 任务处理函数，参数为 (file_path, user_id, sha256, profile)
+        """
+        self._handler = handler
+        self._queue = asyncio.Queue()
+
+        def recover(conn: sqlite3.Connection):
+            # 上次退出时正在执行和等待中的任务重新排队，领取时再重新判断是否需要等待
+            conn.execute(
+                "UPDATE jobs SET state=?, parent_id=NULL, updated_at=CURRENT_TIMESTAMP WHERE state IN (?, ?)",
+                (JOB_PENDING, JOB_RUNNING, JOB_ATTACHED)
+            )
+            return [row[0] for row in conn.execute("SELECT id FROM jobs WHERE state=? ORDER BY id", (JOB_PENDING,))]
+
+        pending = await database.run(recover)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            logger.info("恢复未完成的任务", count=len(pending))
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.JOB_WORKERS)]
+
+    async def stop(self):
+        """
+        停止工作协程，执行中的任务重新置为待执行，下次启动时继续
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def depth(self) -> int:
+        """
+        排队中和执行中的任务数
+        :return:
+        """
+        result = await database.fetchone("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (JOB_PENDING, JOB_RUNNING))
+        return result[0]
+
+    async def check_capacity(self):
+        """
+        队列已满时拒绝新任务
+        """
+        if await self.depth() >= settings.JOB_QUEUE_MAX_DEPTH:
+            raise HTTPException(status_code=429, detail="任务队列已满，请稍后再试")
+
+    async def check_not_running(self, user_id: str, file_name: str):
+        """
+        同一文件正在处理时拒绝重新上传，避免新文件覆盖正在处理的文件，两个任务写入同一个检查点和结果
+        :param user_id:
+        :param file_name: 不带后缀名
+        """
+        row = await database.fetchone(
+            "SELECT id FROM jobs WHERE user_id=? AND file_name=? AND state=?", (user_id, file_name, JOB_RUNNING)
+        )
+        if row:
+            raise HTTPException(status_code=409, detail=f"文件正在处理中，请处理完成后再上传: {file_name}")
+
+    async def enqueue(self, user_id: str, file_path: str, sha256: str = None, profile: bool = False) -> int:
+        """
+        添加任务，同一文件已在排队时不重复添加，正在处理时不添加新任务
+        :param user_id:
+        :param file_path:
+        :param sha256: 文件内容的哈希，相同内容的文档正在处理时等待其完成，为空时不去重
+        :param profile: 执行时是否做性能分析
+        :return: 任务 id，正在处理时为正在执行的任务 id
+        """
+        file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+        def insert(conn: sqlite3.Connection):
+            row = conn.execute(
+                "SELECT id, state FROM jobs WHERE user_id=? AND file_name=? AND state IN (?, ?, ?)",
+                (user_id, file_name, JOB_PENDING, JOB_ATTACHED, JOB_RUNNING)
+            ).fetchone()
+            if row and row[1] == JOB_RUNNING:
+                # 上传前已检查（check_not_running），这里只防止并发上传同名文件
+                return row[0], False, False
+            if row:
+                # 文件已被新上传的内容覆盖，重新排队；排队中的任务已在内存队列中，等待中的任务需要重新放入
+                conn.execute("""
+                    UPDATE jobs SET state=?, sha256=?, profile=?, parent_id=NULL, updated_at=CURRENT_TIMESTAMP
+                    WHERE id=?
+                """, (JOB_PENDING, sha256, int(profile), row[0]))
+                return row[0], True, row[1] == JOB_ATTACHED
+            cursor = conn.execute("""
+                INSERT INTO jobs (user_id, file_name, file_path, state, sha256, profile)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, file_name, file_path, JOB_PENDING, sha256, int(profile)))
+            return cursor.lastrowid, True, True
+
+        # (任务 id, 是否排队, 是否需要放入内存队列)
+        job_id, queued, put = await database.run(insert)
+        if not queued:
+            logger.warning("文件正在处理中，不重复添加任务", user_id=user_id, file=file_name, job_id=job_id)
+            return job_id
+        await file_state.queued(user_id, file_name)
+        if put:
+            self._queue.put_nowait(job_id)
+        return job_id
+
+    async def cancel_user_jobs(self, user_id: str, file_name: str = None):
+        """
+        取消用户所有排队中和等待中的任务，等待这些任务的其他任务重新排队
+        :param user_id:
+        :param file_name: 不带后缀名，传入时只取消该文件的任务
+        """
+        def cancel(conn: sqlite3.Connection):
+            sql = "UPDATE jobs SET state=?, updated_at=CURRENT_TIMESTAMP WHERE user_id=? AND state IN (?, ?)"
+            params = (JOB_CANCELLED, user_id, JOB_PENDING, JOB_ATTACHED)
+            if file_name is not None:
+                sql += " AND file_name=?"
+                params += (file_name,)
+            cancelled = [row[0] for row in conn.execute(sql + " RETURNING id", params).fetchall()]
+            released = []
+            for job_id in cancelled:
+                released += self._release_attached(conn, job_id)
+            return released
+
+        for job_id in await database.run(cancel):
+            self._queue.put_nowait(job_id)
+
+    async def _claim(self, job_id: int) -> dict | None:
+        """
+        领取任务，任务已被取消或已完成时返回 None
+        相同内容的文档正在被其他任务处理时，改为等待该任务完成，同样返回 None
+        """
+        def claim(conn: sqlite3.Connection):
+            row = conn.execute("SELECT sha256 FROM jobs WHERE id=? AND state=?", (job_id, JOB_PENDING)).fetchone()
+            if row is None:
+                return None
+            if row[0]:
+                running = conn.execute(
+                    "SELECT id FROM jobs WHERE sha256=? AND state=? AND id<>? LIMIT 1", (row[0], JOB_RUNNING, job_id)
+                ).fetchone()
+                if running:
+                    conn.execute(
+                        "UPDATE jobs SET state=?, parent_id=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                        (JOB_ATTACHED, running[0], job_id)
+                    )
+                    return None
+            row = conn.execute("""
+                UPDATE jobs SET state=?, attempts=attempts + 1, updated_at=CURRENT_TIMESTAMP
+                WHERE id=?
+                RETURNING id, user_id, file_name, file_path, attempts, sha256, profile
+            """, (JOB_RUNNING, job_id)).fetchall()[0]
+            return {
+                "id": row[0], "user_id": row[1], "file_name": row[2], "file_path": row[3], "attempts": row[4],
+                "sha256": row[5], "profile": bool(row[6]),
+            }
+
+        return await database.run(claim)
+
+    async def _finish(self, job_id: int, state: str, error: str = None):
+        """
+        更新任务状态，任务结束（完成或最终失败）时等待该任务的其他任务重新排队
+        完成时这些任务直接复用结果，失败时由其中一个任务重新处理
+        """
+        def finish(conn: sqlite3.Connection):
+            conn.execute(
+                "UPDATE jobs SET state=?, error=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                (state, error, job_id)
+            )
+            if state in (JOB_DONE, JOB_FAILED):
+                return self._release_attached(conn, job_id)
+            return []
+
+        for attached_id in await database.run(finish):
+            self._queue.put_nowait(attached_id)
+
+    @staticmethod
+    def _release_attached(conn: sqlite3.Connection, job_id: int) -> list:
+        rows = conn.execute("""
+            UPDATE jobs SET state=?, parent_id=NULL, updated_at=CURRENT_TIMESTAMP
+            WHERE parent_id=? AND state=?
+            RETURNING id
+        """, (JOB_PENDING, job_id, JOB_ATTACHED)).fetchall()
+        return sorted(row[0] for row in rows)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 数据库繁忙、磁盘已满等错误不能结束工作协程，否则队列的处理能力会一直减少到重启
+                # 稍后重新放入队列，领取时只处理仍在排队的任务，已开始执行的任务不会重复执行
+                logger.error("任务调度失败", job_id=job_id, error=e)
+                asyncio.get_running_loop().call_later(settings.JOB_RETRY_DELAY, self._queue.put_nowait, job_id)
+
+    async def _run(self, job_id: int):
+        """
+        领取并执行一个任务，按结果更新任务状态
+        """
+        job = await self._claim(job_id)
+        if job is None:
+            return
+        if not os.path.exists(job["file_path"]):
+            await self._fail(job, "文件不存在")
+            return
+        try:
+            await self._handler(job["file_path"], job["user_id"], job["sha256"], job["profile"])
+        except asyncio.CancelledError:
+            # 服务关闭，任务留待下次启动继续
+            await self._finish(job_id, JOB_PENDING)
+            raise
+        except Exception as e:
+            logger.error(
+                "任务执行失败", job_id=job_id, user_id=job["user_id"], file=job["file_name"], attempt=job["attempts"],
+                error=e
+            )
+            if job["attempts"] < settings.JOB_MAX_ATTEMPTS:
+                delay = settings.JOB_RETRY_DELAY * job["attempts"]
+                await self._finish(job_id, JOB_PENDING, str(e))
+                await file_state.queued(job["user_id"], job["file_name"], str(e))
+                # 订阅者继续等待重试的结果
+                event_broker.publish(job["user_id"], job["file_name"], EVENT_RETRY, {
+                    "attempt": job["attempts"],
+                    "max_attempts": settings.JOB_MAX_ATTEMPTS,
+                    "delay": delay,
+                    "message": str(e),
+                })
+                asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+            else:
+                await self._fail(job, str(e))
+        else:
+            await self._finish(job_id, JOB_DONE)
+
+    async def _fail(self, job: dict, error: str):
+        """
+        任务最终失败：记录失败原因并通知订阅者
+        """
+        await self._finish(job["id"], JOB_FAILED, error)
+        await file_state.finished(job["user_id"], job["file_name"], STATE_FAILED, error)
+        documents_total.inc(outcome="failed")
+        event_broker.publish(job["user_id"], job["file_name"], EVENT_ERROR, {"message": error})
+
+
+job_queue = JobQueue()
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class AdaptiveLimiter:
+    """
+    自适应并发限制（AIMD）
+    请求成功且延迟正常时缓慢增加并发上限（每轮约 +1），后端过载（429/503/超时）或延迟明显升高时按比例降低
+    延迟按请求的工作量（折算的页数）归一化后与基线比较，输出较长的请求不会被误判为过载
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_tolerance: float = 2.0,
+                 decrease_factor: float = 0.7, adaptive: bool = True):
+        """
+        :param initial: 初始并发上限
+        :param minimum: 并发下限
+        :param maximum: 并发上限
+        :param latency_tolerance: 单位工作量的延迟超过基线的倍数时视为过载
+        :param decrease_factor: 过载时并发上限乘以该系数
+        :param adaptive: False 时固定使用 maximum，不做调整
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum)) if adaptive else float(self.maximum)
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.adaptive = adaptive
+        self.inflight = 0
+        # 延迟基线：观察到的单位工作量的最小延迟，缓慢上浮以适应后端变化
+        self.baseline: float | None = None
+        self.last_latency: float | None = None
+        self._last_decrease = 0.0
+        self.successes = 0
+        self.overloads = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        占用一个并发名额，用法：async with limiter.slot(): ...
+        """
+        while self.inflight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒但随后取消，把名额让给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._wake()
+
+    def _wake(self):
+        # 按空闲名额唤醒等待者，被唤醒的协程会重新检查名额
+        free = int(self.limit) - self.inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def on_success(self, latency: float, work: float = 1.0):
+        """
+        记录一次成功的请求
+        :param latency: 请求耗时（秒）
+        :param work: 请求的工作量，如折算的页数，不小于1
+        """
+        # 调用时请求仍占用名额
+        self.successes += 1
+        self.last_latency = latency
+        unit_latency = latency / max(1.0, work)
+        if self.baseline is None or unit_latency < self.baseline:
+            self.baseline = unit_latency
+        else:
+            self.baseline *= 1.01
+        if not self.adaptive:
+            return
+        if unit_latency > self.baseline * self.latency_tolerance:
+            self._decrease(latency)
+        elif self.inflight >= int(self.limit):
+            # 只有并发名额被用满时才增加，避免空闲时上限无限增长
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def on_overload(self):
+        """
+        记录一次后端过载（限流、服务不可用、超时）
+        """
+        self.overloads += 1
+        if self.adaptive:
+            self._decrease(self.last_latency or 0)
+
+    def _decrease(self, latency: float):
+        now = time.monotonic()
+        # 同一批并发请求的过载信号只降低一次
+        if now - self._last_decrease < latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "baseline_latency": self.baseline,
+            "last_latency": self.last_latency,
+            "successes": self.successes,
+            "overloads": self.overloads,
+        }
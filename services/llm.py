@@ -1,9 +1,25 @@
 # import openai
+import asyncio
 import base64
+import random
+import time
+from email.utils import parsedate_to_datetime
 
-from openai import AsyncOpenAI
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 from config.config import settings
+from services.endpoints import EndpointPool, Endpoint, load_endpoints
+from services.limiter import AdaptiveLimiter
+from services.logger import get_logger
+from services.metrics import stage_seconds, llm_requests_total, errors_total
+from services.tracing import tracer
+
+logger = get_logger("llm")
+
+# 多页合并请求时的页码标记，模型输出中每页内容以该标记开头
+PAGE_MARKER = "<<<PAGE {}>>>"
 
 
 class ChatService:
@@ -12,9 +28,59 @@ class ChatService:
         # self.api_key = settings.CHAT_API_KEY
         # self.api_base = settings.CHAT_API_BASE
         # self.model = settings.CHAT_MODEL
-        self.api_key = settings.VLLM_API_KEY
-        self.api_base = settings.VLLM_API_BASE
-        self.model = settings.VLLM_MODEL
+        # 图片识别请求在多个实例间负载均衡，各实例应部署相同的模型
+        self.pool = EndpointPool(load_endpoints(), settings.LLM_EJECT_FAILURES, settings.LLM_EJECT_COOLDOWN)
+        # 默认实例，用于对话；model 同时作为识别结果缓存键的一部分
+        primary = self.pool.endpoints[0]
+        self.api_key = primary.api_key
+        self.api_base = primary.api_base
+        self.model = primary.model
+        # 全局并发控制，按后端的延迟和过载情况自动调整同时发往模型的请求数
+        self.limiter = AdaptiveLimiter(
+            initial=settings.LLM_INITIAL_CONCURRENCY,
+            minimum=settings.LLM_MIN_CONCURRENCY,
+            maximum=settings.LLM_MAX_CONCURRENCY,
+            latency_tolerance=settings.LLM_LATENCY_TOLERANCE,
+            decrease_factor=settings.LLM_DECREASE_FACTOR,
+            adaptive=settings.LLM_ADAPTIVE_CONCURRENCY,
+        )
+        # 每个后端一个长连接客户端：(api_base, api_key) -> AsyncOpenAI
+        self._clients: dict[tuple[str, str], AsyncOpenAI] = {}
+
+    def get_client(self, api_base: str = None, api_key: str = None) -> AsyncOpenAI:
+        """
+        获取后端对应的客户端，首次使用时创建，之后复用其连接池
+        :param api_base: 默认使用 vLLM 配置
+        :param api_key:
+        :return:
+        """
+        api_base = api_base or self.api_base
+        api_key = api_key or self.api_key
+        key = (api_base, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+                ),
+                http2=settings.LLM_HTTP2,
+            )
+            # 重试由 _complete 统一处理
+            client = AsyncOpenAI(api_key=api_key, base_url=api_base, http_client=http_client, max_retries=0)
+            self._clients[key] = client
+        return client
+
+    async def aclose(self):
+        """
+        关闭所有客户端及其连接池
+        :return:
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
 
     async def chat(self, question: str, context: str) -> str:
         """
@@ -26,10 +92,7 @@ class ChatService:
                 {"role": "user", "content": f"上下文信息：\n{context}\n\n用户问题：{question}"}
             ]
 
-            client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base
-            )
+            client = self.get_client()
             response = await client.chat.completions.create(
                 model=self.model,
                 messages=messages,
@@ -41,53 +104,245 @@ class ChatService:
         except Exception as e:
             raise Exception(f"生成回复失败: {str(e)}")
 
-    async def generate_response(self, image_contents: bytes):
+    async def generate_response(self, image_contents: bytes, mime_type: str = "image/png", on_delta=None):
         """
         openai大模型图像识别
+        :param image_contents: 图片字节
+        :param mime_type: 图片的 MIME 类型，需与实际编码格式一致
+        :param on_delta: 传入时以流式方式请求模型，每收到一段文本调用一次 on_delta(text)
         """
         try:
-            # 将二进制文件转成字节码
-            base64_image = base64.b64encode(image_contents).decode("utf-8")
-            messages = [
+            messages = self._vl_messages([
                 {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": settings.MY_PROMPT_VL_SYSTEM,
-                        },
-                    ],
+                    "type": "text",
+                    "text": settings.MY_PROMPT_VL_USER,
                 },
+                self._image_part(image_contents, mime_type),
+            ])
+
+            return await self._complete(messages, max_tokens=4096, on_delta=on_delta)
+        except Exception as e:
+            raise Exception(f"生成回复失败: {str(e)}")
+
+    async def generate_batch_response(self, images: list[tuple[bytes, str]]):
+        """
+        多页合并识别，一次请求发送多张图片，减少重复的系统提示词和请求开销
+        每张图片前附加页码标记，要求模型按相同的标记分隔各页的输出
+        :param images: [(图片字节, MIME 类型)]，按页码顺序
+        :return: (tokens, 模型输出)，输出需按 PAGE_MARKER 拆分
+        """
+        try:
+            content = [
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": settings.MY_PROMPT_VL_USER,
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                        },
-                    ],
+                    "type": "text",
+                    "text": settings.MY_PROMPT_VL_BATCH.format(count=len(images), marker=PAGE_MARKER.format(1)),
                 },
             ]
+            for index, (image_contents, mime_type) in enumerate(images, start=1):
+                content.append({"type": "text", "text": PAGE_MARKER.format(index)})
+                content.append(self._image_part(image_contents, mime_type))
+            messages = self._vl_messages(content)
 
-            client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.api_base
-            )
+            return await self._complete(messages, max_tokens=4096 * len(images), pages=len(images))
+        except Exception as e:
+            raise Exception(f"生成回复失败: {str(e)}")
+
+    async def _complete(self, messages: list, max_tokens: int, pages: int = 1, on_delta=None):
+        """
+        请求模型，限流、服务不可用、超时等可重试的错误按指数退避重试，优先使用服务端返回的 Retry-After
+        每次请求的超时为 LLM_REQUEST_TIMEOUT * 页数，从首次发出请求起超过 LLM_REQUEST_DEADLINE 后不再重试
+        :param messages:
+        :param max_tokens:
+        :param pages: 请求包含的页数，用于计算超时和单页延迟
+        :param on_delta: 传入时以流式方式请求
+        :return: (tokens, 模型输出)
+        """
+        deadline = None
+        attempt = 0
+        while True:
+            # 只在请求期间占用并发名额，退避等待时释放
+            async with self.limiter.slot():
+                start = time.monotonic()
+                if deadline is None:
+                    deadline = start + settings.LLM_REQUEST_DEADLINE
+                # 流式请求是否已经输出过内容
+                streamed = []
+                # 每次重试重新选择实例，优先避开出错的实例
+                endpoint = self.pool.pick()
+                span = tracer.start_span(
+                    "llm_request", endpoint=endpoint.api_base, model=endpoint.model, attempt=attempt + 1, pages=pages
+                )
+                try:
+                    result = await self._request(
+                        endpoint, messages, max_tokens, min(settings.LLM_REQUEST_TIMEOUT * pages, deadline - start),
+                        on_delta, streamed
+                    )
+                except Exception as e:
+                    retryable = _is_retryable(e)
+                    self._record_attempt(endpoint, start, "retryable" if retryable else "error")
+                    span.end(e)
+                    if not retryable:
+                        self.pool.on_done(endpoint)
+                        raise
+                    self.pool.on_failure(endpoint)
+                    self.limiter.on_overload()
+                    error = e
+                except BaseException as e:
+                    span.end(e)
+                    self.pool.on_done(endpoint)
+                    raise
+                else:
+                    latency = self._record_attempt(endpoint, start, "success")
+                    tokens, output, completion_tokens = result
+                    span.end(tokens=tokens, completion_tokens=completion_tokens)
+                    self.pool.on_success(endpoint, latency)
+                    # 延迟随输出长度增长，按输出 token 数折算页数，内容密集的页面不视为过载
+                    self.limiter.on_success(latency, max(pages, completion_tokens / settings.LLM_PAGE_TOKENS))
+                    return tokens, output
+            attempt += 1
+            delay = _retry_delay(error, attempt)
+            # 已推送给订阅者的流式输出无法撤回，不再重试
+            if streamed or attempt > settings.LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise error
+            logger.warning("模型请求失败，稍后重试", attempt=attempt, delay=round(delay, 2), error=error)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _record_attempt(endpoint: Endpoint, start: float, outcome: str) -> float:
+        """
+        记录单次请求的耗时和结果
+        :return: 耗时（秒）
+        """
+        latency = time.monotonic() - start
+        stage_seconds.observe(latency, stage="llm_request")
+        llm_requests_total.inc(endpoint=endpoint.api_base, outcome=outcome)
+        if outcome != "success":
+            errors_total.inc(stage="llm_request")
+        return latency
+
+    async def _request(self, endpoint: Endpoint, messages: list, max_tokens: int, timeout: float, on_delta,
+                       streamed: list):
+        """
+        :return: (总 token 数, 模型输出, 输出 token 数)
+        """
+        client = self.get_client(endpoint.api_base, endpoint.api_key)
+        if on_delta is None:
             response = await client.chat.completions.create(
-                model=self.model,
+                model=endpoint.model,
                 messages=messages,
                 temperature=0.4,
-                max_tokens=4096,
-                timeout=180
+                max_tokens=max_tokens,
+                timeout=timeout
             )
+            usage = response.usage
+            return usage.total_tokens, response.choices[0].message.content, usage.completion_tokens or 0
+        # 流式请求，最后一个分片携带 token 用量
+        response = await client.chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            temperature=0.4,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        total_tokens = 0
+        completion_tokens = 0
+        content = []
+        async for chunk in response:
+            if chunk.usage:
+                total_tokens = chunk.usage.total_tokens
+                completion_tokens = chunk.usage.completion_tokens or 0
+            if chunk.choices and chunk.choices[0].delta.content:
+                content.append(chunk.choices[0].delta.content)
+                streamed.append(True)
+                on_delta(chunk.choices[0].delta.content)
+        return total_tokens, "".join(content), completion_tokens
 
-            return response.usage.total_tokens, response.choices[0].message.content
-        except Exception as e:
-            raise Exception(f"生成回复失败: {str(e)}")
+    def stats(self) -> dict:
+        """
+        并发控制和各实例的运行统计
+        :return:
+        """
+        return {
+            "limiter": self.limiter.stats(),
+            "endpoints": self.pool.stats(),
+        }
+
+    @staticmethod
+    def _image_part(image_contents: bytes, mime_type: str) -> dict:
+        # 将二进制文件转成字节码
+        base64_image = base64.b64encode(image_contents).decode("utf-8")
+        return {
+            "type": "image_url",
+            "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
+        }
+
+    @staticmethod
+    def _vl_messages(user_content: list) -> list:
+        return [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": settings.MY_PROMPT_VL_SYSTEM,
+                    },
+                ],
+            },
+            {
+                "role": "user",
+                "content": user_content,
+            },
+        ]
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    限流、服务端错误、超时和连接失败可以重试，请求参数错误等不重试
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """
+    重试等待时间：服务端返回 Retry-After 时按其等待，否则指数退避并加随机抖动
+    Retry-After 不受 LLM_RETRY_MAX_DELAY 限制，提前重试只会再次被限流；超过 LLM_REQUEST_DEADLINE 时由调用方放弃重试
+    :param error:
+    :param attempt: 第几次重试，从1开始
+    :return: 秒
+    """
+    if isinstance(error, openai.APIStatusError):
+        retry_after = _parse_retry_after(error.response.headers)
+        if retry_after is not None:
+            return retry_after
+    # full jitter：在 [0, 退避上限] 内随机，避免大量请求同时重试
+    return random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def _parse_retry_after(headers: httpx.Headers) -> float | None:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    # HTTP 日期格式
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 chat_service = ChatService()
@@ -0,0 +1,151 @@
+import json
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from config.config import settings
+
+# 服务日志的根 logger，与 uvicorn 等第三方日志分开
+ROOT_LOGGER = "fastdata"
+
+_STANDARD_KEYS = frozenset(("exc_info", "stack_info", "stacklevel", "extra"))
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    只把日志记录放入队列，格式化和写 stdout 都在后台线程中执行
+    队列满时丢弃并计数，不阻塞调用方
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 异常在当前线程中格式化，避免 traceback 在队列中长时间引用栈帧
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = (
+            f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')}.{int(record.msecs):03d} {record.levelname} "
+            f"{record.name.removeprefix(ROOT_LOGGER + '.')} {record.getMessage()}"
+        )
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **(getattr(record, "fields", None) or {}),
+        }
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    结构化日志：关键字参数作为字段输出，如 logger.info("页面识别完成", user_id=..., page=3, duration=1.2)
+    高频事件传入 sample=True，同一消息只输出第 1 条及之后每 LOG_SAMPLE_EVERY 条中的 1 条，输出时附带 sampled 计数
+    """
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+        self._counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(level):
+            self._log(level, msg, args, **kwargs)
+
+    def _log(self, level, msg, args, sample: bool = False, **kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _STANDARD_KEYS}
+        if sample and settings.LOG_SAMPLE_EVERY > 1:
+            with self._lock:
+                count = self._counts.get(msg, 0)
+                self._counts[msg] = count + 1
+            if count % settings.LOG_SAMPLE_EVERY:
+                return
+            if count:
+                fields["sampled"] = settings.LOG_SAMPLE_EVERY
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        self.logger.log(level, msg, *args, **kwargs)
+
+    # 未启用的级别只做一次级别判断
+    def debug(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, msg, args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, msg, args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self._log(logging.WARNING, msg, args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, msg, args, **kwargs)
+
+    def exception(self, msg, *args, exc_info=True, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, msg, args, exc_info=exc_info, **kwargs)
+
+
+def _setup() -> tuple[_NonBlockingQueueHandler, QueueListener]:
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(_JsonFormatter() if settings.LOG_FORMAT == "json" else _TextFormatter())
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(settings.LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+    listener = QueueListener(handler.queue, stream)
+    listener.start()
+    return handler, listener
+
+
+_handler, _listener = _setup()
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """
+    :param name: 模块名，如 "file"、"llm"
+    :return:
+    """
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def shutdown_logging():
+    """
+    写完队列中剩余的日志，关闭服务时调用
+    """
+    global _listener
+    if _listener is not None:
+        if _handler.dropped:
+            get_logger("logger").warning("日志队列已满，丢弃了部分日志", dropped=_handler.dropped)
+        _listener.stop()
+        _listener = None
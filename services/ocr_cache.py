@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from config.config import settings
+
+
+class OcrCache:
+    """
+    图片识别结果缓存，以图片内容、模型和提示词的哈希为键
+    存储在 SQLite 中，超过容量上限时按最近访问时间淘汰
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self.init_db()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+
+    def init_db(self):
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                markdown TEXT,
+                tokens INTEGER DEFAULT 0,
+                size INTEGER DEFAULT 0,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_accessed_at ON ocr_cache (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image_contents: bytes, model: str, system_prompt: str, user_prompt: str) -> str:
+        """
+        计算缓存键
+        :param image_contents: 编码后的图片字节
+        :param model: 模型名称
+        :param system_prompt:
+        :param user_prompt:
+        :return:
+        """
+        digest = hashlib.sha256()
+        for part in (image_contents, model.encode("utf-8"), system_prompt.encode("utf-8"), user_prompt.encode("utf-8")):
+            # 写入长度前缀，避免不同字段拼接后产生相同的内容
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> tuple[int, str] | None:
+        """
+        查询缓存
+        :param key:
+        :return: (tokens, markdown) 或 None
+        """
+        result = await asyncio.to_thread(self._get, key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def set(self, key: str, tokens: int, markdown: str):
+        """
+        写入缓存，超出容量时淘汰最久未访问的记录
+        :param key:
+        :param tokens:
+        :param markdown:
+        """
+        await asyncio.to_thread(self._set, key, tokens, markdown)
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        :return:
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT tokens, markdown FROM ocr_cache WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE ocr_cache SET accessed_at=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+            return row[0], row[1]
+
+    def _set(self, key: str, tokens: int, markdown: str):
+        size = len(markdown.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM ocr_cache WHERE key=?", (key,)).fetchone()
+            self._conn.execute("""
+                INSERT OR REPLACE INTO ocr_cache (key, markdown, tokens, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, markdown, tokens, size, now, now))
+            self._total_bytes += size - (old[0] if old else 0)
+            # 按最近访问时间淘汰
+            while self._total_bytes > self.max_bytes:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM ocr_cache ORDER BY accessed_at LIMIT 100"
+                ).fetchall()
+                if not rows:
+                    break
+                for expired_key, expired_size in rows:
+                    self._conn.execute("DELETE FROM ocr_cache WHERE key=?", (expired_key,))
+                    self._total_bytes -= expired_size
+                    if self._total_bytes <= self.max_bytes:
+                        break
+            self._conn.commit()
+
+
+ocr_cache = OcrCache(settings.OCR_CACHE_PATH, settings.OCR_CACHE_MAX_BYTES)
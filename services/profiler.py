@@ -0,0 +1,46 @@
+import asyncio
+import cProfile
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+from config.config import settings
+from services.logger import get_logger
+
+logger = get_logger("profiler")
+
+# 同一线程同时只能启用一个 cProfile，正在分析的任务结束前其他任务不分析
+_active = False
+
+
+@asynccontextmanager
+async def profile_job(name: str, enabled: bool = False):
+    """
+    用 cProfile 分析一个任务，结束后把结果写入 PROFILE_DIR，可用 snakeviz 或 pstats 查看
+    cProfile 统计的是整个事件循环线程，同时执行的其他任务也会计入；渲染进程中的耗时不在其中，见追踪记录
+    :param name: 任务名称，用于结果文件名
+    :param enabled: 本次请求是否要求分析，PROFILE_ENABLED 开启时所有任务都分析
+    :return: 结果文件路径，未分析时为 None，任务结束后才会写入
+    """
+    global _active
+    if not (enabled or settings.PROFILE_ENABLED):
+        yield None
+        return
+    if _active:
+        logger.warning("已有任务正在性能分析，跳过", job=name)
+        yield None
+        return
+    safe_name = re.sub(r"[^\w.-]", "_", name)
+    path = os.path.join(settings.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{os.urandom(3).hex()}.prof")
+    profiler = cProfile.Profile()
+    _active = True
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        _active = False
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        await asyncio.to_thread(profiler.dump_stats, path)
+        logger.info("性能分析结果已保存", job=name, path=path)
@@ -0,0 +1,79 @@
+import asyncio
+
+from services.metrics import coalesced_total
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同键的并发调用：同一个键正在执行时，后来的调用等待同一个结果，不再重复执行
+    共享的调用在单独的任务中执行，某个调用方被取消不影响其他调用方；所有调用方都取消后才取消共享的调用
+    结果和异常由所有调用方共享，调用结束后即移除，不做缓存
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: 用于指标标签，如 "ocr"
+        """
+        self.name = name
+        self._calls: dict[str, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, func):
+        """
+        :param key:
+        :param func: 无参数的协程函数，只在没有相同键的调用正在执行时调用
+        :return: func 的返回值
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+            coalesced_total.inc(kind=self.name)
+        call.waiters += 1
+        try:
+            # shield 使调用方被取消时只停止等待，共享的任务继续执行
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 没有调用方在等待，结果已无人使用
+                self._forget(key, call)
+                call.task.cancel()
+                self.cancelled += 1
+
+    def inflight(self, key: str) -> bool:
+        """
+        :param key:
+        :return: 相同键的调用是否正在执行，此时 do 会合并到该调用
+        """
+        return key in self._calls
+
+    def _forget(self, key: str, call: _Call):
+        # 取消后同一个键可能已有新的调用，只移除自己
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        :return: calls 实际执行次数，coalesced 合并到已有调用的次数，cancelled 因调用方全部取消而取消的次数，inflight 执行中的键数
+        """
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "inflight": len(self._calls),
+        }
@@ -0,0 +1,205 @@
+import contextvars
+import importlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from config.config import settings
+from services.logger import get_logger
+
+logger = get_logger("tracing")
+
+
+class Span:
+    """
+    一次操作的耗时记录，同一文档（或同一次请求）的所有 span 共享 trace_id，通过 parent_id 组成树
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration: float | None = None
+        self.error: str | None = None
+
+    def set(self, **attributes):
+        """
+        添加或覆盖属性
+        """
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None, **attributes):
+        """
+        结束并导出，重复调用时只有第一次生效
+        :param error: 失败时的异常
+        :param attributes: 结束时补充的属性
+        """
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        self.attributes.update(attributes)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self._tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration": self.duration,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Exporter:
+    """
+    span 导出接口，自定义导出器继承该类并通过 TRACE_EXPORTER 配置
+    export 在事件循环中调用，不能阻塞
+    """
+
+    def export(self, span: dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonlExporter(Exporter):
+    """
+    每个 span 一行 JSON 追加到文件，超过大小上限时轮转为 .1、.2 ...
+    写文件在单独的线程中执行
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+        self._size = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace")
+
+    def export(self, span: dict):
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        self._executor.submit(self._write, line.encode("utf-8"))
+
+    def _write(self, data: bytes):
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "ab")
+                self._size = self._file.tell()
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+        except Exception as e:
+            logger.error("写入追踪记录失败", path=self.path, error=e)
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        self._size = 0
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_exporter() -> Exporter | None:
+    """
+    按 TRACE_EXPORTER 创建导出器
+    jsonl 为内置的文件导出器，none 或为空时不导出，其他值按 "模块:类名" 导入并以无参数方式创建
+    :return:
+    """
+    name = settings.TRACE_EXPORTER.strip()
+    if not name or name.lower() == "none":
+        return None
+    if name.lower() == "jsonl":
+        return JsonlExporter(settings.TRACE_FILE, settings.TRACE_MAX_BYTES, settings.TRACE_BACKUP_COUNT)
+    module_name, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+# 当前协程所在的 span，子任务创建时继承
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    创建和导出 span，父子关系通过 contextvars 在协程间传递
+    """
+
+    def __init__(self, exporter: Exporter | None):
+        self.exporter = exporter
+
+    def start_span(self, name: str, parent: Span | None = None, **attributes) -> Span:
+        """
+        创建 span 但不设为当前 span，用于跨协程的操作（如页面从渲染到识别），需手动调用 end
+        :param name:
+        :param parent: 父 span，为空时使用当前 span，没有当前 span 时创建新的 trace
+        :param attributes:
+        :return:
+        """
+        parent = parent or _current_span.get()
+        if parent is None:
+            return Span(self, name, uuid.uuid4().hex, None, attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Span | None = None, **attributes):
+        """
+        创建 span 并设为当前 span，代码块中创建的 span 和子任务都挂在它下面
+        用法：with tracer.span("xxx", page=1) as span: ...
+        """
+        span = self.start_span(name, parent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def export(self, span: Span):
+        if self.exporter is not None:
+            try:
+                self.exporter.export(span.to_dict())
+            except Exception as e:
+                logger.error("导出追踪记录失败", error=e, sample=True)
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+tracer = Tracer(load_exporter())
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# 测试从任意目录运行时都能导入项目中的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 导入时会打开识别缓存数据库，放到临时目录，不在工作目录中留下文件
+os.environ.setdefault("OCR_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "ocr_cache.db"))
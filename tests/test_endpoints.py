@@ -0,0 +1,70 @@
+import pytest
+
+from config.config import settings
+from services.endpoints import Endpoint, EndpointPool, load_endpoints
+
+
+def _pool(*weights: float, eject_failures: int = 2, eject_cooldown: float = 60) -> EndpointPool:
+    endpoints = [Endpoint(f"http://10.0.0.{i}/v1", "key", "model", weight) for i, weight in enumerate(weights)]
+    return EndpointPool(endpoints, eject_failures, eject_cooldown)
+
+
+def test_pick_least_outstanding():
+    pool = _pool(1, 1)
+    first = pool.pick()
+    second = pool.pick()
+    assert first is not second
+    pool.on_success(first, 0.1)
+    assert pool.pick() is first
+
+
+def test_pick_by_weight():
+    pool = _pool(2, 1)
+    picks = [pool.pick().api_base for _ in range(6)]
+    assert picks.count("http://10.0.0.0/v1") == 4
+    assert picks.count("http://10.0.0.1/v1") == 2
+
+
+def test_eject_after_consecutive_failures():
+    pool = _pool(1, 1)
+    bad = pool.endpoints[0]
+    for _ in range(2):
+        bad.outstanding += 1
+        pool.on_failure(bad)
+    assert bad.ejections == 1
+    assert all(pool.pick() is not bad for _ in range(4))
+
+
+def test_success_resets_failures():
+    pool = _pool(1, eject_failures=2)
+    endpoint = pool.pick()
+    pool.on_failure(endpoint)
+    pool.pick()
+    pool.on_success(endpoint, 0.1)
+    pool.pick()
+    pool.on_failure(endpoint)
+    assert endpoint.ejections == 0
+
+
+def test_all_ejected_picks_earliest_recovery():
+    pool = _pool(1, 1, eject_failures=1)
+    for endpoint, cooldown in zip(pool.endpoints, (60, 30)):
+        pool.eject_cooldown = cooldown
+        endpoint.outstanding += 1
+        pool.on_failure(endpoint)
+    assert pool.pick() is pool.endpoints[1]
+
+
+def test_empty_pool_rejected():
+    with pytest.raises(ValueError):
+        EndpointPool([], 3, 30)
+
+
+def test_load_endpoints_requires_same_model(monkeypatch):
+    monkeypatch.setattr(settings, "VLLM_MODEL", "model-a")
+    monkeypatch.setattr(settings, "VLLM_ENDPOINTS", '[{"api_base": "http://a/v1"}, {"api_base": "http://b/v1", "weight": 2}]')
+    endpoints = load_endpoints()
+    assert [(e.api_base, e.model, e.weight) for e in endpoints] == [("http://a/v1", "model-a", 1), ("http://b/v1", "model-a", 2)]
+    monkeypatch.setattr(settings, "VLLM_ENDPOINTS", '[{"api_base": "http://a/v1"}, {"api_base": "http://b/v1", "model": "b"}]')
+    with pytest.raises(ValueError):
+        load_endpoints()
@@ -0,0 +1,111 @@
+import asyncio
+
+from services.limiter import AdaptiveLimiter
+
+
+def _saturate(limiter: AdaptiveLimiter):
+    # on_success 调用时请求仍占用名额，名额用满时才会增加上限
+    limiter.inflight = int(limiter.limit)
+
+
+def test_increase_only_when_saturated():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8)
+    limiter.on_success(1.0)
+    assert limiter.limit == 4
+    # 每次 +1/上限，约一轮（上限个请求）增加1
+    for _ in range(5):
+        _saturate(limiter)
+        limiter.on_success(1.0)
+    assert int(limiter.limit) == 5
+
+
+def test_increase_capped_at_maximum():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=2)
+    _saturate(limiter)
+    limiter.on_success(1.0)
+    assert limiter.limit == 2
+
+
+def test_overload_decreases_once_per_latency_window():
+    limiter = AdaptiveLimiter(initial=10, minimum=2, maximum=32, decrease_factor=0.5)
+    limiter.on_success(60.0)
+    limiter.on_overload()
+    assert limiter.limit == 5
+    # 同一批请求的过载信号只降低一次
+    limiter.on_overload()
+    assert limiter.limit == 5
+
+
+def test_decrease_floored_at_minimum():
+    limiter = AdaptiveLimiter(initial=3, minimum=2, maximum=32, decrease_factor=0.5)
+    limiter.on_overload()
+    assert limiter.limit == 2
+
+
+def test_slow_request_is_overload():
+    limiter = AdaptiveLimiter(initial=10, minimum=1, maximum=32, latency_tolerance=3, decrease_factor=0.5)
+    limiter.on_success(1.0)
+    limiter.on_success(5.0)
+    assert limiter.limit == 5
+
+
+def test_latency_normalized_by_work():
+    # 输出较长的请求耗时更长，按工作量折算后不视为过载
+    limiter = AdaptiveLimiter(initial=10, minimum=1, maximum=32, latency_tolerance=3, decrease_factor=0.5)
+    limiter.on_success(1.0)
+    limiter.on_success(5.0, work=4)
+    assert limiter.limit == 10
+    assert limiter.last_latency == 5.0
+
+
+def test_not_adaptive_uses_maximum():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=16, adaptive=False)
+    limiter.on_success(1.0)
+    limiter.on_success(100.0)
+    limiter.on_overload()
+    assert limiter.limit == 16
+
+
+def test_slot_limits_concurrency():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=2)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.inflight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.inflight == 0
+
+
+def test_cancelled_waiter_releases_slot():
+    limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        async def take():
+            async with limiter.slot():
+                return True
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(take())
+        waiting = asyncio.create_task(take())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        release.set()
+        await holder
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(main())
@@ -0,0 +1,46 @@
+import time
+from email.utils import formatdate
+
+import httpx
+import openai
+
+from config.config import settings
+from services.llm import _parse_retry_after, _retry_delay
+
+
+def _rate_limit_error(headers: dict) -> openai.RateLimitError:
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://test/v1/chat/completions"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_parse_seconds_and_milliseconds():
+    assert _parse_retry_after(httpx.Headers({"retry-after": "5"})) == 5
+    assert _parse_retry_after(httpx.Headers({"retry-after": "1.5"})) == 1.5
+    # retry-after-ms 优先
+    assert _parse_retry_after(httpx.Headers({"retry-after-ms": "250", "retry-after": "5"})) == 0.25
+    assert _parse_retry_after(httpx.Headers({"retry-after": "-3"})) == 0
+
+
+def test_parse_http_date():
+    delay = _parse_retry_after(httpx.Headers({"retry-after": formatdate(time.time() + 60, usegmt=True)}))
+    assert 55 <= delay <= 60
+
+
+def test_parse_missing_or_invalid():
+    assert _parse_retry_after(httpx.Headers({})) is None
+    assert _parse_retry_after(httpx.Headers({"retry-after": "soon"})) is None
+    assert _parse_retry_after(httpx.Headers({"retry-after-ms": "x", "retry-after": "2"})) == 2
+
+
+def test_retry_after_not_capped(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_DELAY", 30)
+    assert _retry_delay(_rate_limit_error({"retry-after": "60"}), 1) == 60
+
+
+def test_backoff_with_jitter(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 1)
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_DELAY", 5)
+    error = _rate_limit_error({})
+    for attempt, limit in ((1, 1), (2, 2), (3, 4), (10, 5)):
+        assert all(0 <= _retry_delay(error, attempt) <= limit for _ in range(20))
+    assert all(0 <= _retry_delay(openai.APITimeoutError(httpx.Request("POST", "http://test")), 2) <= 2 for _ in range(20))
@@ -0,0 +1,30 @@
+from core.ocr import split_pages
+from services.llm import PAGE_MARKER
+
+
+def _output(*pages: str, numbers: list = None, preamble: str = "") -> str:
+    numbers = numbers or range(1, len(pages) + 1)
+    return preamble + "".join(f"{PAGE_MARKER.format(n)}\n{page}\n" for n, page in zip(numbers, pages))
+
+
+def test_split():
+    assert split_pages(_output("## 第一页", "第二页\n内容"), 2) == ["## 第一页\n", "第二页\n内容\n"]
+
+
+def test_code_fence_preamble_allowed():
+    assert split_pages(_output("a", "b", preamble="```markdown\n"), 2) == ["a\n", "b\n"]
+
+
+def test_text_preamble_rejected():
+    assert split_pages(_output("a", "b", preamble="以下是识别结果\n"), 2) is None
+
+
+def test_missing_duplicate_or_out_of_order_markers():
+    assert split_pages(_output("a"), 2) is None
+    assert split_pages(_output("a", "b", numbers=[1, 1]), 2) is None
+    assert split_pages(_output("a", "b", numbers=[2, 1]), 2) is None
+
+
+def test_marker_must_be_on_its_own_line():
+    output = f"{PAGE_MARKER.format(1)}\na 见 {PAGE_MARKER.format(2)} 后\n{PAGE_MARKER.format(2)}\nb"
+    assert split_pages(output, 2) == [f"a 见 {PAGE_MARKER.format(2)} 后\n", "b\n"]
@@ -0,0 +1,39 @@
+import fitz
+
+from core.render import choose_dpi, render_options
+
+
+def _page(width: float = 595, height: float = 842) -> fitz.Page:
+    return fitz.open().new_page(width=width, height=height)
+
+
+def _options(**overrides) -> dict:
+    options = render_options()
+    options.update(dpi=0, min_dpi=96, max_dpi=300, max_pixels=2048 * 2048, glyph_px=24)
+    options.update(overrides)
+    return options
+
+
+def test_fixed_dpi():
+    assert choose_dpi(_page(), {"chars": 100, "small_font_size": 10}, _options(dpi=150)) == 150
+
+
+def test_dpi_from_small_font_size():
+    # 10pt 的文字渲染为 24 像素高
+    assert choose_dpi(_page(), {"chars": 100, "small_font_size": 10}, _options()) == int(24 * 72 / 10)
+
+
+def test_clamped_to_min_and_max():
+    assert choose_dpi(_page(), {"chars": 100, "small_font_size": 30}, _options()) == 96
+    assert choose_dpi(_page(100, 100), {"chars": 100, "small_font_size": 4}, _options()) == 300
+
+
+def test_no_text_layer_uses_pixel_budget():
+    # 没有文本层时使用最大 DPI，再受像素预算限制
+    dpi = choose_dpi(_page(), {"chars": 0, "small_font_size": 0}, _options())
+    assert dpi == int(72 * (2048 * 2048 / (595 * 842)) ** 0.5)
+    assert 595 * dpi / 72 * 842 * dpi / 72 <= 2048 * 2048
+
+
+def test_no_text_layer_small_page():
+    assert choose_dpi(_page(200, 200), {"chars": 0}, _options()) == 300
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.result import read_result_range, write_index, load_index, _encode_cursor
+
+PAGES = ["# 第一页\n内容\n", "## 第二页\nsecond\n", "第三页 ✓\n"]
+
+
+@pytest.fixture
+def result_file(tmp_path) -> str:
+    path = tmp_path / "doc.md"
+    data = "".join(PAGES).encode("utf-8")
+    path.write_bytes(data)
+    offsets = [0]
+    for page in PAGES:
+        offsets.append(offsets[-1] + len(page.encode("utf-8")))
+    asyncio.run(write_index(str(path), offsets))
+    return str(path)
+
+
+def _read(result_file: str, **kwargs) -> dict:
+    return asyncio.run(read_result_range(result_file, **kwargs))
+
+
+def _status(result_file: str, **kwargs) -> int:
+    with pytest.raises(HTTPException) as e:
+        _read(result_file, **kwargs)
+    return e.value.status_code
+
+
+def test_read_pages(result_file):
+    part = _read(result_file, page=2, page_size=1)
+    assert part["content"] == PAGES[1]
+    assert part["range"] == {"unit": "page", "start": 2, "end": 3, "total": 3}
+
+
+def test_page_cursor_covers_whole_file(result_file):
+    part = _read(result_file, page=1, page_size=2)
+    content = part["content"]
+    assert part["next_cursor"]
+    part = _read(result_file, cursor=part["next_cursor"])
+    content += part["content"]
+    assert part["next_cursor"] is None
+    assert content == "".join(PAGES)
+
+
+def test_byte_cursor_keeps_utf8_characters(result_file):
+    chunks = []
+    part = _read(result_file, offset=0, length=5)
+    while True:
+        chunks.append(part["content"])
+        if part["next_cursor"] is None:
+            break
+        part = _read(result_file, cursor=part["next_cursor"])
+    assert "".join(chunks) == "".join(PAGES)
+    assert len(chunks) > 3
+
+
+def test_byte_offset_inside_character(result_file):
+    # "第" 占第 2-4 字节，从其中间开始时跳到下一个完整字符
+    part = _read(result_file, offset=3, length=64)
+    assert part["range"]["start"] == 5
+    assert part["content"].startswith("一页")
+
+
+def test_invalid_cursor(result_file):
+    assert _status(result_file, cursor="not-a-cursor") == 400
+    assert _status(result_file, cursor=_encode_cursor({"unit": "line", "start": 0, "count": 1})) == 400
+
+
+def test_cursor_after_file_changed(result_file):
+    cursor = _read(result_file, page=1, page_size=1)["next_cursor"]
+    with open(result_file, "a", encoding="utf-8") as f:
+        f.write("追加\n")
+    assert _status(result_file, cursor=cursor) == 409
+
+
+def test_out_of_range(result_file):
+    assert _status(result_file, page=4) == 416
+    assert _status(result_file, offset=10 ** 6, length=10) == 416
+    assert _status(result_file, page=0) == 400
+
+
+def test_missing_file(tmp_path):
+    assert _status(str(tmp_path / "missing.md"), page=1) == 404
+
+
+def test_stale_index_is_one_page(result_file):
+    # 结果被覆盖后索引与文件大小不一致，整个文件视为一页
+    with open(result_file, "w", encoding="utf-8") as f:
+        f.write("新的结果\n")
+    size = len("新的结果\n".encode("utf-8"))
+    assert asyncio.run(load_index(result_file, size)) == [0, size]
@@ -0,0 +1,121 @@
+import fitz
+
+from core.render import render_options
+from core.text_layer import (
+    ROUTE_TEXT, ROUTE_VLM, _block_to_markdown, analyze_page, classify_page, get_text_dict, text_dict_to_markdown
+)
+
+BODY = "This paragraph is long enough to be treated as body text on the page."
+
+
+def _features(**overrides) -> dict:
+    features = {
+        "chars": 500, "small_font_size": 10, "hidden_ratio": 0, "replacement_ratio": 0, "image_coverage": 0,
+        "drawings": 0,
+    }
+    features.update(overrides)
+    return features
+
+
+def _policy(routing: str = "auto") -> dict:
+    policy = render_options()
+    policy.update(routing=routing, min_chars=50, max_image_coverage=0.3, max_drawings=100)
+    return policy
+
+
+def test_classify_text_page():
+    assert classify_page(_features(), _policy()) == ROUTE_TEXT
+
+
+def test_classify_needs_vlm():
+    for overrides in (
+            {"chars": 0}, {"chars": 10}, {"hidden_ratio": 0.9}, {"replacement_ratio": 0.1}, {"image_coverage": 0.5},
+            {"drawings": 500},
+    ):
+        assert classify_page(_features(**overrides), _policy()) == ROUTE_VLM, overrides
+
+
+def test_classify_forced_routing():
+    assert classify_page(_features(image_coverage=0.9), _policy("text")) == ROUTE_TEXT
+    assert classify_page(_features(), _policy("vlm")) == ROUTE_VLM
+    # 没有文字时无法使用文本层
+    assert classify_page(_features(chars=0), _policy("text")) == ROUTE_VLM
+
+
+def test_analyze_page():
+    page = fitz.open().new_page()
+    page.insert_text((72, 72), BODY, fontsize=10)
+    features = analyze_page(page, get_text_dict(page))
+    assert features["chars"] == len(BODY.replace(" ", "")) + BODY.count(" ")
+    assert features["small_font_size"] == 10
+    assert features["image_coverage"] == 0
+    assert classify_page(features, _policy()) == ROUTE_TEXT
+
+
+def test_page_to_markdown_heading_and_body():
+    page = fitz.open().new_page()
+    page.insert_text((72, 72), "Report Title", fontsize=20)
+    for index in range(3):
+        page.insert_text((72, 120 + index * 40), BODY, fontsize=10)
+    markdown = text_dict_to_markdown(page, get_text_dict(page))
+    assert markdown.startswith("\n## Report Title\n")
+    assert markdown.count(BODY) == 3
+
+
+def test_two_column_reading_order():
+    page = fitz.open().new_page()
+    # 右栏的段落位于左栏两段之间，按栏输出时仍在左栏之后
+    page.insert_text((72, 100), "left column", fontsize=10)
+    page.insert_text((320, 150), "right column", fontsize=10)
+    page.insert_text((72, 200), "left continues", fontsize=10)
+    markdown = text_dict_to_markdown(page, get_text_dict(page))
+    assert markdown.index("left column") < markdown.index("left continues") < markdown.index("right column")
+
+
+def _block(*texts: str, size: float = 10, flags: int = 0, x0: list = None, y0: list = None) -> dict:
+    """
+    :param texts: 每行的文本
+    :param x0: 每行的左边界，默认都是 72
+    :param y0: 每行的上边界，默认行高 10、行间距 2
+    """
+    lines = []
+    for index, text in enumerate(texts):
+        x = x0[index] if x0 else 72
+        y = y0[index] if y0 else 100 + index * 12
+        lines.append({"bbox": (x, y, 300, y + 10), "spans": [{"text": text, "size": size, "flags": flags}]})
+    return {"bbox": (72, lines[0]["bbox"][1], 300, lines[-1]["bbox"][3]), "lines": lines}
+
+
+def test_bullets():
+    assert _block_to_markdown(_block("• 第一项", "●第二项", "- 第三项", "* 第四项", "– 第五项"), 10, []) == [
+        "- 第一项", "- 第二项", "- 第三项", "- 第四项", "- 第五项",
+    ]
+
+
+def test_signs_without_space_are_not_bullets():
+    for text in ("-5% growth", "*note", "–0.3", "-0.25"):
+        assert _block_to_markdown(_block(text), 10, []) == [text]
+
+
+def test_numbered_items():
+    assert _block_to_markdown(_block("1. 第一", "2) 第二", "3、 第三"), 10, []) == ["1. 第一", "2. 第二", "3. 第三"]
+
+
+def test_letter_prefix_is_not_numbered():
+    assert _block_to_markdown(_block("A. Smith"), 10, []) == ["A. Smith"]
+    assert _block_to_markdown(_block("B) 条款"), 10, []) == ["B) 条款"]
+
+
+def test_indented_line_continues_item():
+    block = _block("• first item that", "wraps onto the next line", x0=[72, 82])
+    assert _block_to_markdown(block, 10, []) == ["- first item that wraps onto the next line"]
+
+
+def test_paragraph_after_list_at_left_margin():
+    block = _block("• 第一项", "• 第二项", "列表之后的段落", "段落第二行", x0=[72, 72, 72, 72])
+    assert _block_to_markdown(block, 10, []) == ["- 第一项", "- 第二项", "列表之后的段落段落第二行"]
+
+
+def test_paragraph_after_list_gap():
+    block = _block("1. item", "indented after a gap", x0=[72, 82], y0=[100, 120])
+    assert _block_to_markdown(block, 10, []) == ["1. item", "indented after a gap"]
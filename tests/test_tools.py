@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+from config.config import settings
+from core.tools import MarkdownNormalizer, iter_md, iter_str, normalize_stream
+
+
+async def _collect(chunks) -> str:
+    return b"".join([chunk async for chunk in chunks]).decode("utf-8")
+
+
+def _normalize(chunks: list[str], unescape: bool = True) -> str:
+    normalizer = MarkdownNormalizer(unescape)
+    return "".join(normalizer.feed(chunk) for chunk in chunks) + normalizer.close()
+
+
+def test_unescape_literal_newlines():
+    assert _normalize(["```markdown# 标题\\n正文\\r\\n结尾```"]) == f"# 标题{os.linesep}正文{os.linesep}结尾"
+
+
+def test_chunk_boundaries_match_whole_string():
+    text = "```markdown第一行\\n第二行\\r\\n```代码```\\n末尾```"
+    expected = _normalize([text])
+    for size in range(1, len(text) + 1):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert _normalize(chunks) == expected, size
+
+
+def test_opening_fence_only():
+    assert _normalize(["```mark", "down"]) == ""
+    assert _normalize(["```"]) == ""
+
+
+def test_keep_escapes_when_disabled():
+    text = "```markdown$\\nabla f \\neq 0$\\r\\n```"
+    assert _normalize([text[i:i + 3] for i in range(0, len(text), 3)], unescape=False) == "$\\nabla f \\neq 0$\\r\\n"
+
+
+def test_saved_result_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    content = "# 公式\n\n$\\nabla f \\neq 0$\n\n路径 C:\\new\\name\\r\\n\n```python\nprint('\\n')\n```\n"
+    result_dir = tmp_path / "u1" / "result"
+    result_dir.mkdir(parents=True)
+    (result_dir / "doc.md").write_text(content, encoding="utf-8")
+
+    async def download(chunk_size: int) -> str:
+        return await _collect(normalize_stream(await iter_md("doc", "u1", chunk_size), unescape=False))
+
+    for chunk_size in (1, 2, 7, 64 * 1024):
+        assert asyncio.run(download(chunk_size)) == content
+
+
+def test_query_string_still_unescaped():
+    assert asyncio.run(_collect(normalize_stream(iter_str("a\\nb")))) == f"a{os.linesep}b"